@@ -0,0 +1,257 @@
+"""
+Batch runs: many topics and/or documents through the pipeline at once.
+
+A batch fans its items out over a thread pool of its own, at most
+`concurrency` items at a time (the crew pool bounds the crews actually in
+use). Each finished item is appended as one JSON line to the batch's NDJSON
+file under the state directory and handed to any client streaming the
+batch, so results arrive as they complete instead of when the batch ends.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from test_gemini.jobs import CANCELLED, FAILED, FINISHED_STATES, QUEUED, RUNNING, SUCCEEDED
+from test_gemini.run_files import inline_result
+from test_gemini.settings import env_int, state_path
+
+logger = logging.getLogger(__name__)
+
+
+class BatchItem:
+    """One topic or document of a batch and its outcome."""
+
+    def __init__(self, index, topic=None, document_id=None, current_year=None):
+        self.index = index
+        self.topic = topic
+        self.document_id = document_id
+        self.current_year = current_year
+        self.status = QUEUED
+        self.message = None
+        self.meta = {}
+        self.result = None
+        self.started_at = None
+        self.seconds = None
+
+    def to_dict(self, include_result=False):
+        data = {
+            "index": self.index,
+            "topic": self.meta.get('topic', self.topic),
+            "document_id": self.document_id,
+            "status": self.status,
+            "message": self.message,
+            "run_id": self.meta.get('run_id'),
+            "cache": self.meta.get('cache'),
+            "seconds": self.seconds,
+            "result_file": self.meta.get('result_file')
+        }
+        data = {name: value for name, value in data.items() if value is not None}
+        result = inline_result(self.result, self.meta) if include_result else None
+        if result is not None:
+            data["result"] = result
+        return data
+
+
+class Batch:
+    """A set of items run with bounded concurrency, results kept as NDJSON."""
+
+    def __init__(self, kind, items, runner, concurrency, run_kwargs=None, directory=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.items = items
+        self.runner = runner
+        self.concurrency = concurrency
+        self.run_kwargs = run_kwargs or {}
+        self.created_at = datetime.now()
+        self.finished_at = None
+        self.results_path = os.path.join(directory, f"{self.id}.ndjson") if directory else None
+        self._lines = []
+        self._condition = threading.Condition()
+        self._executor = None
+        self._futures = []
+
+    @property
+    def finished(self):
+        return all(item.status in FINISHED_STATES for item in self.items)
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=f"batch-{self.id[:8]}")
+        self._futures = [self._executor.submit(self._run_item, item) for item in self.items]
+        self._executor.shutdown(wait=False)
+
+    def cancel(self):
+        """Cancel the items that have not started. Returns how many were cancelled."""
+        cancelled = 0
+        for item, future in zip(self.items, self._futures):
+            if future.cancel():
+                self._finish(item, CANCELLED, "Cancelled before execution")
+                cancelled += 1
+        return cancelled
+
+    def _run_item(self, item):
+        item.status = RUNNING
+        item.started_at = time.perf_counter()
+        try:
+            success, message, result = self.runner(
+                item.topic,
+                item.current_year,
+                meta=item.meta,
+                document_id=item.document_id,
+                **self.run_kwargs
+            )
+            item.result = result
+            self._finish(item, SUCCEEDED if success else FAILED, message)
+        except Exception as e:
+            logger.error(f"Batch {self.id} item {item.index} failed: {str(e)}")
+            self._finish(item, FAILED, f"Error: {str(e)}")
+
+    def _finish(self, item, status, message):
+        if item.started_at is not None:
+            item.seconds = round(time.perf_counter() - item.started_at, 3)
+        item.message = message
+        with self._condition:
+            item.status = status
+            line = json.dumps(item.to_dict(include_result=True), default=str)
+            self._lines.append(line)
+            if self.results_path:
+                try:
+                    with open(self.results_path, 'a', encoding='utf-8') as handle:
+                        handle.write(line + '\n')
+                except OSError as e:
+                    logger.warning(f"Could not write batch {self.id} results: {str(e)}")
+            if self.finished:
+                self.finished_at = datetime.now()
+            self._condition.notify_all()
+
+    def iter_lines(self, timeout=None):
+        """
+        Yield NDJSON lines as items finish (starting with those already
+        finished), then a summary line once the batch is done. timeout is
+        the keep-alive interval: an empty line is yielded when nothing
+        finished within it.
+        """
+        position = 0
+        while True:
+            with self._condition:
+                while position >= len(self._lines) and not self.finished:
+                    if not self._condition.wait(timeout):
+                        break
+                lines = self._lines[position:]
+                done = self.finished and position + len(lines) >= len(self._lines)
+            if not lines and not done:
+                yield '\n'
+                continue
+            for line in lines:
+                yield line + '\n'
+            position += len(lines)
+            if done:
+                yield json.dumps({"batch": self.to_dict()}, default=str) + '\n'
+                return
+
+    def to_dict(self, include_items=False):
+        counts = {}
+        for item in self.items:
+            counts[item.status] = counts.get(item.status, 0) + 1
+        data = {
+            "batch_id": self.id,
+            "kind": self.kind,
+            "status": "finished" if self.finished else "running",
+            "concurrency": self.concurrency,
+            "total": len(self.items),
+            "counts": counts,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "elapsed_seconds": round(((self.finished_at or datetime.now()) - self.created_at).total_seconds(), 3)
+        }
+        if include_items:
+            data["items"] = [item.to_dict() for item in self.items]
+        return data
+
+
+class BatchManager:
+    """Registry of recent batches."""
+
+    def __init__(self, directory, max_concurrency=8, history_limit=100, ttl_seconds=7 * 24 * 3600):
+        self.directory = directory
+        self.max_concurrency = max(1, max_concurrency)
+        self.history_limit = max(1, history_limit)
+        self.ttl_seconds = ttl_seconds
+        self._batches = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def submit(self, kind, items, runner, concurrency=None, run_kwargs=None):
+        """
+        Start a batch. items are dicts with 'topic' and/or 'document_id'
+        (and optionally 'current_year'); runner has the run_* signature.
+        """
+        concurrency = max(1, min(concurrency or self.max_concurrency, self.max_concurrency, len(items)))
+        batch = Batch(
+            kind,
+            [BatchItem(index, item.get('topic'), item.get('document_id'), item.get('current_year')) for index, item in enumerate(items)],
+            runner,
+            concurrency,
+            run_kwargs=run_kwargs,
+            directory=self.directory
+        )
+        with self._lock:
+            self._batches[batch.id] = batch
+            while len(self._batches) > self.history_limit:
+                oldest_id, oldest = next(iter(self._batches.items()))
+                if not oldest.finished:
+                    break
+                self._batches.pop(oldest_id)
+        self._remove_expired_results()
+        batch.start()
+        logger.info(f"Started {kind} batch {batch.id} with {len(items)} items, {concurrency} at a time")
+        return batch
+
+    def get(self, batch_id):
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def results_path(self, batch_id):
+        """Path of a batch's NDJSON results, also for batches no longer in memory."""
+        batch = self.get(batch_id)
+        if batch is not None:
+            return batch.results_path
+        if not batch_id.isalnum():
+            return None
+        path = os.path.join(self.directory, f"{batch_id}.ndjson")
+        return path if os.path.exists(path) else None
+
+    def _remove_expired_results(self):
+        if not self.ttl_seconds:
+            return
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if name.endswith('.ndjson') and now - os.path.getmtime(path) > self.ttl_seconds:
+                    os.remove(path)
+            except OSError:
+                continue
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_batch_manager():
+    """Return the process-wide BatchManager configured from the environment."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = BatchManager(
+                directory=os.environ.get('BATCH_DIR') or state_path('batches'),
+                max_concurrency=env_int('BATCH_MAX_CONCURRENCY', 8),
+                history_limit=env_int('BATCH_HISTORY_LIMIT', 100),
+                ttl_seconds=env_int('BATCH_RESULTS_TTL', 7 * 24 * 3600)
+            )
+        return _manager
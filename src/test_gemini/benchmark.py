@@ -0,0 +1,291 @@
+"""
+Offline load and throughput benchmark.
+
+The agents' LLM is replaced by FakeLLM (through the llm.py factory). FakeLLM
+is local and deterministic, with a fixed latency per call and a fixed
+output size. The benchmark drives these targets:
+- run_crew_pipeline;
+- the per-agent run_* functions;
+- the Flask routes, through the test client.
+
+Each target runs at increasing concurrency. The report gives throughput,
+p50/p95/p99 latency and peak RSS per level, plus the share of latency spent
+outside the (fake) model. No network or API key is needed: state goes to a
+temporary directory, caches are bypassed and telemetry is disabled.
+
+    benchmark --concurrency 1,2,4,8 --requests 16 --latency 0.05 > bench.json
+    benchmark --baseline bench.json      # exit 1 on a regression
+
+Measured levels are capped by the crew pool: set CREW_POOL_SIZE to the
+highest concurrency to measure more than the pool's throughput.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import math
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+TARGETS = ('pipeline', 'agents', 'routes')
+
+# Agent stage -> (run_* function name, route)
+_AGENT_STAGES = {
+    'requirements': ('run_requirements_analyst', '/requirements'),
+    'test-design': ('run_test_case_designer', '/test-design'),
+    'test-implementation': ('run_test_implementer', '/test-implementation'),
+}
+
+
+def _offline_environment(state_dir):
+    """Keep every component local: temporary state, no telemetry, no remote model cost map."""
+    os.environ['TEST_GEMINI_STATE_DIR'] = state_dir
+    os.environ.setdefault('CREW_POOL_PREWARM', '0')
+    os.environ['CREWAI_DISABLE_TELEMETRY'] = 'true'
+    os.environ['OTEL_SDK_DISABLED'] = 'true'
+    os.environ['LITELLM_LOCAL_MODEL_COST_MAP'] = 'True'
+    os.environ['LLM_STREAM'] = 'false'
+    # Measure the model path itself, not recorded completions
+    os.environ['LLM_CACHE_MODE'] = 'passthrough'
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of values (0 < fraction <= 1)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm', 'r') as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _RSSSampler:
+    """Peak resident set size while the block runs, sampled every interval seconds."""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.peak = _rss_bytes()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss_bytes())
+
+
+class Benchmark:
+    """Drives one target at a given concurrency and summarizes the calls."""
+
+    def __init__(self, latency=0.05, output_chars=2000):
+        from test_gemini.fake_llm import FakeLLM
+        from test_gemini.llm import set_llm_factory
+
+        self.latency = latency
+        self.output_chars = output_chars
+        self.llms = []
+        self._llms_lock = threading.Lock()
+
+        def factory(agent_name):
+            llm = FakeLLM(agent_name, latency=latency, output_chars=output_chars)
+            with self._llms_lock:
+                self.llms.append(llm)
+            return llm
+
+        set_llm_factory(factory)
+        self._client = None
+
+    def llm_totals(self):
+        with self._llms_lock:
+            return sum(llm.calls for llm in self.llms), sum(llm.seconds for llm in self.llms)
+
+    def client(self):
+        if self._client is None:
+            from test_gemini.main import create_app
+            self._client = create_app().test_client()
+        return self._client
+
+    def call(self, target):
+        """One request of the target; returns True on success."""
+        from test_gemini import main
+
+        topic = f"benchmark {uuid.uuid4().hex[:12]}"
+        if target == 'pipeline':
+            return main.run_crew_pipeline(topic, use_cache=False)[0]
+        if target == 'agents':
+            success = True
+            run_id = None
+            for stage, (function, _) in _AGENT_STAGES.items():
+                meta = {}
+                ok, _, _ = getattr(main, function)(None if run_id else topic, use_cache=False, meta=meta, run_id=run_id)
+                success, run_id = success and ok, meta.get('run_id')
+            return success
+        if target == 'routes':
+            response = self.client().post('/run', json={'topic': topic, 'no_cache': True})
+            return response.status_code == 200
+        raise ValueError(f"Unknown target: {target}")
+
+    def measure(self, target, concurrency, requests):
+        calls_before, llm_before = self.llm_totals()
+        latencies = []
+        errors = 0
+        # Exception class name (or "unsuccessful" for a failed result) -> count
+        error_types = {}
+        lock = threading.Lock()
+
+        def timed():
+            nonlocal errors
+            started = time.perf_counter()
+            error, first = None, False
+            try:
+                ok = self.call(target)
+            except Exception as e:
+                ok, error = False, e
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors += 1
+                    kind = type(error).__name__ if error is not None else 'unsuccessful'
+                    error_types[kind] = error_types.get(kind, 0) + 1
+                    first = error_types[kind] == 1
+            if not ok and first:
+                if error is not None:
+                    logger.warning(f"{target} request failed: {kind}: {str(error)}", exc_info=error)
+                else:
+                    logger.warning(f"{target} request was unsuccessful")
+
+        with _RSSSampler() as rss:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                for _ in range(requests):
+                    executor.submit(timed)
+            wall = time.perf_counter() - started
+
+        calls_after, llm_after = self.llm_totals()
+        mean = sum(latencies) / len(latencies)
+        llm_per_request = (llm_after - llm_before) / len(latencies)
+        return {
+            "concurrency": concurrency,
+            "requests": requests,
+            "errors": errors,
+            "error_types": error_types,
+            "seconds": round(wall, 3),
+            "throughput_rps": round(requests / wall, 3),
+            "latency_ms": {
+                "p50": round(percentile(latencies, 0.50) * 1000, 1),
+                "p95": round(percentile(latencies, 0.95) * 1000, 1),
+                "p99": round(percentile(latencies, 0.99) * 1000, 1),
+                "mean": round(mean * 1000, 1)
+            },
+            "llm_calls_per_request": round((calls_after - calls_before) / len(latencies), 2),
+            "llm_ms_per_request": round(llm_per_request * 1000, 1),
+            "framework_ms_per_request": round((mean - llm_per_request) * 1000, 1),
+            "peak_rss_mb": round(rss.peak / (1024 * 1024), 1)
+        }
+
+
+def run_benchmark(targets=TARGETS, levels=(1, 2, 4, 8), requests=16, latency=0.05, output_chars=2000, warmup=1):
+    """Report for each target at each concurrency level."""
+    bench = Benchmark(latency=latency, output_chars=output_chars)
+    report = {
+        "python": sys.version.split()[0],
+        "llm": {"latency_seconds": latency, "output_chars": output_chars},
+        "crew_pool_size": None,
+        "targets": {}
+    }
+    # crewai's verbose agent output goes to stdout, which carries the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        from test_gemini.crew_pool import get_crew_pool
+        report["crew_pool_size"] = get_crew_pool().size
+        for target in targets:
+            for _ in range(warmup):
+                bench.call(target)
+            report["targets"][target] = [bench.measure(target, level, max(requests, level)) for level in levels]
+    report["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return report
+
+
+def regressions(report, baseline, tolerance=0.2):
+    """Levels whose p95 latency grew, or throughput fell, by more than tolerance against baseline."""
+    found = []
+    for target, levels in report['targets'].items():
+        previous = {level['concurrency']: level for level in baseline.get('targets', {}).get(target, [])}
+        for level in levels:
+            before = previous.get(level['concurrency'])
+            if not before:
+                continue
+            name = f"{target}@{level['concurrency']}"
+            if level['errors'] > before.get('errors', 0):
+                found.append(f"{name}: {level['errors']} errors (baseline {before.get('errors', 0)})")
+            if level['latency_ms']['p95'] > before['latency_ms']['p95'] * (1 + tolerance):
+                found.append(f"{name}: p95 {level['latency_ms']['p95']} ms (baseline {before['latency_ms']['p95']} ms)")
+            if level['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+                found.append(f"{name}: {level['throughput_rps']} req/s (baseline {before['throughput_rps']} req/s)")
+    return found
+
+
+def main():
+    """
+    Print the benchmark report as JSON; exit 1 when --baseline shows a regression.
+    Usage: benchmark [--targets pipeline,agents,routes] [--concurrency 1,2,4,8] [--requests 16]
+                     [--latency 0.05] [--output-chars 2000] [--baseline report.json] [--tolerance 0.2]
+    """
+    parser = argparse.ArgumentParser(prog='benchmark', description="Offline throughput benchmark with a fake LLM")
+    parser.add_argument('--targets', default=','.join(TARGETS), help="comma-separated: pipeline, agents, routes")
+    parser.add_argument('--concurrency', default='1,2,4,8', help="comma-separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=16, help="requests per level (at least the concurrency)")
+    parser.add_argument('--latency', type=float, default=0.05, help="fake LLM seconds per call")
+    parser.add_argument('--output-chars', type=int, default=2000, help="fake LLM answer size")
+    parser.add_argument('--warmup', type=int, default=1, help="unmeasured requests per target first")
+    parser.add_argument('--baseline', help="earlier report to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative p95/throughput change")
+    args = parser.parse_args()
+
+    targets = [target.strip() for target in args.targets.split(',') if target.strip()]
+    unknown = sorted(set(targets) - set(TARGETS))
+    if unknown:
+        parser.error(f"Unknown targets: {', '.join(unknown)} (known: {', '.join(TARGETS)})")
+    try:
+        levels = [max(1, int(level)) for level in args.concurrency.split(',') if level.strip()]
+    except ValueError:
+        parser.error("--concurrency must be comma-separated integers")
+
+    _offline_environment(tempfile.mkdtemp(prefix='test_gemini_bench_'))
+    logging.basicConfig(level=logging.WARNING, force=True)
+
+    report = run_benchmark(targets, levels, args.requests, args.latency, args.output_chars, args.warmup)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as handle:
+            report['regressions'] = regressions(report, json.load(handle), args.tolerance)
+    print(json.dumps(report, indent=2))
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""
+Content-addressed result cache for pipeline stages.
+
+A stage result is keyed by the SHA-256 of the stage name, the normalized
+inputs, the agents.yaml/tasks.yaml contents and the model identity, so
+editing the prompts or switching models never serves stale output. Lookups
+go through an in-memory LRU tier first and a size/TTL-bounded disk tier
+second.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from test_gemini.settings import env_bool, env_int, state_path
+from test_gemini.storage import DiskStore
+
+logger = logging.getLogger(__name__)
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), 'config')
+CONFIG_FILES = ('agents.yaml', 'tasks.yaml')
+
+
+def normalize_text(value):
+    """Collapse whitespace so trivially different inputs share a cache entry."""
+    return re.sub(r'\s+', ' ', str(value)).strip()
+
+
+def config_fingerprint():
+    """Hash of the agent/task YAML files the crew is built from."""
+    digest = hashlib.sha256()
+    for name in CONFIG_FILES:
+        path = os.path.join(CONFIG_DIR, name)
+        digest.update(name.encode())
+        try:
+            with open(path, 'rb') as handle:
+                digest.update(handle.read())
+        except FileNotFoundError:
+            digest.update(b'<missing>')
+    return digest.hexdigest()
+
+
+def model_identity():
+    """The model the agents run on, as crewai resolves it from the environment."""
+    return (
+        os.environ.get('STAGE_CACHE_MODEL_ID')
+        or os.environ.get('MODEL')
+        or os.environ.get('OPENAI_MODEL_NAME')
+        or 'crewai-default'
+    )
+
+
+class StageCache:
+    """Two-tier (memory LRU + disk) cache with per-stage hit/miss counters."""
+
+    def __init__(self, directory, memory_items=256, max_bytes=256 * 1024 * 1024, ttl_seconds=7 * 24 * 3600, enabled=True):
+        self.enabled = enabled
+        self.memory_items = max(0, memory_items)
+        self.ttl_seconds = ttl_seconds
+        self.disk = DiskStore(directory, max_bytes=max_bytes, ttl_seconds=ttl_seconds)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._fingerprint = config_fingerprint()
+
+    def key(self, stage, inputs):
+        """Cache key for a stage run with the given inputs."""
+        normalized = {name: normalize_text(value) for name, value in sorted(inputs.items())}
+        material = json.dumps({
+            "stage": stage,
+            "inputs": normalized,
+            "config": self._fingerprint,
+            "model": model_identity()
+        }, sort_keys=True)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, stage, key):
+        """Return the cached result for key, or None (counting the outcome)."""
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if not self.ttl_seconds or now - stored_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._count(stage, 'hits_memory')
+                    return value
+                del self._memory[key]
+
+        record = self.disk.get(key)
+        if record is not None:
+            self._remember(key, record['stored_at'], record['value'])
+            with self._lock:
+                self._count(stage, 'hits_disk')
+            return record['value']
+
+        with self._lock:
+            self._count(stage, 'misses')
+        return None
+
+    def put(self, stage, key, value):
+        if not self.enabled or value is None:
+            return
+        stored_at = time.time()
+        self._remember(key, stored_at, value)
+        try:
+            self.disk.put(key, {"stage": stage, "stored_at": stored_at, "value": value})
+        except OSError as e:
+            logger.warning(f"Could not persist {stage} cache entry: {str(e)}")
+        with self._lock:
+            self._count(stage, 'stores')
+
+    def record_bypass(self, stage):
+        with self._lock:
+            self._count(stage, 'bypasses')
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        self.disk.clear()
+
+    def stats(self):
+        with self._lock:
+            by_stage = {stage: dict(counters) for stage, counters in self._counters.items()}
+            memory_entries = len(self._memory)
+        totals = {}
+        for counters in by_stage.values():
+            for name, value in counters.items():
+                totals[name] = totals.get(name, 0) + value
+        hits = totals.get('hits_memory', 0) + totals.get('hits_disk', 0)
+        lookups = hits + totals.get('misses', 0)
+        return {
+            "enabled": self.enabled,
+            "memory_entries": memory_entries,
+            "disk_bytes": self.disk.size_bytes(),
+            "totals": totals,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "by_stage": by_stage
+        }
+
+    def _remember(self, key, stored_at, value):
+        if not self.memory_items:
+            return
+        with self._lock:
+            self._memory[key] = (stored_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _count(self, stage, name):
+        counters = self._counters.setdefault(stage, {})
+        counters[name] = counters.get(name, 0) + 1
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_stage_cache():
+    """Return the process-wide StageCache configured from the environment."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = StageCache(
+                directory=os.environ.get('STAGE_CACHE_DIR') or state_path('stage_cache'),
+                memory_items=env_int('STAGE_CACHE_MEMORY_ITEMS', 256),
+                max_bytes=env_int('STAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024),
+                ttl_seconds=env_int('STAGE_CACHE_TTL', 7 * 24 * 3600),
+                enabled=env_bool('STAGE_CACHE_ENABLED', True)
+            )
+        return _cache
@@ -0,0 +1,290 @@
+"""
+Parallel test case design, one subtask per requirement category.
+
+test_case_design_task designs the tests for all seven requirement
+categories in one long generation, although the categories are
+independent. Here the requirements document is split by category (see
+mapreduce.parse_requirements), every requirement gets an ID, and the
+test_case_designer designs each category's test cases concurrently on
+pooled crews. The category designs are merged into one test case document
+with a single coverage matrix that maps every requirement ID to the test
+cases that reference it.
+"""
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from test_gemini.cache import get_stage_cache
+from test_gemini.crew_pool import get_crew_pool
+from test_gemini.revisions import bind_revision, current_revision, reuse_or_generate
+from test_gemini.mapreduce import (
+    OTHER_CATEGORY, REQUIREMENT_CATEGORIES, parse_requirements, requirement_id, strip_requirement_id
+)
+from test_gemini.settings import env_bool, env_int
+from test_gemini.stages import execute_stage
+from test_gemini.streaming import bind_stream, current_stream, publish
+
+logger = logging.getLogger(__name__)
+
+# Requirement and test case ID prefix per category
+CATEGORY_PREFIXES = {
+    'Functional Requirements': 'FR',
+    'Interface Requirements': 'IF',
+    'Performance Requirements': 'PR',
+    'Error Handling Requirements': 'EH',
+    'Hardware Requirements': 'HW',
+    'Safety Requirements': 'SF',
+    'Power Management Requirements': 'PM',
+    OTHER_CATEGORY: 'OT',
+}
+
+TEST_CASE_ID = re.compile(r'\bTC[-_]?(?:[A-Z]{2}[-_]?)?\d+(?:\.\d+)*\b')
+_UNQUALIFIED_TEST_CASE_ID = re.compile(r'\bTC[-_]?(\d+(?:\.\d+)*)\b')
+_HEADING = re.compile(r'^(#{1,6})\s+(.*)$')
+# A line that introduces a test case: heading, list item or bold label led by its ID
+_TEST_CASE_START = re.compile(r'^\s*(?:#{1,6}\s*|[-*+]\s+|\d+[.)]\s+)?[*_`\[]*(?:Test Case(?: ID)?\s*:?\s*)?[*_`]*TC[-_]?', re.IGNORECASE)
+
+
+def should_parallelize(parallel=None):
+    """Whether test design runs per category: an explicit request wins, else TEST_DESIGN_PARALLEL."""
+    if parallel is not None:
+        return bool(parallel)
+    return env_bool('TEST_DESIGN_PARALLEL', True)
+
+
+def identify_requirements(categorized):
+    """
+    [(category, [(requirement_id, text), ...]), ...] in document category
+    order. Requirements that carry no ID get <PREFIX>-NNN (e.g. SF-003);
+    an ID that repeats is made unique with a suffix.
+    """
+    identified = []
+    seen = set()
+    for category in [name for name, _ in REQUIREMENT_CATEGORIES] + [OTHER_CATEGORY]:
+        requirements = categorized.get(category)
+        if not requirements:
+            continue
+        prefix = CATEGORY_PREFIXES[category]
+        entries = []
+        for number, requirement in enumerate(requirements, start=1):
+            rid = requirement_id(requirement) or f"{prefix}-{number:03d}"
+            base, suffix = rid, 2
+            while rid in seen:
+                rid, suffix = f"{base}-{suffix}", suffix + 1
+            seen.add(rid)
+            entries.append((rid, strip_requirement_id(requirement)))
+        identified.append((category, entries))
+    return identified
+
+
+def render_category_requirements(category, requirements):
+    """One category's requirements, each led by its ID."""
+    lines = [f"## {category}", '']
+    for rid, text in requirements:
+        first, *rest = text.splitlines() or ['']
+        lines.append(f"- {rid}: {first}")
+        lines.extend(f"  {line.strip()}" for line in rest)
+    return '\n'.join(lines) + '\n'
+
+
+def _category_context(category, requirements):
+    """Task context for one category's subtask: the focus note and its requirements."""
+    prefix = CATEGORY_PREFIXES[category]
+    return (
+        f"Design test cases for the {category} below only; the other requirement categories are designed separately. "
+        f"Give every test case an ID of the form TC-{prefix}-NNN and name the requirement IDs it verifies. "
+        "Leave out the coverage matrix; one is built for all categories.\n\n"
+        + render_category_requirements(category, requirements)
+    )
+
+
+def qualify_test_case_ids(text, prefix):
+    """Rewrite bare test case IDs (TC-001) as TC-<prefix>-001 so IDs stay unique across categories."""
+    return _UNQUALIFIED_TEST_CASE_ID.sub(lambda match: f"TC-{prefix}-{match.group(1)}", text)
+
+
+def _without_coverage_matrix(text):
+    """Drop sections whose heading names a coverage/traceability matrix; the merged document has its own."""
+    kept = []
+    skip_level = None
+    for line in text.splitlines():
+        heading = _HEADING.match(line.strip())
+        if heading:
+            level = len(heading.group(1))
+            if skip_level is not None and level <= skip_level:
+                skip_level = None
+            if skip_level is None and re.search(r'\b(?:coverage|traceability)\b', heading.group(2), re.IGNORECASE):
+                skip_level = level
+                continue
+        if skip_level is None:
+            kept.append(line)
+    return '\n'.join(kept).strip()
+
+
+def _nest_headings(text, top=3):
+    """Shift Markdown headings so the shallowest is level top, nesting a category design under its section."""
+    levels = [len(match.group(1)) for match in re.finditer(r'^(#{1,6})\s', text, flags=re.MULTILINE)]
+    if not levels:
+        return text
+    shift = top - min(levels)
+    return re.sub(r'^(#{1,6})(?=\s)', lambda match: '#' * max(1, min(6, len(match.group(1)) + shift)), text, flags=re.MULTILINE)
+
+
+def coverage_matrix(designs, identified):
+    """
+    Map each requirement ID to the test cases that reference it:
+    [(requirement_id, category, [test_case_id, ...]), ...] in requirement
+    order. A requirement ID mentioned on a line naming test cases (e.g. a
+    table row) is covered by those, otherwise by the test case whose block
+    (from the line that introduces it to the next one) it appears in.
+    """
+    ids = [rid for _, requirements in identified for rid, _ in requirements]
+    covered = {rid: [] for rid in ids}
+    if ids:
+        mention = re.compile(r'(?<![\w-])(' + '|'.join(re.escape(rid) for rid in sorted(ids, key=len, reverse=True)) + r')(?![\w-])')
+        for category, _ in identified:
+            current = None
+            for line in (designs.get(category) or '').splitlines():
+                test_case = TEST_CASE_ID.search(line)
+                if test_case and _TEST_CASE_START.match(line):
+                    current = test_case.group()
+                # A table row or line naming test cases belongs to them
+                owners = TEST_CASE_ID.findall(line) or ([current] if current else [])
+                for match in mention.finditer(line):
+                    for owner in owners:
+                        if owner not in covered[match.group(1)]:
+                            covered[match.group(1)].append(owner)
+    return [(rid, category, covered[rid]) for category, requirements in identified for rid, _ in requirements]
+
+
+def test_case_sections(design):
+    """
+    Split a test case document into [(section, preamble, [(test_case_id,
+    block), ...]), ...]: one entry per level-2 section (None for text before
+    the first), with its text before the first test case and its test case
+    blocks. Coverage and traceability sections are left out.
+    """
+    sections = [[None, [], []]]
+    for line in _without_coverage_matrix(design or '').splitlines():
+        heading = _HEADING.match(line.strip())
+        if heading and len(heading.group(1)) <= 2 and not TEST_CASE_ID.search(line):
+            # Level 1 is the document title
+            if len(heading.group(1)) == 2:
+                sections.append([heading.group(2).strip().strip('*').strip(), [], []])
+            continue
+        section = sections[-1]
+        test_case = TEST_CASE_ID.search(line)
+        if test_case and _TEST_CASE_START.match(line):
+            section[2].append([test_case.group(), [line]])
+        elif section[2]:
+            section[2][-1][1].append(line)
+        else:
+            section[1].append(line)
+    return [
+        (title, '\n'.join(preamble).strip(), [(test_case_id, '\n'.join(block).strip()) for test_case_id, block in blocks])
+        for title, preamble, blocks in sections
+        if title is not None or blocks or '\n'.join(preamble).strip()
+    ]
+
+
+def render_test_design(designs, identified, topic_label=None):
+    """Merge the category designs into one test case document with a unified coverage matrix."""
+    title = f"# Test Case Document: {topic_label}" if topic_label else "# Test Case Document"
+    lines = [title, '']
+    for category, _ in identified:
+        design = _without_coverage_matrix(designs.get(category) or '')
+        lines.append(f"## {category.replace('Requirements', 'Test Cases')}")
+        lines.append('')
+        lines.append(_nest_headings(design))
+        lines.append('')
+
+    matrix = coverage_matrix(designs, identified)
+    uncovered = [rid for rid, _, test_cases in matrix if not test_cases]
+    lines.append('## Coverage Matrix')
+    lines.append('')
+    lines.append('| Requirement | Category | Test Cases |')
+    lines.append('| --- | --- | --- |')
+    for rid, category, test_cases in matrix:
+        lines.append(f"| {rid} | {category} | {', '.join(test_cases) if test_cases else 'NOT COVERED'} |")
+    lines.append('')
+    lines.append(f"Coverage: {len(matrix) - len(uncovered)} of {len(matrix)} requirements have at least one test case.")
+    return '\n'.join(lines).strip() + '\n', matrix
+
+
+def design_category(category, requirements, inputs, use_cache, tools=None, stream=None, revision=None):
+    """The test cases of one category's requirements, on the caller's stream and revision. Returns (design, cached)."""
+    with bind_stream(stream), bind_revision(revision):
+        result, cached = _design_category_cached(category, requirements, inputs, use_cache, tools)
+        publish('category_completed', stage='test-design', category=category, cached=cached)
+    return result, cached
+
+
+def _design_category_cached(category, requirements, inputs, use_cache, tools):
+    cache = get_stage_cache()
+    context = _category_context(category, requirements)
+    key = cache.key('test-design-category', dict(inputs, context=context, tools=bool(tools)))
+
+    def generate():
+        if use_cache:
+            cached = cache.get('test-design-category', key)
+            if cached is not None:
+                return cached, True
+        else:
+            cache.record_bypass('test-design-category')
+
+        started = time.perf_counter()
+        result = qualify_test_case_ids(execute_stage('test-design', inputs, context, tools=tools), CATEGORY_PREFIXES[category])
+        cache.put('test-design-category', key, result)
+        logger.info(f"Test cases for {category} designed in {time.perf_counter() - started:.1f}s")
+        return result, False
+
+    return reuse_or_generate('test-design-category', key, generate)
+
+
+def design_test_cases(requirements, inputs, use_cache=True, stats=None, tools=None, parallel=None):
+    """
+    The test design stage for a requirements document. With parallel design
+    enabled and requirements in at least two categories, each category is
+    designed by its own subtask, up to TEST_DESIGN_CONCURRENCY at once (each
+    on its own pooled crew), and the designs are merged with one coverage
+    matrix. Otherwise the whole document goes to a single
+    test_case_design_task as before. stats (a dict) receives the split,
+    coverage and timings.
+    """
+    stats = stats if stats is not None else {}
+    identified = identify_requirements(parse_requirements(requirements)) if should_parallelize(parallel) else []
+    if len(identified) < 2:
+        stats.update({"parallel": False, "categories": len(identified)})
+        return execute_stage('test-design', inputs, requirements, tools=tools)
+
+    concurrency = max(1, min(
+        env_int('TEST_DESIGN_CONCURRENCY', 7),
+        get_crew_pool().size,
+        len(identified)
+    ))
+    logger.info(f"Designing test cases for {len(identified)} requirement categories, {concurrency} at a time")
+    publish('design_split', stage='test-design', categories=[category for category, _ in identified], concurrency=concurrency)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='test-design') as executor:
+        futures = [
+            executor.submit(design_category, category, entries, inputs, use_cache, tools, current_stream(), current_revision())
+            for category, entries in identified
+        ]
+        outcomes = [future.result() for future in futures]
+    design_seconds = time.perf_counter() - started
+
+    designs = {category: result for (category, _), (result, _) in zip(identified, outcomes)}
+    document, matrix = render_test_design(designs, identified, inputs.get('topic'))
+    stats.update({
+        "parallel": True,
+        "categories": len(identified),
+        "concurrency": concurrency,
+        "cached_categories": sum(1 for _, cached in outcomes if cached),
+        "requirements": len(matrix),
+        "uncovered_requirements": [rid for rid, _, test_cases in matrix if not test_cases],
+        "test_cases": len({test_case for design in designs.values() for test_case in TEST_CASE_ID.findall(design)}),
+        "design_seconds": round(design_seconds, 3)
+    })
+    return document
@@ -0,0 +1,72 @@
+"""
+Command-line entry points for training, replaying and testing the crew.
+
+This module only imports the standard library at load time; crewai (via
+test_gemini.crew) is imported when a command actually builds the crew, so
+`replay <task_id>` no longer pays for Flask, flask_cors and PyPDF2 the way
+it did when these commands lived in main.py.
+"""
+import sys
+from datetime import datetime
+
+
+def build_crew():
+    """
+    A fresh TestGemini crew (imports crewai on first use). Every test
+    implementation it generates is written to a run directory of its own in
+    the run file store, like the server's runs.
+    """
+    from test_gemini.crew import TestGemini
+    from test_gemini.stages import STAGE_GRAPH
+    crew = TestGemini().crew()
+    crew.tasks[STAGE_GRAPH['test-implementation']['task_index']].callback = store_implementation
+    return crew
+
+
+def store_implementation(output):
+    """Task callback: save a generated test implementation as a new run's files."""
+    from test_gemini.implementation_shards import implementation_files
+    from test_gemini.run_files import get_run_file_store
+    from test_gemini.stages import get_stage_store
+
+    run_id = get_stage_store().new_id()
+    store = get_run_file_store()
+    for name, content in implementation_files(str(getattr(output, 'raw', output))):
+        store.save(run_id, name, content)
+        print(f"Saved {name} to {store.path(run_id, name)}")
+
+
+def train():
+    """Train the crew for a given number of iterations."""
+    inputs = {
+        "topic": "Real-time Operating System (RTOS)",
+        'current_year': str(datetime.now().year)
+    }
+    try:
+        build_crew().train(n_iterations=int(sys.argv[2]), filename=sys.argv[3], inputs=inputs)
+        print(f"Training completed for {sys.argv[2]} iterations, results saved to {sys.argv[3]}")
+    except Exception as e:
+        raise Exception(f"Error training the crew: {e}")
+
+
+def replay():
+    """Replay the crew execution from a specific task."""
+    try:
+        build_crew().replay(task_id=sys.argv[2])
+        print(f"Replay completed for task: {sys.argv[2]}")
+    except Exception as e:
+        raise Exception(f"Error replaying: {e}")
+
+
+def test():
+    """Test the crew execution and returns the results."""
+    inputs = {
+        "topic": "Automotive Control Unit Testing",
+        "current_year": str(datetime.now().year)
+    }
+    try:
+        result = build_crew().test(n_iterations=int(sys.argv[2]), eval_llm=sys.argv[3], inputs=inputs)
+        print(f"Testing completed for {sys.argv[2]} iterations using {sys.argv[3]} as evaluation LLM")
+        return result
+    except Exception as e:
+        raise Exception(f"Error testing the crew: {e}")
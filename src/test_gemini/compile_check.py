@@ -0,0 +1,284 @@
+"""
+Compile check of the generated Google Test code.
+
+After test_script_implementation_task, the generated files (the single
+test_implementation.cpp, or the shared header and suite shards) can be
+written to a scratch directory without their Markdown fences and checked
+with a local compiler in -fsyntax-only mode. gtest and gmock are included
+through a precompiled header that is built once per compiler and flag set,
+and every check result is cached by the hash of the compiler, the flags
+and the file contents. Compiler processes are bounded process-wide by a
+semaphore, so checks never hold a pooled crew. An optional bounded fix-up
+loop sends files with errors, together with their diagnostics, back to the
+test_script_developer.
+"""
+import hashlib
+import logging
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from test_gemini.crew_pool import get_crew_pool
+from test_gemini.implementation_shards import HEADER_FILE, replace_source_files, source_files, strip_code_fences
+from test_gemini.metrics import get_metrics
+from test_gemini.settings import env_bool, env_int, state_path
+from test_gemini.stages import execute_stage
+from test_gemini.storage import DiskStore
+from test_gemini.streaming import publish
+
+logger = logging.getLogger(__name__)
+
+PCH_HEADER = 'gtest_pch.h'
+PCH_INCLUDES = '#include <gtest/gtest.h>\n#include <gmock/gmock.h>\n'
+
+_DIAGNOSTIC = re.compile(
+    r'^(?P<file>[^:\n]+):(?P<line>\d+):(?:(?P<column>\d+):)? (?P<severity>fatal error|error|warning): (?P<message>.*)$',
+    re.MULTILINE
+)
+
+
+def should_check(compile_check=None):
+    """Whether the implementation is compile-checked: an explicit request wins, else COMPILE_CHECK."""
+    if compile_check is not None:
+        return bool(compile_check)
+    return env_bool('COMPILE_CHECK', False)
+
+
+def parse_diagnostics(output, directory=None):
+    """Compiler output as [{file, line, column, severity, message}, ...] (errors and warnings only)."""
+    diagnostics = []
+    for match in _DIAGNOSTIC.finditer(output or ''):
+        path = match.group('file')
+        if directory and os.path.isabs(path) and path.startswith(directory):
+            path = os.path.relpath(path, directory)
+        diagnostics.append({
+            "file": path,
+            "line": int(match.group('line')),
+            "column": int(match.group('column')) if match.group('column') else None,
+            "severity": 'error' if match.group('severity') == 'fatal error' else match.group('severity'),
+            "message": match.group('message').strip()
+        })
+    return diagnostics
+
+
+class CompileChecker:
+    """Syntax checks with a local compiler, a precompiled gtest/gmock header and a result cache."""
+
+    def __init__(self, compiler=None, flags=None, cache_directory=None, pch_directory=None, timeout=60,
+                 concurrency=2, use_pch=True, max_diagnostics=20):
+        self.compiler = compiler
+        self.flags = list(flags or [])
+        self.timeout = timeout
+        self.use_pch = use_pch
+        self.max_diagnostics = max_diagnostics
+        self.cache = DiskStore(cache_directory, max_bytes=64 * 1024 * 1024, ttl_seconds=30 * 24 * 3600) if cache_directory else None
+        self.pch_directory = pch_directory
+        self._slots = threading.BoundedSemaphore(max(1, concurrency))
+        self.concurrency = max(1, concurrency)
+        self._pch_lock = threading.Lock()
+        self._pch = None
+        self._version = None
+
+    def available(self):
+        return bool(self.compiler and shutil.which(self.compiler))
+
+    def version(self):
+        if self._version is None:
+            try:
+                output = subprocess.run([self.compiler, '--version'], capture_output=True, text=True, timeout=10).stdout
+                self._version = (output.splitlines() or [self.compiler])[0].strip()
+            except (OSError, subprocess.SubprocessError):
+                self._version = self.compiler
+        return self._version
+
+    def _run(self, command, cwd=None):
+        """Run one compiler process inside a semaphore slot. Returns (returncode, output)."""
+        with self._slots:
+            try:
+                completed = subprocess.run(command, cwd=cwd, capture_output=True, text=True, timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                return None, f"compiler timed out after {self.timeout}s"
+            return completed.returncode, completed.stderr + completed.stdout
+
+    def precompiled_header(self):
+        """Path of the gtest/gmock header to -include (precompiled once), or None if it cannot be built."""
+        if not self.use_pch or not self.pch_directory:
+            return None
+        with self._pch_lock:
+            if self._pch is not None:
+                return self._pch or None
+            material = '\n'.join([self.version(), *self.flags, PCH_INCLUDES])
+            directory = os.path.join(self.pch_directory, hashlib.sha256(material.encode('utf-8')).hexdigest()[:16])
+            header = os.path.join(directory, PCH_HEADER)
+            if not os.path.exists(header + '.gch'):
+                os.makedirs(directory, exist_ok=True)
+                with open(header, 'w', encoding='utf-8') as handle:
+                    handle.write(PCH_INCLUDES)
+                # Built under a temporary name so concurrent workers never read a partial file
+                fd, partial = tempfile.mkstemp(dir=directory, suffix='.gch.tmp')
+                os.close(fd)
+                started = time.perf_counter()
+                returncode, output = self._run([self.compiler, *self.flags, '-x', 'c++-header', header, '-o', partial])
+                if returncode != 0:
+                    os.unlink(partial)
+                    logger.warning(f"Could not precompile gtest/gmock headers, checking without: {output.strip()[:500]}")
+                    self._pch = ''
+                    return None
+                os.replace(partial, header + '.gch')
+                logger.info(f"Precompiled gtest/gmock headers in {time.perf_counter() - started:.1f}s")
+            self._pch = header
+            return header
+
+    def _key(self, name, files, pch):
+        digest = hashlib.sha256()
+        for part in (self.version(), *self.flags, 'pch' if pch else 'no-pch', name):
+            digest.update(part.encode('utf-8') + b'\0')
+        for file_name in sorted(files):
+            digest.update(file_name.encode('utf-8') + b'\0' + files[file_name].encode('utf-8') + b'\0')
+        return digest.hexdigest()
+
+    def check_file(self, name, files, directory, pch):
+        """Check one translation unit of files (written to directory). Returns its report."""
+        # Shards see every header of the set, so a header change invalidates them
+        relevant = {file_name: code for file_name, code in files.items() if file_name == name or not file_name.endswith('.cpp')}
+        key = self._key(name, relevant, pch)
+        cached = self.cache.get(key) if self.cache else None
+        if cached is not None:
+            get_metrics().inc('compile_checks_total', outcome='cached')
+            return dict(cached, cached=True, seconds=0.0)
+
+        command = [self.compiler, *self.flags, '-fsyntax-only', '-fdiagnostics-color=never', '-I', directory]
+        if pch:
+            command += ['-include', pch]
+        started = time.perf_counter()
+        returncode, output = self._run(command + [os.path.join(directory, name)], cwd=directory)
+        seconds = time.perf_counter() - started
+        diagnostics = parse_diagnostics(output, directory)
+        if returncode is None:
+            diagnostics = [{"file": name, "line": None, "column": None, "severity": 'error', "message": output}]
+        errors = [entry for entry in diagnostics if entry['severity'] == 'error']
+        report = {
+            "file": name,
+            "status": 'passed' if returncode == 0 else 'failed',
+            "errors": len(errors) or (0 if returncode == 0 else 1),
+            "warnings": len(diagnostics) - len(errors),
+            "diagnostics": diagnostics[:self.max_diagnostics]
+        }
+        if returncode != 0 and not diagnostics:
+            report["diagnostics"] = [{"file": name, "line": None, "column": None, "severity": 'error', "message": output.strip()[:2000]}]
+        if returncode is not None and self.cache:
+            try:
+                self.cache.put(key, report)
+            except OSError as e:
+                logger.warning(f"Could not cache compile check of {name}: {str(e)}")
+        get_metrics().inc('compile_checks_total', outcome=report['status'])
+        return dict(report, cached=False, seconds=round(seconds, 3))
+
+    def check(self, files):
+        """
+        Check every .cpp of files ({file_name: code}), concurrently. Returns
+        {status, compiler, pch, seconds, files: [...], diagnostics: [...]}.
+        """
+        if not self.available():
+            return {"status": 'skipped', "reason": f"compiler not found: {self.compiler}"}
+        started = time.perf_counter()
+        pch = self.precompiled_header()
+        units = [name for name in files if name.endswith('.cpp')]
+        directory = tempfile.mkdtemp(prefix='test_gemini_compile_')
+        try:
+            for name, code in files.items():
+                with open(os.path.join(directory, name), 'w', encoding='utf-8') as handle:
+                    handle.write(code)
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, max(1, len(units))), thread_name_prefix='compile-check') as executor:
+                reports = list(executor.map(lambda name: self.check_file(name, files, directory, pch), units))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        return {
+            "status": 'passed' if all(report['status'] == 'passed' for report in reports) else 'failed',
+            "compiler": self.version(),
+            "pch": bool(pch),
+            "seconds": round(time.perf_counter() - started, 3),
+            "files": [{key: value for key, value in report.items() if key != 'diagnostics'} for report in reports],
+            "diagnostics": [entry for report in reports for entry in report['diagnostics']]
+        }
+
+
+def _fix_context(name, code, diagnostics, header=None):
+    listed = '\n'.join(
+        f"{entry['file']}:{entry['line']}:{entry['column']}: {entry['severity']}: {entry['message']}"
+        for entry in diagnostics
+    )
+    return (
+        f"{name} below does not compile. Fix the compiler errors and return the whole corrected {name} only, "
+        "keeping every test case.\n\n"
+        f"Compiler diagnostics:\n{listed}\n\n"
+        + (f"{HEADER_FILE} (included, do not repeat it):\n```cpp\n{header.rstrip()}\n```\n\n" if header and name != HEADER_FILE else '')
+        + f"{name}:\n```cpp\n{code.rstrip()}\n```\n"
+    )
+
+
+def check_implementation(result, inputs, fix_attempts=None, stats=None, tools=None):
+    """
+    Compile-check a test-implementation output and return it, fixed when
+    COMPILE_CHECK_FIX_ATTEMPTS (or fix_attempts) allows rounds of fix-ups:
+    each round sends the files with errors back to the
+    test_script_developer with their diagnostics, then checks again. stats
+    (a dict) receives the final report plus the rounds used.
+    """
+    stats = stats if stats is not None else {}
+    checker = get_compile_checker()
+    fix_attempts = env_int('COMPILE_CHECK_FIX_ATTEMPTS', 0) if fix_attempts is None else fix_attempts
+    publish('compile_check_started', stage='test-implementation')
+    report = checker.check(source_files(result))
+    rounds = 0
+    while report['status'] == 'failed' and rounds < fix_attempts:
+        rounds += 1
+        files = source_files(result)
+        failing = sorted({entry['file'] for entry in report['diagnostics'] if entry['severity'] == 'error' and entry['file'] in files})
+        if not failing:
+            break
+        logger.info(f"Compile fix-up round {rounds}: {', '.join(failing)}")
+
+        def fix(name):
+            diagnostics = [entry for entry in report['diagnostics'] if entry['file'] == name]
+            context = _fix_context(name, files[name], diagnostics, files.get(HEADER_FILE))
+            return strip_code_fences(execute_stage('test-implementation', inputs, context, tools=tools))
+
+        with ThreadPoolExecutor(max_workers=max(1, min(len(failing), get_crew_pool().size)), thread_name_prefix='compile-fix') as executor:
+            fixed = dict(zip(failing, executor.map(fix, failing)))
+        result = replace_source_files(result, fixed, inputs.get('topic'))
+        report = checker.check(source_files(result))
+    report['fix_rounds'] = rounds
+    stats.update(report)
+    publish('compile_check_completed', stage='test-implementation', status=report['status'], fix_rounds=rounds)
+    return result
+
+
+_checker = None
+_checker_lock = threading.Lock()
+
+
+def get_compile_checker():
+    """Return the process-wide CompileChecker configured from the environment."""
+    global _checker
+    with _checker_lock:
+        if _checker is None:
+            compiler = os.environ.get('COMPILE_CHECK_CXX') or next(
+                (name for name in ('g++', 'clang++', 'c++') if shutil.which(name)), 'g++'
+            )
+            _checker = CompileChecker(
+                compiler=compiler,
+                flags=shlex.split(os.environ.get('COMPILE_CHECK_FLAGS', '-std=c++17')),
+                cache_directory=os.environ.get('COMPILE_CHECK_CACHE_DIR') or state_path('compile_check', 'results'),
+                pch_directory=state_path('compile_check', 'pch'),
+                timeout=env_int('COMPILE_CHECK_TIMEOUT', 60),
+                concurrency=env_int('COMPILE_CHECK_CONCURRENCY', max(1, (os.cpu_count() or 2) // 2)),
+                use_pch=env_bool('COMPILE_CHECK_PCH', True)
+            )
+        return _checker
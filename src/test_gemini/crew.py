@@ -3,6 +3,10 @@ from crewai.project import CrewBase, agent, crew, task
 from crewai.agents.agent_builder.base_agent import BaseAgent
 from typing import List
 
+from test_gemini.llm import agent_llm
+from test_gemini.retrieval import retrieval_tools
+from test_gemini.streaming import report_step
+
 @CrewBase
 class TestGemini():
     """TestGemini crew"""
@@ -21,21 +25,30 @@ class TestGemini():
     def requirements_engineer(self) -> Agent:
         return Agent(
             config=self.agents_config['requirements_engineer'],
-            verbose=True
+            verbose=True,
+            llm=agent_llm('requirements_engineer'),
+            tools=retrieval_tools('requirements_engineer'),
+            step_callback=report_step
         )
 
     @agent
     def test_case_designer(self) -> Agent:
         return Agent(
             config=self.agents_config['test_case_designer'],
-            verbose=True
+            verbose=True,
+            llm=agent_llm('test_case_designer'),
+            tools=retrieval_tools('test_case_designer'),
+            step_callback=report_step
         )
 
     @agent
     def test_script_developer(self) -> Agent:
         return Agent(
             config=self.agents_config['test_script_developer'],
-            verbose=True
+            verbose=True,
+            llm=agent_llm('test_script_developer'),
+            tools=retrieval_tools('test_script_developer'),
+            step_callback=report_step
         )
 
     # To learn more about structured task outputs,
@@ -58,7 +71,6 @@ class TestGemini():
     def test_script_implementation_task(self) -> Task:
         return Task(
             config=self.tasks_config['test_script_implementation_task'],
-            output_file='test_implementation.cpp'
         )
 
     @crew
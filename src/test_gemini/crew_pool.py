@@ -0,0 +1,194 @@
+"""
+Shared pool of pre-built TestGemini crews.
+
+Building a crew loads the YAML config, instantiates all three agents and
+their LLM clients, so doing it per request puts seconds of setup on every
+API call. The pool builds up to CREW_POOL_SIZE crews once, hands them out
+with check-out/check-in semantics and resets per-run state on check-in.
+"""
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from test_gemini.settings import env_int, env_float
+
+logger = logging.getLogger(__name__)
+
+
+class CrewPoolTimeout(Exception):
+    """Raised when no crew becomes available within the checkout timeout."""
+
+
+def _build_crew():
+    from test_gemini.crew import TestGemini
+    # Generated files go to the per-run file store (run_files.py), never to
+    # a shared output_file in the working directory
+    return TestGemini().crew()
+
+
+def reset_crew_state(crew):
+    """
+    Clear the per-run state a crew accumulates so the next run starts clean.
+
+    Agent roles/goals and task descriptions are re-interpolated from their
+    original templates on every run, so only run outputs and counters need
+    clearing here.
+    """
+    for task in crew.tasks:
+        task.output = None
+        task.used_tools = 0
+        task.tools_errors = 0
+        task.delegations = 0
+        task.processed_by_agents = set()
+        task.prompt_context = None
+    for agent in crew.agents:
+        agent.tools_results = []
+
+
+class CrewPool:
+    """Fixed-size pool of crews with lazy construction and build/run timing."""
+
+    def __init__(self, size=4, factory=None, checkout_timeout=600.0):
+        self.size = max(1, size)
+        self.factory = factory or _build_crew
+        self.checkout_timeout = checkout_timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._construction_seconds = 0.0
+        self._execution_seconds = {}
+        self._executions = {}
+        self._wait_seconds = 0.0
+        self._checkouts = 0
+
+    def prewarm(self, count=None):
+        """Build crews up front so the first requests do not pay for it."""
+        target = min(self.size, count if count is not None else self.size)
+        built = 0
+        while True:
+            with self._lock:
+                if self._created >= target:
+                    break
+                self._created += 1
+            try:
+                self._idle.put(self._timed_build())
+                built += 1
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        if built:
+            logger.info(f"Crew pool pre-warmed with {built} crews")
+        return built
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """
+        Borrow a crew for one run. The crew is reset and returned on exit;
+        if the run raised, it is discarded and rebuilt lazily instead.
+        """
+        started = time.perf_counter()
+        crew = self._acquire(self.checkout_timeout if timeout is None else timeout)
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_seconds += time.perf_counter() - started
+
+        healthy = False
+        try:
+            yield crew
+            healthy = True
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            if healthy:
+                try:
+                    reset_crew_state(crew)
+                    self._idle.put(crew)
+                except Exception as e:
+                    logger.warning(f"Discarding crew that failed to reset: {str(e)}")
+                    self._discard()
+            else:
+                self._discard()
+
+    def record_execution(self, stage, seconds):
+        """Record time spent running a stage (i.e. waiting on the LLM)."""
+        with self._lock:
+            self._execution_seconds[stage] = self._execution_seconds.get(stage, 0.0) + seconds
+            self._executions[stage] = self._executions.get(stage, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            execution_total = sum(self._execution_seconds.values())
+            return {
+                "size": self.size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "checkouts": self._checkouts,
+                "checkout_wait_seconds_total": round(self._wait_seconds, 3),
+                "construction_seconds_total": round(self._construction_seconds, 3),
+                "execution_seconds_total": round(execution_total, 3),
+                "execution_seconds_by_stage": {
+                    stage: round(seconds, 3) for stage, seconds in self._execution_seconds.items()
+                },
+                "executions_by_stage": dict(self._executions),
+                "construction_share": round(
+                    self._construction_seconds / (self._construction_seconds + execution_total), 4
+                ) if (self._construction_seconds + execution_total) else 0.0
+            }
+
+    def _acquire(self, timeout):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_build = self._created < self.size
+            if can_build:
+                self._created += 1
+        if can_build:
+            try:
+                return self._timed_build()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise CrewPoolTimeout(f"No crew available after {timeout} seconds (pool size {self.size})")
+
+    def _timed_build(self):
+        started = time.perf_counter()
+        crew = self.factory()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._construction_seconds += elapsed
+        logger.info(f"Built crew in {elapsed:.2f}s")
+        return crew
+
+    def _discard(self):
+        with self._lock:
+            self._created -= 1
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_crew_pool():
+    """Return the process-wide CrewPool configured from the environment."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = CrewPool(
+                size=env_int('CREW_POOL_SIZE', 4),
+                checkout_timeout=env_float('CREW_POOL_CHECKOUT_TIMEOUT', 600.0)
+            )
+        return _pool
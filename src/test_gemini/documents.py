@@ -0,0 +1,186 @@
+"""
+Registry of uploaded specification documents.
+
+Extracted PDF text is cached on disk by the SHA-256 of the uploaded bytes,
+one entry per document with the text of each page kept separately. A repeat
+upload of a known document skips PyPDF2 entirely, and clients can register
+a PDF once (POST /documents) and refer to it by its document ID afterwards.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+from test_gemini.pdf import PDFExtractionError, extract_pdf_pages, join_pages, read_pdf_bytes
+from test_gemini.settings import env_int, state_path
+from test_gemini.storage import DiskStore
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentNotFound(Exception):
+    """Raised when a document ID is unknown (never registered or evicted)."""
+
+
+_DOCUMENT_ID = re.compile(r'^[0-9a-f]{64}$')
+
+
+def document_id_for(pdf_bytes):
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def is_document_id(value):
+    """Whether value has the form of a document ID (the SHA-256 of the PDF, lowercase hex)."""
+    return isinstance(value, str) and bool(_DOCUMENT_ID.match(value))
+
+
+def topic_label(record):
+    """
+    Short topic for a document, used to fill the {topic} placeholders of
+    the agent and task templates: the file name, else the first line.
+    """
+    filename = os.path.splitext(os.path.basename(record.get('filename') or ''))[0]
+    label = re.sub(r'[_\-\s]+', ' ', filename).strip()
+    if not label:
+        for page in record.get('pages', []):
+            first_line = next((line.strip() for line in page.splitlines() if line.strip()), '')
+            if first_line:
+                label = first_line
+                break
+    return label[:80] or f"document {record['document_id'][:12]}"
+
+
+class DocumentStore:
+    """Disk-backed, size-bounded cache of per-page PDF text keyed by content hash."""
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, ttl_seconds=30 * 24 * 3600):
+        self.disk = DiskStore(directory, max_bytes=max_bytes, ttl_seconds=ttl_seconds)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def register(self, pdf_bytes, filename=None, stats=None):
+        """
+        Return the document record for pdf_bytes, extracting it only when the
+        content hash is not cached yet. stats (a dict) receives 'cache' and
+        extraction details.
+        """
+        stats = stats if stats is not None else {}
+        document_id = document_id_for(pdf_bytes)
+        max_pages = env_int('PDF_MAX_PAGES', 0)
+
+        record = self.disk.get(document_id)
+        # A record extracted under a tighter page cap cannot serve a looser one
+        if record is not None and record['truncated'] and (not max_pages or max_pages > len(record['pages'])):
+            record = None
+
+        if record is not None:
+            with self._lock:
+                self._hits += 1
+            stats.update({
+                "cache": "hit",
+                "pages": len(record['pages']),
+                "document_pages": record['document_pages'],
+                "seconds": 0.0,
+                "parallel": False,
+                "truncated": record['truncated']
+            })
+            logger.info(f"Document {document_id[:12]} served from the document cache")
+            return record
+
+        with self._lock:
+            self._misses += 1
+        started = time.perf_counter()
+        pages = extract_pdf_pages(pdf_bytes, max_pages=max_pages, stats=stats)
+        if not any(page.strip() for page in pages):
+            raise PDFExtractionError("No text content found in PDF")
+
+        record = {
+            "document_id": document_id,
+            "filename": filename,
+            "size_bytes": len(pdf_bytes),
+            "document_pages": stats.get('document_pages', len(pages)),
+            "truncated": stats.get('truncated', False),
+            "created_at": datetime.now().isoformat(),
+            "pages": pages
+        }
+        try:
+            self.disk.put(document_id, record)
+        except OSError as e:
+            logger.warning(f"Could not persist document {document_id[:12]}: {str(e)}")
+        stats['cache'] = 'miss'
+        logger.info(f"Registered document {document_id[:12]} ({len(pages)} pages) in {time.perf_counter() - started:.2f}s")
+        return record
+
+    def get(self, document_id):
+        # Request-supplied IDs never reach the disk store unless well-formed
+        record = self.disk.get(document_id) if is_document_id(document_id) else None
+        if record is None:
+            raise DocumentNotFound(f"Document not found: {document_id}")
+        return record
+
+    def delete(self, document_id):
+        if is_document_id(document_id):
+            self.disk.delete(document_id)
+
+    @staticmethod
+    def text(record, max_chars=None, stats=None):
+        """The document text, assembled from its pages."""
+        return join_pages(record['pages'], max_chars=max_chars, stats=stats)
+
+    @staticmethod
+    def summary(record):
+        """Record metadata without the page texts."""
+        summary = {key: value for key, value in record.items() if key != 'pages'}
+        summary['pages'] = len(record['pages'])
+        summary['chars'] = sum(len(page) for page in record['pages'])
+        return summary
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "disk_bytes": self.disk.size_bytes()
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_document_store():
+    """Return the process-wide DocumentStore configured from the environment."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DocumentStore(
+                directory=os.environ.get('DOCUMENT_STORE_DIR') or state_path('documents'),
+                max_bytes=env_int('DOCUMENT_STORE_MAX_BYTES', 512 * 1024 * 1024),
+                ttl_seconds=env_int('DOCUMENT_STORE_TTL', 30 * 24 * 3600)
+            )
+        return _store
+
+
+def text_from_upload(pdf_file, stats=None):
+    """
+    Text of an uploaded PDF via the document cache. Returns (record, text);
+    stats receives the extraction/cache summary plus the document ID.
+    """
+    stats = stats if stats is not None else {}
+    try:
+        store = get_document_store()
+        record = store.register(read_pdf_bytes(pdf_file), filename=getattr(pdf_file, 'filename', None), stats=stats)
+        text = store.text(record, stats=stats)
+        if not text:
+            raise PDFExtractionError("No text content found in PDF")
+        stats['document_id'] = record['document_id']
+        return record, text
+    except PDFExtractionError:
+        raise
+    except Exception as e:
+        logger.error(f"Error extracting text from PDF: {str(e)}")
+        raise PDFExtractionError(f"Failed to extract text from PDF: {str(e)}")
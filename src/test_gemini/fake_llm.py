@@ -0,0 +1,136 @@
+"""
+A local, deterministic stand-in for the agents' LLM.
+
+FakeLLM answers every call after a fixed latency with a final answer of a
+configurable size whose content depends only on the agent and the prompt.
+When streaming is on (see streaming.llm_streaming) the answer arrives line
+by line over the same latency, as LLMStreamChunkEvents. It needs no
+network or API key. Each call reports estimated token usage to
+crewai's token counters, just as litellm would, so the token accounting
+code paths still run. It backs the offline benchmark (see benchmark.py).
+"""
+import hashlib
+import re
+import threading
+import time
+
+from crewai.llms.base_llm import BaseLLM
+
+# Answer lines per agent (see agents.yaml), shaped like the real outputs so
+# the downstream parsing (requirement merging, code files) sees realistic input
+_TEMPLATES = {
+    'requirements_engineer': (
+        "## Functional Requirements",
+        "- REQ-F{n:03d}: The system shall process command {token} within the specified cycle.",
+        "## Performance Requirements",
+        "- REQ-P{n:03d}: The system shall complete operation {token} in under {ms} ms.",
+        "## Safety Requirements",
+        "- REQ-S{n:03d}: The system shall enter a safe state when fault {token} is detected.",
+    ),
+    'test_case_designer': (
+        "### TC-{n:03d}: Verify behaviour {token}",
+        "- Requirements: {requirement}",
+        "- Preconditions: system initialised, input {token} prepared",
+        "- Steps: apply stimulus {token}, wait {ms} ms, read outputs",
+        "- Expected: outputs match the requirement within tolerance",
+    ),
+    'test_script_developer': (
+        "TEST(GeneratedSuite, Case{n:03d}) {{",
+        "    EXPECT_EQ(Process(\"{token}\"), Status::kOk);",
+        "    EXPECT_LT(ElapsedMs(\"{token}\"), {ms});",
+        "}}",
+    ),
+}
+
+# Requirement IDs a prompt lists, for test cases to reference
+_REQUIREMENT_IDS = re.compile(r'\b(?!TC-)[A-Z]{2,6}(?:-[A-Z]{1,6})?-[A-Z]?\d+\b')
+
+
+class FakeLLM(BaseLLM):
+    """Deterministic LLM with configurable latency and output size."""
+
+    def __init__(self, agent_name='agent', latency=0.05, output_chars=2000, model='fake/deterministic'):
+        super().__init__(model=model, temperature=0.0)
+        self.agent_name = agent_name
+        self.latency = latency
+        self.output_chars = output_chars
+        self.stream = False
+        self.calls = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None):
+        prompt = messages if isinstance(messages, str) else "\n".join(
+            str(message.get('content', '')) for message in messages
+        )
+        answer = self.answer(prompt)
+        response = f"Thought: I now know the final answer\nFinal Answer: {answer}"
+        if self.stream:
+            self._stream(response)
+        elif self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            self.seconds += self.latency
+        self._report_usage(callbacks, prompt, answer)
+        return response
+
+    def _stream(self, response):
+        from crewai.utilities.events import crewai_event_bus
+        from crewai.utilities.events.llm_events import LLMStreamChunkEvent
+
+        chunks = response.splitlines(keepends=True)
+        for chunk in chunks:
+            if self.latency:
+                time.sleep(self.latency / len(chunks))
+            crewai_event_bus.emit(self, event=LLMStreamChunkEvent(chunk=chunk))
+
+    def answer(self, prompt):
+        """The answer text for a prompt: output_chars of agent-shaped lines seeded by the prompt."""
+        digest = hashlib.sha256(f"{self.agent_name}\n{prompt}".encode('utf-8')).hexdigest()
+        template = _TEMPLATES.get(self.agent_name, ("- item {n:03d}: {token}",))
+        requirements = list(dict.fromkeys(_REQUIREMENT_IDS.findall(prompt))) or ['REQ-000']
+        lines = []
+        size = 0
+        n = 0
+        while size < self.output_chars:
+            token = digest[(n * 7) % 56:(n * 7) % 56 + 8]
+            for line in template:
+                text = line.format(n=n + 1, token=token, ms=10 + int(token[:2], 16),
+                                   requirement=requirements[n % len(requirements)])
+                lines.append(text)
+                size += len(text) + 1
+            n += 1
+        if any(line.startswith('## ') for line in template):
+            # One section per heading, as a requirements document has
+            sections = {}
+            for text in lines:
+                if text.startswith('## '):
+                    section = sections.setdefault(text, [])
+                else:
+                    section.append(text)
+            lines = [text for heading, items in sections.items() for text in [heading] + items]
+        if self.agent_name == 'test_script_developer':
+            return "```cpp\n#include <gtest/gtest.h>\n\n" + "\n".join(lines) + "\n```"
+        return "\n".join(lines)
+
+    def _report_usage(self, callbacks, prompt, answer):
+        # The token counters crewai attaches expect litellm's usage shape
+        usage = _Usage(prompt_tokens=len(prompt) // 4, completion_tokens=len(answer) // 4)
+        for callback in callbacks or []:
+            if hasattr(callback, 'log_success_event'):
+                callback.log_success_event({}, {'usage': usage}, None, None)
+
+    def supports_function_calling(self):
+        return False
+
+    def get_context_window_size(self):
+        return 128000
+
+
+class _Usage:
+    def __init__(self, prompt_tokens, completion_tokens):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = prompt_tokens + completion_tokens
+        self.prompt_tokens_details = None
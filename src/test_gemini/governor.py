@@ -0,0 +1,323 @@
+"""
+Process-wide governor for LLM calls, shared by the workers on one host.
+
+Every agent's LLM is wrapped in a GovernedLLM (see llm.py). Before a call
+goes to the model, the governor takes one request and the call's estimated
+tokens from two token buckets, LLM_REQUESTS_PER_MINUTE and
+LLM_TOKENS_PER_MINUTE. It then takes one of LLM_MAX_CONCURRENCY call
+slots. A rate-limit response (HTTP 429, RESOURCE_EXHAUSTED) does not fail
+the run. The call is retried with jittered exponential backoff, up to
+LLM_RATE_LIMIT_RETRIES times, honouring the delay the API asks for. The
+backoff is shared: every worker holds its calls until it has passed, and
+each further 429 before a success doubles it. Overlapping pipelines
+therefore slow down instead of failing.
+
+The buckets and the backoff live in one small JSON file that is updated
+under an exclusive flock. The call slots are lock files held with flock.
+Both are released by the kernel when a worker dies, so all processes that
+share LLM_GOVERNOR_DIR (the gunicorn workers of server.py) observe the same
+limits. A limit of 0 is unlimited.
+"""
+import fcntl
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from crewai.llms.base_llm import BaseLLM
+
+from test_gemini.metrics import get_metrics
+from test_gemini.settings import env_bool, env_float, env_int, state_path
+
+logger = logging.getLogger(__name__)
+
+_RATE_LIMIT_MESSAGE = re.compile(r'\b429\b|RESOURCE_EXHAUSTED|rate[ _-]?limit|too many requests', re.IGNORECASE)
+# "Please retry in 23.4s", "retryDelay": "23s", "Retry-After: 23"
+_RETRY_DELAY = re.compile(r'retry(?:[ _-]?(?:delay|after))?["\']?\s*[:=]?\s*["\']?(?:in\s+)?(\d+(?:\.\d+)?)\s*s?\b', re.IGNORECASE)
+
+
+def should_govern():
+    """Whether agents' LLM calls go through the governor (LLM_GOVERNOR)."""
+    return env_bool('LLM_GOVERNOR', True)
+
+
+def is_rate_limit(error):
+    """Whether an exception from an LLM call is a rate-limit (quota) response."""
+    if getattr(error, 'status_code', None) == 429 or 'RateLimit' in type(error).__name__:
+        return True
+    return bool(_RATE_LIMIT_MESSAGE.search(str(error)))
+
+
+def retry_after(error):
+    """Seconds the API asked to wait before retrying, or None."""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        value = headers.get('retry-after') or headers.get('Retry-After')
+        if value is not None:
+            return float(value)
+    except (TypeError, ValueError, AttributeError):
+        pass
+    match = _RETRY_DELAY.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+def estimate_tokens(messages):
+    """Rough token count of a prompt (4 characters per token)."""
+    if isinstance(messages, str):
+        return len(messages) // 4
+    return sum(len(str(message.get('content', ''))) for message in messages or []) // 4
+
+
+class LLMGovernor:
+    """Token buckets, call slots and shared rate-limit backoff for every LLM call on the host."""
+
+    def __init__(self, directory, requests_per_minute=0, tokens_per_minute=0, max_concurrency=0,
+                 max_retries=5, base_delay=2.0, max_delay=60.0, completion_tokens=1000):
+        self.directory = directory
+        self.requests_per_minute = max(0, requests_per_minute)
+        self.tokens_per_minute = max(0, tokens_per_minute)
+        self.max_concurrency = max(0, max_concurrency)
+        self.max_retries = max(0, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.completion_tokens = completion_tokens
+        self._state_path = os.path.join(directory, 'state.json')
+        self._slots_dir = os.path.join(directory, 'slots')
+        os.makedirs(self._slots_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._counters = {"calls": 0, "waits": 0, "wait_seconds": 0.0, "rate_limited": 0, "retries": 0, "failures": 0}
+
+    @contextmanager
+    def _shared_state(self):
+        """The state every process shares, exclusively locked for the block and written back after it."""
+        # flock locks belong to the open file, so each thread opens its own
+        with open(self._state_path, 'a+', encoding='utf-8') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                handle.seek(0)
+                try:
+                    state = json.loads(handle.read() or '{}')
+                except ValueError:
+                    state = {}
+                before = dict(state)
+                yield state
+                if state != before:
+                    handle.seek(0)
+                    handle.truncate()
+                    handle.write(json.dumps(state))
+                    handle.flush()
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _refill(state, name, per_minute, now):
+        """Current level of a bucket that holds up to a minute of its limit."""
+        level, updated = state.get(name) or (per_minute, now)
+        return min(per_minute, level + (now - updated) * per_minute / 60.0)
+
+    def _reserve(self, tokens):
+        """Wait out any shared backoff and take one request and tokens from the buckets. Returns the seconds waited."""
+        started = time.monotonic()
+        while True:
+            with self._shared_state() as state:
+                now = time.time()
+                wait = state.get('backoff_until', 0) - now
+                if wait <= 0:
+                    requests = self._refill(state, 'requests', self.requests_per_minute, now) if self.requests_per_minute else None
+                    budget = self._refill(state, 'tokens', self.tokens_per_minute, now) if self.tokens_per_minute else None
+                    # A prompt larger than the whole bucket waits for a full bucket, not forever
+                    needed = min(tokens, self.tokens_per_minute)
+                    waits = []
+                    if requests is not None and requests < 1:
+                        waits.append((1 - requests) * 60.0 / self.requests_per_minute)
+                    if budget is not None and budget < needed:
+                        waits.append((needed - budget) * 60.0 / self.tokens_per_minute)
+                    if not waits:
+                        if requests is not None:
+                            state['requests'] = [requests - 1, now]
+                        if budget is not None:
+                            state['tokens'] = [budget - tokens, now]
+                        return time.monotonic() - started
+                    wait = max(waits)
+            # Spread the processes that wake up together
+            time.sleep(min(wait, 5.0) + random.uniform(0, 0.05))
+
+    def _settle(self, estimated, used):
+        """Correct the token bucket by the tokens a call actually used, and end the backoff streak."""
+        with self._shared_state() as state:
+            if self.tokens_per_minute and used is not None and state.get('tokens'):
+                level, updated = state['tokens']
+                state['tokens'] = [level - (used - estimated), updated]
+            state.pop('strikes', None)
+
+    def _back_off(self, attempt, requested=None):
+        """Hold every process's calls for a jittered exponential delay (at least what the API asked for)."""
+        with self._shared_state() as state:
+            strikes = state.get('strikes', 0)
+            delay = min(self.max_delay, self.base_delay * 2 ** max(attempt, strikes))
+            delay = delay / 2 + random.uniform(0, delay / 2)
+            if requested:
+                delay = max(delay, min(requested, self.max_delay))
+            state['strikes'] = strikes + 1
+            state['backoff_until'] = max(state.get('backoff_until', 0), time.time() + delay)
+        return delay
+
+    @contextmanager
+    def _slot(self):
+        """One of max_concurrency call slots shared by every process (a held lock file)."""
+        if not self.max_concurrency:
+            yield
+            return
+        handle = None
+        while handle is None:
+            for index in random.sample(range(self.max_concurrency), self.max_concurrency):
+                candidate = open(os.path.join(self._slots_dir, f"{index}.lock"), 'a')
+                try:
+                    fcntl.flock(candidate, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    candidate.close()
+                    continue
+                handle = candidate
+                break
+            else:
+                time.sleep(random.uniform(0.05, 0.2))
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+
+    def run(self, call, prompt_tokens=0, agent=None):
+        """
+        call() under the limits, retried on rate-limit responses. Other
+        errors, and a rate limit after max_retries retries, are raised.
+        """
+        metrics = get_metrics()
+        estimated = prompt_tokens + self.completion_tokens
+        attempt = 0
+        while True:
+            waited = self._reserve(estimated)
+            slot_requested = time.monotonic()
+            with self._slot():
+                waited += time.monotonic() - slot_requested
+                try:
+                    response = call()
+                except Exception as e:
+                    if not is_rate_limit(e):
+                        raise
+                    rate_limited = e
+                else:
+                    rate_limited = None
+            self._count(waited)
+            metrics.observe('llm_governor_wait_seconds', waited, agent=agent or 'unknown')
+
+            if rate_limited is None:
+                used = prompt_tokens + len(response) // 4 if isinstance(response, str) else None
+                self._settle(estimated, used)
+                return response
+
+            if attempt >= self.max_retries:
+                self._count(failures=1)
+                metrics.inc('llm_rate_limits_total', agent=agent or 'unknown', outcome='failed')
+                logger.error(f"LLM call of {agent or 'agent'} still rate limited after {attempt} retries")
+                raise rate_limited
+            delay = self._back_off(attempt, retry_after(rate_limited))
+            attempt += 1
+            self._count(rate_limited=1, retries=1)
+            metrics.inc('llm_rate_limits_total', agent=agent or 'unknown', outcome='retried')
+            logger.warning(f"LLM call of {agent or 'agent'} rate limited; retry {attempt} of {self.max_retries} in {delay:.1f}s")
+
+    def _count(self, waited=None, **counts):
+        with self._lock:
+            if waited is not None:
+                self._counters['calls'] += 1
+                if waited > 0.001:
+                    self._counters['waits'] += 1
+                    self._counters['wait_seconds'] += waited
+            for name, value in counts.items():
+                self._counters[name] += value
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters['wait_seconds'] = round(counters['wait_seconds'], 3)
+        with self._shared_state() as state:
+            backoff = max(0.0, state.get('backoff_until', 0) - time.time())
+        return dict(counters, **{
+            "requests_per_minute": self.requests_per_minute or None,
+            "tokens_per_minute": self.tokens_per_minute or None,
+            "max_concurrency": self.max_concurrency or None,
+            "backoff_seconds": round(backoff, 3)
+        })
+
+
+class GovernedLLM(BaseLLM):
+    """Wraps an agent's LLM so its calls go through the LLMGovernor."""
+
+    def __init__(self, llm, governor, agent_name=None):
+        super().__init__(model=llm.model, temperature=getattr(llm, 'temperature', None))
+        self.llm = llm
+        self.governor = governor
+        self.agent_name = agent_name
+        self.stop = list(getattr(llm, 'stop', None) or [])
+
+    # Sampling parameters (read by CachedLLM's cache key) are the wrapped model's
+    def __getattr__(self, name):
+        if name == 'llm':
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    # llm_streaming() toggles streaming on the wrapped model
+    @property
+    def stream(self):
+        return getattr(self.llm, 'stream', False)
+
+    @stream.setter
+    def stream(self, value):
+        if hasattr(self.llm, 'stream'):
+            self.llm.stream = value
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None):
+        # The executor sets stop words on the LLM it sees, i.e. this wrapper
+        self.llm.stop = self.stop
+        return self.governor.run(
+            lambda: self.llm.call(messages, tools=tools, callbacks=callbacks, available_functions=available_functions),
+            prompt_tokens=estimate_tokens(messages),
+            agent=self.agent_name
+        )
+
+    def supports_stop_words(self):
+        return self.llm.supports_stop_words()
+
+    def supports_function_calling(self):
+        supports = getattr(self.llm, 'supports_function_calling', None)
+        return supports() if supports else False
+
+    def get_context_window_size(self):
+        return self.llm.get_context_window_size()
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_llm_governor():
+    """Return the process-wide LLMGovernor configured from the environment."""
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = LLMGovernor(
+                directory=os.environ.get('LLM_GOVERNOR_DIR') or state_path('llm_governor'),
+                requests_per_minute=env_int('LLM_REQUESTS_PER_MINUTE', 0),
+                tokens_per_minute=env_int('LLM_TOKENS_PER_MINUTE', 0),
+                max_concurrency=env_int('LLM_MAX_CONCURRENCY', 0),
+                max_retries=env_int('LLM_RATE_LIMIT_RETRIES', 5),
+                base_delay=env_float('LLM_BACKOFF_BASE', 2.0),
+                max_delay=env_float('LLM_BACKOFF_MAX', 60.0),
+                completion_tokens=env_int('LLM_COMPLETION_TOKENS_ESTIMATE', 1000)
+            )
+        return _governor
@@ -0,0 +1,383 @@
+"""
+Structured, compact handoff between the pipeline stages.
+
+The agents write Markdown prose, and each downstream task used to get the
+whole upstream document as context. Here a stage output is parsed once
+into typed records that are validated against a schema:
+- RequirementSet: requirements with stable IDs and their categories (see
+  category_design.identify_requirements).
+- TestDesign: test cases with their fields and the IDs of the requirements
+  they verify, plus the coverage of every requirement.
+
+Each downstream prompt gets a compact rendering with only the fields its
+task needs: requirement IDs and text for test design, and the
+preconditions, test data, steps and expected results of every test case
+for the implementation. /requirements and /test-design return the records
+as JSON. An output that does not yield a valid, non-empty structure is
+handed downstream unchanged.
+"""
+import logging
+import re
+from typing import List, Optional
+
+from pydantic import BaseModel, Field, ValidationError, field_validator, model_validator
+
+from test_gemini.category_design import (
+    CATEGORY_PREFIXES, TEST_CASE_ID, identify_requirements, render_category_requirements, test_case_sections
+)
+from test_gemini.mapreduce import parse_requirements
+from test_gemini.settings import env_bool
+
+logger = logging.getLogger(__name__)
+
+_ID = r'^[A-Za-z0-9][A-Za-z0-9_.-]*$'
+# A requirement reference when the requirement IDs are not known
+_REQUIREMENT_REF = re.compile(r'\b[A-Z]{1,6}(?:-[A-Z]{1,6})*[-_]?\d+(?:\.\d+)*\b')
+_LIST_ITEM = re.compile(r'^\s*(?:[-*+•]|\d+[.)])\s+')
+
+# Test case field -> labels the designer uses for it
+_FIELD_LABELS = (
+    ('title', r'title|name|test case name'),
+    ('objective', r'(?:test )?objective|purpose|description|summary'),
+    ('preconditions', r'pre-?conditions?|setup|initial (?:state|conditions?)'),
+    ('test_data', r'test data|test inputs?|inputs?'),
+    ('steps', r'(?:test )?steps|(?:test )?procedure|actions'),
+    ('expected', r'expected(?: (?:results?|outcomes?|behaviou?r|outputs?))?'),
+    ('pass_criteria', r'pass(?:/fail)? criteria|acceptance criteria'),
+    ('requirements', r'requirements?(?: (?:ids?|covered|verified|traced|references?))?|traceability|verifies|covers'),
+    ('environment', r'(?:test )?environment'),
+    ('priority', r'priority'),
+)
+_FIELDS = [
+    (field, re.compile(r'^\s*(?:[-*+]\s+|#{1,6}\s+)?[*_]*(?:' + labels + r')[*_]*\s*(?::[*_]*\s*(.*))?$', re.IGNORECASE))
+    for field, labels in _FIELD_LABELS
+]
+
+# What the test_script_developer needs of a test case (besides its ID, title and requirements)
+IMPLEMENTATION_FIELDS = ('preconditions', 'test_data', 'steps', 'expected')
+
+
+class HandoffError(Exception):
+    """Raised when a stage output does not yield a valid structure."""
+
+
+class Requirement(BaseModel):
+    id: str = Field(pattern=_ID)
+    category: str
+    text: str = Field(min_length=1)
+
+    @field_validator('category')
+    @classmethod
+    def known_category(cls, value):
+        if value not in CATEGORY_PREFIXES:
+            raise ValueError(f"unknown requirement category: {value}")
+        return value
+
+
+class RequirementSet(BaseModel):
+    requirements: List[Requirement] = Field(min_length=1)
+
+    @model_validator(mode='after')
+    def unique_ids(self):
+        ids = [requirement.id for requirement in self.requirements]
+        repeated = sorted({rid for rid in ids if ids.count(rid) > 1})
+        if repeated:
+            raise ValueError(f"repeated requirement IDs: {', '.join(repeated)}")
+        return self
+
+    def ids(self):
+        return [requirement.id for requirement in self.requirements]
+
+
+class TestCase(BaseModel):
+    id: str = Field(pattern=TEST_CASE_ID.pattern)
+    title: str = ''
+    suite: Optional[str] = None
+    requirement_ids: List[str] = Field(default_factory=list)
+    objective: str = ''
+    preconditions: str = ''
+    test_data: str = ''
+    steps: List[str] = Field(default_factory=list)
+    expected: str = ''
+    pass_criteria: str = ''
+    # Text under no recognized label
+    details: str = ''
+
+    @field_validator('requirement_ids')
+    @classmethod
+    def valid_requirement_ids(cls, value):
+        for rid in value:
+            if not re.match(_ID, rid):
+                raise ValueError(f"invalid requirement ID: {rid}")
+        return value
+
+
+class Coverage(BaseModel):
+    requirement_id: str
+    category: Optional[str] = None
+    test_case_ids: List[str] = Field(default_factory=list)
+
+
+class TestDesign(BaseModel):
+    test_cases: List[TestCase] = Field(min_length=1)
+    coverage: List[Coverage] = Field(default_factory=list)
+    environment: str = ''
+    uncovered_requirement_ids: List[str] = Field(default_factory=list)
+    unknown_requirement_ids: List[str] = Field(default_factory=list)
+
+    @model_validator(mode='after')
+    def unique_ids(self):
+        ids = [test_case.id for test_case in self.test_cases]
+        repeated = sorted({tid for tid in ids if ids.count(tid) > 1})
+        if repeated:
+            raise ValueError(f"repeated test case IDs: {', '.join(repeated)}")
+        return self
+
+
+def should_structure():
+    """Whether stages hand structured, compact context downstream (STRUCTURED_HANDOFF)."""
+    return env_bool('STRUCTURED_HANDOFF', True)
+
+
+def _validated(model, **fields):
+    try:
+        return model(**fields)
+    except ValidationError as e:
+        raise HandoffError('; '.join(
+            f"{'.'.join(str(part) for part in error['loc']) or model.__name__}: {error['msg']}" for error in e.errors()
+        )) from e
+
+
+def structure_requirements(text):
+    """The RequirementSet of a requirements document. Raises HandoffError."""
+    requirements = [
+        {'id': rid, 'category': category, 'text': requirement}
+        for category, entries in identify_requirements(parse_requirements(text))
+        for rid, requirement in entries
+    ]
+    return _validated(RequirementSet, requirements=requirements)
+
+
+def _test_case_title(line, test_case_id):
+    title = line.strip().lstrip('#-*+ ').strip()
+    title = title[title.find(test_case_id) + len(test_case_id):] if test_case_id in title else title
+    title = re.sub(r'^[*_`\]]*\s*[:.)\-–]?\s*', '', title)
+    return re.sub(r'[*_`]+', '', title).strip()
+
+
+def _field_of(line):
+    """(field, inline text) when line starts a labelled field, else None."""
+    for field, pattern in _FIELDS:
+        match = pattern.match(line)
+        if match:
+            return field, (match.group(1) or '').strip()
+    return None
+
+
+def _parse_test_case(test_case_id, block, suite):
+    """The fields of one test case block."""
+    first, *lines = block.splitlines()
+    fields = {'title': _test_case_title(first, test_case_id)}
+    collected = {}
+    current = 'details'
+    for line in lines:
+        if not line.strip():
+            continue
+        labelled = _field_of(line)
+        if labelled:
+            current, text = labelled
+            collected.setdefault(current, [])
+            if text:
+                collected[current].append(text)
+        else:
+            collected.setdefault(current, []).append(line.rstrip())
+
+    for field, values in collected.items():
+        if field == 'steps':
+            steps = []
+            for value in values:
+                item = _LIST_ITEM.match(value)
+                if item or not steps:
+                    steps.append(value[item.end():].strip() if item else value.strip())
+                else:
+                    steps[-1] += ' ' + value.strip()
+            # An inline list ("Steps: a, b, c") stays one step
+            fields['steps'] = [step for step in steps if step]
+        elif field == 'title':
+            fields['title'] = fields['title'] or ' '.join(value.strip() for value in values)
+        elif field not in ('environment', 'priority'):
+            fields[field] = '\n'.join(value.strip() for value in values).strip()
+    fields['suite'] = suite
+    return test_case_id, fields, block
+
+
+def _merge(existing, fields):
+    """Fill the empty fields of a test case seen before (e.g. in a summary list) from a later block."""
+    for field, value in fields.items():
+        if value and not existing.get(field):
+            existing[field] = value
+
+
+def structure_test_design(text, requirements=None):
+    """
+    The TestDesign of a test case document. With the upstream RequirementSet
+    a test case verifies every known requirement ID its block (or a coverage
+    table row naming it) mentions, and coverage lists every requirement;
+    without it the IDs under a requirements label are taken as they are.
+    Raises HandoffError.
+    """
+    known = requirements.ids() if requirements is not None else []
+    categories = {requirement.id: requirement.category for requirement in requirements.requirements} if known else {}
+    mention = re.compile(
+        r'(?<![\w-])(' + '|'.join(re.escape(rid) for rid in sorted(known, key=len, reverse=True)) + r')(?![\w-])'
+    ) if known else None
+
+    def referenced(text):
+        if mention is not None:
+            return mention.findall(text)
+        return [ref for ref in _REQUIREMENT_REF.findall(text) if not TEST_CASE_ID.fullmatch(ref)]
+
+    test_cases = {}
+    links = {}
+    environment = []
+    for section, preamble, blocks in test_case_sections(text):
+        if not blocks and section is not None and preamble and not TEST_CASE_ID.search(preamble):
+            environment.append(f"## {section}\n\n{preamble}")
+        for test_case_id, fields, block in (_parse_test_case(tid, block, section) for tid, block in blocks):
+            refs = referenced(block if mention is not None else fields.get('requirements', ''))
+            if test_case_id in test_cases:
+                _merge(test_cases[test_case_id], fields)
+            else:
+                test_cases[test_case_id] = fields
+            links.setdefault(test_case_id, [])
+            links[test_case_id].extend(ref for ref in refs if ref not in links[test_case_id])
+    # Rows of coverage and traceability tables
+    for line in (text or '').splitlines():
+        if line.lstrip().startswith('|'):
+            for test_case_id in TEST_CASE_ID.findall(line):
+                if test_case_id in links:
+                    links[test_case_id].extend(ref for ref in referenced(line) if ref not in links[test_case_id])
+
+    cases = []
+    for test_case_id, fields in test_cases.items():
+        fields = {field: value for field, value in fields.items() if field != 'requirements'}
+        cases.append(dict(fields, id=test_case_id, requirement_ids=links[test_case_id]))
+
+    referenced_ids = list(dict.fromkeys(rid for case in cases for rid in case['requirement_ids']))
+    coverage = [
+        {
+            'requirement_id': rid,
+            'category': categories.get(rid),
+            'test_case_ids': [case['id'] for case in cases if rid in case['requirement_ids']]
+        }
+        for rid in (known or referenced_ids)
+    ]
+    return _validated(
+        TestDesign,
+        test_cases=cases,
+        coverage=coverage,
+        environment='\n\n'.join(environment),
+        uncovered_requirement_ids=[entry['requirement_id'] for entry in coverage if not entry['test_case_ids']],
+        unknown_requirement_ids=[rid for rid in referenced_ids if known and rid not in known]
+    )
+
+
+def compact_requirements(requirement_set):
+    """The test design prompt's view of the requirements: ID and text per category, nothing else."""
+    by_category = {}
+    for requirement in requirement_set.requirements:
+        by_category.setdefault(requirement.category, []).append((requirement.id, requirement.text))
+    return '\n'.join(render_category_requirements(category, entries) for category, entries in by_category.items())
+
+
+def _compact_field(label, value):
+    return f"{label}: {value}" if '\n' not in value else f"{label}:\n{value}"
+
+
+def render_test_case(test_case):
+    """
+    A test case's compact form: heading with its ID and title, requirement
+    IDs and IMPLEMENTATION_FIELDS. A test case with neither steps nor
+    expected results keeps its unlabelled text.
+    """
+    lines = [f"### {test_case.id}: {test_case.title}".rstrip(': ')]
+    if test_case.requirement_ids:
+        lines.append(f"Verifies: {', '.join(test_case.requirement_ids)}")
+    labels = {'preconditions': 'Preconditions', 'test_data': 'Test data', 'expected': 'Expected'}
+    for field in IMPLEMENTATION_FIELDS:
+        if field == 'steps':
+            if test_case.steps:
+                lines.append('Steps:')
+                lines.extend(f"{number}. {step}" for number, step in enumerate(test_case.steps, start=1))
+        elif getattr(test_case, field):
+            lines.append(_compact_field(labels[field], getattr(test_case, field)))
+    if not test_case.steps and not test_case.expected and (test_case.details or test_case.objective):
+        lines.append(test_case.details or test_case.objective)
+    return '\n'.join(lines)
+
+
+def compact_test_design(design, topic_label=None):
+    """
+    The implementation prompt's view of a test design: the test environment
+    and, per suite, each test case in its compact form (render_test_case).
+    The result is itself a test design document, so it splits into the same
+    suites (see implementation_shards).
+    """
+    title = f"# Test Cases: {topic_label}" if topic_label else "# Test Cases"
+    lines = [title, '']
+    if design.environment:
+        lines.extend([design.environment, ''])
+    suite = None
+    for test_case in sorted(design.test_cases, key=lambda case: case.suite is not None):
+        if test_case.suite != suite:
+            suite = test_case.suite
+            lines.extend([f"## {suite}", ''])
+        lines.extend([render_test_case(test_case), ''])
+    return '\n'.join(lines).strip() + '\n'
+
+
+def handoff(stage, upstream, topic_label=None, stats=None):
+    """
+    The task context for stage from its upstream output: the compact
+    rendering of the structured upstream output, or upstream unchanged when
+    structured handoff is off or the output does not structure. stats (a
+    dict) receives the sizes before and after.
+    """
+    stats = stats if stats is not None else {}
+    stats.update({"structured": False, "upstream_chars": len(upstream or '')})
+    if not upstream or not should_structure():
+        stats["context_chars"] = len(upstream or '')
+        return upstream
+    try:
+        if stage == 'test-design':
+            context = compact_requirements(structure_requirements(upstream))
+        elif stage == 'test-implementation':
+            context = compact_test_design(structure_test_design(upstream), topic_label)
+        else:
+            raise ValueError(f"{stage} takes no upstream stage output")
+    except HandoffError as e:
+        logger.warning(f"Passing the {stage} context unstructured: {str(e)}")
+        stats.update({"context_chars": len(upstream), "error": str(e)})
+        return upstream
+    stats.update({"structured": True, "context_chars": len(context)})
+    return context
+
+
+def structured_output(stage, output, upstream=None):
+    """
+    The JSON form of a requirements or test design output for API
+    responses; test designs are linked to the requirements of upstream.
+    An output that fails validation gives {"errors": [...]}.
+    """
+    try:
+        if stage == 'requirements':
+            return structure_requirements(output).model_dump()
+        if stage == 'test-design':
+            try:
+                requirements = structure_requirements(upstream) if upstream else None
+            except HandoffError:
+                requirements = None
+            return structure_test_design(output, requirements).model_dump()
+    except HandoffError as e:
+        return {"errors": str(e).split('; ')}
+    return None
@@ -0,0 +1,329 @@
+"""
+Sharded test implementation: one Google Test file per suite.
+
+test_script_implementation_task writes the whole C++ implementation in one
+long generation. Here the test design is grouped into suites (the category
+sections of a per-category design, else test case ID prefixes, split
+further beyond IMPLEMENTATION_SUITE_SIZE test cases). The
+test_script_developer first writes a shared header with the mocks and
+fixtures, then every suite concurrently into its own .cpp file that
+includes the header. The files compile in parallel, and a failed shard can
+be regenerated on its own (regenerate_shard) against the stored header.
+
+The stage output is a Markdown manifest with one fenced block per file
+(see render_manifest); implementation_files() turns any
+test-implementation output, sharded or not, into the files to store.
+"""
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from test_gemini.cache import get_stage_cache
+from test_gemini.category_design import TEST_CASE_ID, test_case_sections
+from test_gemini.crew_pool import get_crew_pool
+from test_gemini.revisions import bind_revision, current_revision, reuse_or_generate
+from test_gemini.run_files import IMPLEMENTATION_FILE
+from test_gemini.settings import env_bool, env_int
+from test_gemini.stages import execute_stage
+from test_gemini.streaming import bind_stream, current_stream, publish
+
+logger = logging.getLogger(__name__)
+
+HEADER_FILE = 'test_fixtures.h'
+MANIFEST_FILE = 'test_implementation.md'
+
+_CODE_FENCE = re.compile(r'^```[ \t]*([\w+#.-]*)[ \t]*\n(.*?)^```[ \t]*$', re.MULTILINE | re.DOTALL)
+_CPP_LANGUAGES = ('', 'cpp', 'c++', 'cc', 'cxx', 'h', 'hpp', 'c')
+_MANIFEST_FILE = re.compile(
+    r'^#{2,3} `?([A-Za-z0-9_][A-Za-z0-9_.-]*\.(?:h|hh|hpp|cc|cpp|cxx))`?[ \t]*\n+```[\w+]*[ \t]*\n(.*?)^```[ \t]*$',
+    re.MULTILINE | re.DOTALL
+)
+
+
+class ShardNotFound(Exception):
+    """Raised when a shard to regenerate is not part of the run's implementation."""
+
+
+def should_shard(sharded=None):
+    """Whether the implementation is generated per suite: an explicit request wins, else IMPLEMENTATION_SHARDED."""
+    if sharded is not None:
+        return bool(sharded)
+    return env_bool('IMPLEMENTATION_SHARDED', True)
+
+
+def strip_code_fences(text):
+    """
+    The C++ inside Markdown code fences (every C++ or untagged block, in
+    order), or the text itself when it has no fences.
+    """
+    blocks = [(match.group(1).lower(), match.group(2).rstrip()) for match in _CODE_FENCE.finditer(text or '')]
+    code = [block for language, block in blocks if language in _CPP_LANGUAGES] or [block for _, block in blocks]
+    return ('\n\n'.join(code) if code else (text or '').strip()) + '\n'
+
+
+def _slug(title):
+    words = re.findall(r'[A-Za-z0-9]+', re.sub(r'\b(?:test\s*cases?|tests?|requirements?)\b', ' ', title, flags=re.IGNORECASE))
+    return '_'.join(word.lower() for word in words) or 'suite'
+
+
+def _suite_name(slug):
+    return ''.join(word.capitalize() for word in slug.split('_')) + 'Tests'
+
+
+def split_suites(design, minimum=2):
+    """
+    Group a test design into suites: [(suite, file_name, text), ...]. Suites
+    are the document's level-2 sections (e.g. 'Safety Test Cases' from a
+    per-category design), else the test case ID prefixes (TC-SF-...);
+    suites with more than IMPLEMENTATION_SUITE_SIZE test cases are split.
+    A design that yields fewer than minimum suites is not sharded ([]).
+    """
+    groups = {}
+    for section, preamble, blocks in test_case_sections(design):
+        if section is not None and (blocks or TEST_CASE_ID.search(preamble)):
+            groups.setdefault(section, (preamble, []))[1].extend(blocks)
+            continue
+        for test_case_id, block in blocks:
+            prefix = re.match(r'TC[-_]?([A-Z]{2})[-_]?\d', test_case_id)
+            name = f"{prefix.group(1)} Test Cases" if prefix else 'Test Cases'
+            groups.setdefault(name, ('', []))[1].append((test_case_id, block))
+
+    size = max(1, env_int('IMPLEMENTATION_SUITE_SIZE', 12))
+    suites = []
+    for title, (preamble, blocks) in groups.items():
+        slug = _slug(title)
+        suite = _suite_name(slug)
+        parts = [blocks[index:index + size] for index in range(0, len(blocks), size)] or [[]]
+        for number, part in enumerate(parts, start=1):
+            suffix = '' if number == 1 else f"_{number}"
+            text = '\n\n'.join(filter(None, [f"## {title}", preamble] + [block for _, block in part]))
+            suites.append((suite + suffix.replace('_', ''), f"test_{slug}{suffix}.cpp", text))
+    return suites if len(suites) >= minimum else []
+
+
+def _shared_text(design):
+    """The parts of a test design that belong to no suite (e.g. the test environment)."""
+    return '\n\n'.join(
+        '\n\n'.join(filter(None, [f"## {section}" if section else None, preamble]))
+        for section, preamble, blocks in test_case_sections(design)
+        if not blocks and preamble and not TEST_CASE_ID.search(preamble)
+    )
+
+
+def _outline(suites):
+    """Compact list of the suites and their test case titles for the header task."""
+    lines = []
+    for suite, file_name, text in suites:
+        lines.append(f"- {suite} ({file_name}):")
+        for line in text.splitlines():
+            if TEST_CASE_ID.search(line) and not line.lstrip().startswith('|'):
+                lines.append(f"  - {line.strip().lstrip('#-*+ ').strip()}")
+    return '\n'.join(lines)
+
+
+def _header_context(suites, preamble):
+    return (
+        f"Write only the shared header {HEADER_FILE} for the Google Test suites listed below: includes, "
+        "mock classes and interfaces, test fixtures with setup/teardown, and helpers that several suites use. "
+        "Do not write TEST, TEST_F or TEST_P cases; each suite is generated separately into its own .cpp file "
+        "that includes this header.\n\n"
+        + (f"Test environment:\n{preamble}\n\n" if preamble else '')
+        + f"Suites:\n{_outline(suites)}\n"
+    )
+
+
+def _requirements_header_context(categories, requirements):
+    suites = '\n'.join(
+        f"- {_suite_name(slug)} (test_{slug}.cpp)"
+        for slug in (_slug(category.replace('Requirements', 'Test Cases')) for category in categories)
+    )
+    return (
+        f"Write only the shared header {HEADER_FILE} for the Google Test suites that will test the requirements "
+        "below, one suite per requirement category: includes, mock classes and interfaces, test fixtures with "
+        "setup/teardown, and helpers that several suites use. Do not write TEST, TEST_F or TEST_P cases; the test "
+        "cases are designed and generated separately into each suite's .cpp file, which includes this header.\n\n"
+        f"Suites:\n{suites}\n\n"
+        f"Requirements:\n{requirements}\n"
+    )
+
+
+def _shard_context(suite, file_name, text, header):
+    return (
+        f"Write only {file_name}: the Google Test cases of suite {suite} for the test cases below. "
+        f"Start with #include \"{HEADER_FILE}\" and use its mocks and fixtures instead of redefining them; "
+        "the other suites are generated separately. Put helpers of this file in an anonymous namespace.\n\n"
+        f"{HEADER_FILE}:\n```cpp\n{header.rstrip()}\n```\n\n"
+        f"Test cases:\n{text}\n"
+    )
+
+
+def _generate(kind, inputs, context, use_cache, tools, reuse_key=None):
+    """
+    One cached test_script_developer generation; kind names its stage cache
+    namespace, reuse_key (default: the cache key) its entry in a revision.
+    Returns (code, cached).
+    """
+    cache = get_stage_cache()
+    key = cache.key(kind, dict(inputs, context=context, tools=bool(tools)))
+
+    def generate():
+        if use_cache:
+            cached = cache.get(kind, key)
+            if cached is not None:
+                return cached, True
+        else:
+            cache.record_bypass(kind)
+        code = strip_code_fences(execute_stage('test-implementation', inputs, context, tools=tools))
+        cache.put(kind, key, code)
+        return code, False
+
+    return reuse_or_generate(kind, reuse_key or key, generate)
+
+
+def implement_header(requirements, categories, inputs, use_cache=True, tools=None):
+    """
+    The shared header of a pipelined implementation (see pipelining.py),
+    written from the requirements while their test cases are still being
+    designed. categories name the suites it serves. Returns (code, cached).
+    """
+    started = time.perf_counter()
+    header, cached = _generate(
+        'test-implementation-header', inputs, _requirements_header_context(categories, requirements), use_cache, tools
+    )
+    logger.info(f"Shared header {HEADER_FILE} generated in {time.perf_counter() - started:.1f}s" + (" (cached)" if cached else ""))
+    publish('shard_completed', stage='test-implementation', file=HEADER_FILE, cached=cached)
+    return header, cached
+
+
+def generate_shard(suite, file_name, text, header, inputs, use_cache, tools=None, stream=None, revision=None):
+    """One suite file against the shared header, on the caller's stream and revision. Returns (code, cached)."""
+    with bind_stream(stream), bind_revision(revision):
+        started = time.perf_counter()
+        code, cached = _generate('test-implementation-shard', inputs, _shard_context(suite, file_name, text, header), use_cache, tools)
+        logger.info(f"Test shard {file_name} generated in {time.perf_counter() - started:.1f}s" + (" (cached)" if cached else ""))
+        publish('shard_completed', stage='test-implementation', file=file_name, suite=suite, cached=cached)
+    return code, cached
+
+
+def render_manifest(files, topic_label=None):
+    """The stage output of a sharded implementation: one heading and fenced block per file."""
+    title = f"# Test Implementation: {topic_label}" if topic_label else "# Test Implementation"
+    lines = [title, '']
+    for name, code in files.items():
+        lines.extend([f"## {name}", '', "```cpp", code.rstrip(), '```', ''])
+    return '\n'.join(lines)
+
+
+def parse_manifest(result):
+    """{file_name: code} of a sharded implementation output, in order; {} for a single-file output."""
+    return {match.group(1): match.group(2).rstrip() + '\n' for match in _MANIFEST_FILE.finditer(result or '')}
+
+
+def source_files(result):
+    """{file_name: code} of a test-implementation output: its shards, else IMPLEMENTATION_FILE without Markdown fences."""
+    return parse_manifest(result) or {IMPLEMENTATION_FILE: strip_code_fences(result)}
+
+
+def replace_source_files(result, files, topic_label=None):
+    """The test-implementation output with its source files replaced by files ({file_name: code})."""
+    if parse_manifest(result):
+        return render_manifest(dict(parse_manifest(result), **files), topic_label)
+    return f"```cpp\n{files[IMPLEMENTATION_FILE].rstrip()}\n```"
+
+
+def implementation_files(result):
+    """
+    The files to store for a test-implementation output, as [(name,
+    content), ...] with the primary file first: the manifest plus every
+    shard for a sharded output, else IMPLEMENTATION_FILE (compilable C++,
+    without the Markdown fences the model wraps it in).
+    """
+    if not parse_manifest(result):
+        return list(source_files(result).items())
+    return [(MANIFEST_FILE, result)] + list(source_files(result).items())
+
+
+def implement_sharded(design, inputs, use_cache=True, stats=None, tools=None, sharded=None):
+    """
+    The test implementation stage for a test design. When sharding is
+    enabled and the design has at least two suites, the shared header is
+    generated first and then the suites, up to
+    IMPLEMENTATION_SHARD_CONCURRENCY at once (each on its own pooled crew),
+    and the manifest of all files is returned. Otherwise the whole design
+    goes to a single test_script_implementation_task as before. stats (a
+    dict) receives the suites and timings.
+    """
+    stats = stats if stats is not None else {}
+    suites = split_suites(design) if should_shard(sharded) else []
+    if not suites:
+        stats.update({"sharded": False})
+        return execute_stage('test-implementation', inputs, design, tools=tools)
+
+    preamble = _shared_text(design)
+    concurrency = max(1, min(
+        env_int('IMPLEMENTATION_SHARD_CONCURRENCY', 4),
+        get_crew_pool().size,
+        len(suites)
+    ))
+    logger.info(f"Implementing {len(suites)} test suites, {concurrency} at a time")
+    publish('sharding', stage='test-implementation', suites=[file_name for _, file_name, _ in suites], concurrency=concurrency)
+
+    started = time.perf_counter()
+    # A revision keeps its previous header while the set of suites is the
+    # same, so the shards of unchanged suites keep identical inputs
+    header, header_cached = _generate(
+        'test-implementation-header', inputs, _header_context(suites, preamble), use_cache, tools,
+        reuse_key='header:' + ','.join(file_name for _, file_name, _ in suites)
+    )
+    publish('shard_completed', stage='test-implementation', file=HEADER_FILE, cached=header_cached)
+    header_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='test-shard') as executor:
+        futures = [
+            executor.submit(generate_shard, suite, file_name, text, header, inputs, use_cache, tools, current_stream(), current_revision())
+            for suite, file_name, text in suites
+        ]
+        outcomes = [future.result() for future in futures]
+    shard_seconds = time.perf_counter() - started
+
+    files = {HEADER_FILE: header}
+    files.update((file_name, code) for (_, file_name, _), (code, _) in zip(suites, outcomes))
+    stats.update({
+        "sharded": True,
+        "suites": len(suites),
+        "concurrency": concurrency,
+        "files": list(files),
+        "cached_shards": sum(1 for _, cached in outcomes if cached) + (1 if header_cached else 0),
+        "header_seconds": round(header_seconds, 3),
+        "shard_seconds": round(shard_seconds, 3)
+    })
+    return render_manifest(files, inputs.get('topic'))
+
+
+def regenerate_shard(result, design, shard, inputs, stats=None, tools=None):
+    """
+    Regenerate one suite file (by file name or suite name) of a sharded
+    implementation against its stored header, bypassing the cache, and
+    return the updated manifest. Raises ShardNotFound for an unknown shard.
+    """
+    stats = stats if stats is not None else {}
+    files = parse_manifest(result)
+    if HEADER_FILE not in files:
+        raise ShardNotFound("The implementation is not sharded; regenerate the whole stage instead")
+    matches = [entry for entry in split_suites(design) if shard in (entry[0], entry[1])]
+    if not matches:
+        raise ShardNotFound(f"Unknown shard: {shard} (known: {', '.join(name for name in files if name != HEADER_FILE)})")
+    suite, file_name, text = matches[0]
+
+    started = time.perf_counter()
+    code, _ = generate_shard(suite, file_name, text, files[HEADER_FILE], inputs, use_cache=False, tools=tools, stream=current_stream())
+    files[file_name] = code
+    stats.update({
+        "sharded": True,
+        "regenerated": file_name,
+        "files": list(files),
+        "shard_seconds": round(time.perf_counter() - started, 3)
+    })
+    return render_manifest(files, inputs.get('topic'))
@@ -0,0 +1,302 @@
+"""
+Background job subsystem for long-running crew executions.
+
+Routes submit work here and return a job ID immediately; a bounded pool of
+worker threads drains the queue and runs the crew. Queue depth, worker count
+and how many finished jobs are remembered are configurable through
+JOB_QUEUE_SIZE, JOB_WORKERS and JOB_HISTORY_LIMIT.
+
+Every state change is also written as a JSON snapshot under JOBS_DIR, so
+when the server runs several worker processes a job's status and result
+can be read from whichever worker serves the request, not only the one
+executing it.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from test_gemini.settings import env_int, state_path
+from test_gemini.storage import DiskStore
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class Job:
+    """A single unit of queued crew work and its outcome."""
+
+    def __init__(self, kind, target, args=(), kwargs=None, describe=None, build_payload=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.describe = describe or {}
+        self.build_payload = build_payload
+        self.status = QUEUED
+        self.message = None
+        self.payload = None
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def to_dict(self, include_result=False):
+        """Serialize the job for status/list responses."""
+        data = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "message": self.message,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+        data.update(self.describe)
+        if include_result and self.payload is not None:
+            data["result"] = self.payload
+        return data
+
+    @classmethod
+    def from_snapshot(cls, data):
+        """Rebuild a (read-only) job from a snapshot written by another process."""
+        data = dict(data)
+        job = cls(data.pop('kind', None), None)
+        job.id = data.pop('job_id')
+        job.status = data.pop('status', QUEUED)
+        job.message = data.pop('message', None)
+        job.payload = data.pop('result', None)
+        for name in ('created_at', 'started_at', 'finished_at'):
+            value = data.pop(name, None)
+            setattr(job, name, datetime.fromisoformat(value) if value else None)
+        job.describe = data
+        return job
+
+
+class JobManager:
+    """Bounded queue plus a fixed pool of worker threads."""
+
+    def __init__(self, workers=4, queue_size=500, history_limit=1000, snapshots=None):
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.history_limit = max(1, history_limit)
+        self.snapshots = snapshots
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._started = False
+        self._stopping = False
+
+    def start(self):
+        """Start the worker threads (idempotent)."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for index in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    name=f"crew-job-worker-{index}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"Job manager started with {self.workers} workers (queue size {self.queue_size})")
+
+    def submit(self, kind, target, *args, describe=None, build_payload=None, **kwargs):
+        """
+        Queue target(*args, **kwargs) and return the Job.
+
+        target must return the usual (success, message, result) tuple;
+        build_payload(success, message, result) turns it into the JSON payload
+        served from the result endpoint.
+        """
+        if self._stopping:
+            raise QueueFullError("Job manager is shutting down")
+        self.start()
+
+        job = Job(kind, target, args, kwargs, describe=describe, build_payload=build_payload)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            raise QueueFullError(f"Job queue is full ({self.queue_size} pending jobs)")
+        self._save_snapshot(job)
+
+        logger.info(f"Queued {kind} job {job.id}")
+        self._prune()
+        return job
+
+    def get(self, job_id):
+        """The job, or its latest snapshot when another worker process runs it."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.snapshots is not None and job_id.isalnum():
+            snapshot = self.snapshots.get(job_id)
+            if snapshot is not None:
+                job = Job.from_snapshot(snapshot)
+        return job
+
+    def list(self, status=None, kind=None, limit=50):
+        """Return the most recent jobs first, optionally filtered."""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        jobs.reverse()
+        if status:
+            jobs = [job for job in jobs if job.status == status]
+        if kind:
+            jobs = [job for job in jobs if job.kind == kind]
+        return jobs[:max(0, limit)]
+
+    def cancel(self, job_id, message="Cancelled before execution"):
+        """
+        Cancel a job that has not started yet. Returns True on success. Only
+        jobs queued in this process can be cancelled.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or job.status != QUEUED:
+                return False
+            job.status = CANCELLED
+            job.message = message
+            job.finished_at = datetime.now()
+        self._save_snapshot(job)
+        return True
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "queue_depth": self._queue.qsize(),
+            "jobs": counts
+        }
+
+    def shutdown(self, wait=True, timeout=None):
+        """Stop accepting work and let the workers drain the queue."""
+        self._stopping = True
+        for _ in self._threads:
+            self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join(timeout)
+
+    def drain(self, timeout=None):
+        """
+        Graceful stop for a server process that is going away: cancel the
+        jobs still queued (nothing would run them), then wait up to timeout
+        seconds for the running ones to finish. Returns how many were cancelled.
+        """
+        self._stopping = True
+        with self._lock:
+            queued = [job.id for job in self._jobs.values() if job.status == QUEUED]
+        cancelled = sum(1 for job_id in queued if self.cancel(job_id, "Cancelled: server shutting down"))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return cancelled
+
+    def _worker_loop(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._execute(job)
+            finally:
+                self._queue.task_done()
+
+    def _execute(self, job):
+        with self._lock:
+            if job.status == CANCELLED:
+                return
+            job.status = RUNNING
+            job.started_at = datetime.now()
+        self._save_snapshot(job)
+
+        logger.info(f"Running {job.kind} job {job.id}")
+        try:
+            success, message, result = job.target(*job.args, **job.kwargs)
+            payload = job.build_payload(success, message, result) if job.build_payload else result
+            status = SUCCEEDED if success else FAILED
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {str(e)}")
+            success, message, payload = False, f"Error: {str(e)}", None
+            status = FAILED
+
+        with self._lock:
+            job.status = status
+            job.message = message
+            job.payload = payload
+            job.finished_at = datetime.now()
+            # Drop references to the (possibly large) inputs once finished
+            job.args, job.kwargs = (), {}
+        self._save_snapshot(job)
+        logger.info(f"Job {job.id} finished with status {status}")
+
+    def _save_snapshot(self, job):
+        if self.snapshots is None:
+            return
+        try:
+            self.snapshots.put(job.id, job.to_dict(include_result=True))
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not write snapshot of job {job.id}: {str(e)}")
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond the history limit."""
+        with self._lock:
+            excess = len(self._jobs) - self.history_limit
+            if excess <= 0:
+                return
+            for job_id in [job_id for job_id, job in self._jobs.items() if job.finished][:excess]:
+                del self._jobs[job_id]
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """Return the process-wide JobManager, creating it from the environment."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager(
+                workers=env_int('JOB_WORKERS', 4),
+                queue_size=env_int('JOB_QUEUE_SIZE', 500),
+                history_limit=env_int('JOB_HISTORY_LIMIT', 1000),
+                snapshots=DiskStore(
+                    os.environ.get('JOBS_DIR') or state_path('jobs'),
+                    max_bytes=env_int('JOBS_MAX_BYTES', 256 * 1024 * 1024),
+                    ttl_seconds=env_int('JOBS_TTL', 7 * 24 * 3600)
+                )
+            )
+        return _manager
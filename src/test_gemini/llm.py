@@ -0,0 +1,48 @@
+"""
+LLM selection for the crew's agents.
+
+crew.py asks agent_llm(name) for the LLM of each agent (named as in
+agents.yaml). By default there is no factory and crewai picks the model
+from the environment as before. set_llm_factory() installs a
+factory(agent_name) -> LLM that is used instead; the offline benchmark
+swaps in FakeLLM this way. Whichever LLM results is wrapped in a
+GovernedLLM that keeps its calls within the host's rate limits (see
+governor.py) unless LLM_GOVERNOR is off, and, unless LLM_CACHE_MODE is
+passthrough, in a CachedLLM that records and replays its completions (see
+llm_cache.py), so replayed completions take no quota.
+
+Crews already built keep their LLMs, so install the factory before the
+crew pool builds crews (or build a new pool).
+"""
+import threading
+
+_factory = None
+_factory_lock = threading.Lock()
+
+
+def set_llm_factory(factory):
+    """Use factory(agent_name) for agents built from now on; None restores the default."""
+    global _factory
+    with _factory_lock:
+        _factory = factory
+
+
+def agent_llm(name):
+    """The LLM for the named agent, or None to let crewai choose from the environment (no governor or cache)."""
+    with _factory_lock:
+        factory = _factory
+    llm = factory(name) if factory is not None else None
+
+    from test_gemini.governor import GovernedLLM, get_llm_governor, should_govern
+    from test_gemini.llm_cache import PASSTHROUGH, CachedLLM, cache_mode, get_llm_cache
+    mode = cache_mode()
+    if mode == PASSTHROUGH and not should_govern():
+        return llm
+    if llm is None:
+        from crewai.utilities.llm_utils import create_llm
+        llm = create_llm(None)
+    if should_govern():
+        llm = GovernedLLM(llm, get_llm_governor(), agent_name=name)
+    if mode == PASSTHROUGH:
+        return llm
+    return CachedLLM(llm, get_llm_cache(), agent_name=name, mode=mode)
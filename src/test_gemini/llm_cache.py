@@ -0,0 +1,179 @@
+"""
+Record/replay cache for individual LLM completions.
+
+The stage cache (cache.py) only helps when a whole stage's inputs are
+unchanged. This cache works one level lower: every completion the agents
+request is keyed by the exact messages, the model, the sampling parameters
+and the stop words, so a re-run after a small prompt edit or a retry reuses
+each call whose prompt did not change. Entries are zlib-compressed JSON in
+a size- and TTL-bounded DiskStore.
+
+LLM_CACHE_MODE selects the behaviour (llm.py wraps each agent's LLM in a
+CachedLLM unless the mode is passthrough):
+- passthrough (default): no caching, every call goes to the model;
+- record: serve recorded completions, call the model on a miss and record it;
+- replay: serve recorded completions only; a miss raises LLMCacheMiss, so
+  `crew().test(...)`, `replay` and regression runs are fast, deterministic
+  and never reach the model.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from crewai.llms.base_llm import BaseLLM
+
+from test_gemini.metrics import get_metrics
+from test_gemini.settings import env_int, state_path
+from test_gemini.storage import DiskStore
+
+logger = logging.getLogger(__name__)
+
+PASSTHROUGH = 'passthrough'
+RECORD = 'record'
+REPLAY = 'replay'
+MODES = (PASSTHROUGH, RECORD, REPLAY)
+
+# LLM attributes that change what the model returns
+SAMPLING_PARAMETERS = (
+    'temperature', 'top_p', 'n', 'max_tokens', 'max_completion_tokens', 'presence_penalty',
+    'frequency_penalty', 'logit_bias', 'seed', 'response_format', 'reasoning_effort'
+)
+
+
+class LLMCacheMiss(RuntimeError):
+    """Raised in replay mode when a completion was never recorded."""
+
+
+def cache_mode():
+    """LLM_CACHE_MODE, falling back to passthrough for unknown values."""
+    mode = (os.environ.get('LLM_CACHE_MODE') or PASSTHROUGH).strip().lower()
+    if mode not in MODES:
+        logger.warning(f"Unknown LLM_CACHE_MODE '{mode}', using {PASSTHROUGH}")
+        return PASSTHROUGH
+    return mode
+
+
+class LLMCallCache:
+    """Recorded completions on disk, with hit/miss/store counters."""
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, ttl_seconds=None):
+        self.disk = DiskStore(directory, max_bytes=max_bytes, ttl_seconds=ttl_seconds, compress=True)
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    @staticmethod
+    def key(model, messages, parameters=None, stop=None, tools=None):
+        material = json.dumps({
+            "model": model,
+            "messages": messages,
+            "parameters": parameters or {},
+            "stop": sorted(stop or []),
+            "tools": tools
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, key, agent=None):
+        record = self.disk.get(key)
+        self._count(agent, 'hits' if record is not None else 'misses')
+        return record['response'] if record is not None else None
+
+    def put(self, key, response, agent=None, model=None):
+        try:
+            self.disk.put(key, {"agent": agent, "model": model, "stored_at": time.time(), "response": response})
+        except OSError as e:
+            logger.warning(f"Could not record LLM completion: {str(e)}")
+            return
+        self._count(agent, 'stores')
+
+    def _count(self, agent, outcome):
+        with self._lock:
+            counters = self._counters.setdefault(agent or 'unknown', {})
+            counters[outcome] = counters.get(outcome, 0) + 1
+        get_metrics().inc('llm_cache_total', agent=agent or 'unknown', outcome=outcome)
+
+    def clear(self):
+        self.disk.clear()
+
+    def stats(self):
+        with self._lock:
+            by_agent = {agent: dict(counters) for agent, counters in self._counters.items()}
+        return {
+            "mode": cache_mode(),
+            "by_agent": by_agent,
+            "disk_bytes": self.disk.size_bytes(),
+            "max_bytes": self.disk.max_bytes
+        }
+
+
+class CachedLLM(BaseLLM):
+    """Wraps an agent's LLM so its completions are recorded and replayed."""
+
+    def __init__(self, llm, cache, agent_name=None, mode=RECORD):
+        super().__init__(model=llm.model, temperature=getattr(llm, 'temperature', None))
+        self.llm = llm
+        self.cache = cache
+        self.agent_name = agent_name
+        self.mode = mode
+        self.stop = list(getattr(llm, 'stop', None) or [])
+
+    # llm_streaming() toggles streaming on the wrapped model
+    @property
+    def stream(self):
+        return getattr(self.llm, 'stream', False)
+
+    @stream.setter
+    def stream(self, value):
+        if hasattr(self.llm, 'stream'):
+            self.llm.stream = value
+
+    def parameters(self):
+        return {
+            name: getattr(self.llm, name) for name in SAMPLING_PARAMETERS
+            if getattr(self.llm, name, None) is not None
+        }
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None):
+        key = self.cache.key(self.model, messages, self.parameters(), self.stop, tools)
+        response = self.cache.get(key, self.agent_name)
+        if response is not None:
+            return response
+        if self.mode == REPLAY:
+            raise LLMCacheMiss(f"No recorded completion for {self.agent_name or self.model} (key {key[:12]})")
+
+        # The executor sets stop words on the LLM it sees, i.e. this wrapper
+        self.llm.stop = self.stop
+        response = self.llm.call(messages, tools=tools, callbacks=callbacks, available_functions=available_functions)
+        # Only text completions are recorded; tool-call results are side effects
+        if isinstance(response, str):
+            self.cache.put(key, response, self.agent_name, self.model)
+        return response
+
+    def supports_stop_words(self):
+        return self.llm.supports_stop_words()
+
+    def supports_function_calling(self):
+        supports = getattr(self.llm, 'supports_function_calling', None)
+        return supports() if supports else False
+
+    def get_context_window_size(self):
+        return self.llm.get_context_window_size()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """Return the process-wide LLMCallCache configured from the environment."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCallCache(
+                directory=os.environ.get('LLM_CACHE_DIR') or state_path('llm_cache'),
+                max_bytes=env_int('LLM_CACHE_MAX_BYTES', 512 * 1024 * 1024),
+                ttl_seconds=env_int('LLM_CACHE_TTL', 30 * 24 * 3600)
+            )
+        return _cache
@@ -4,13 +4,32 @@ import os
 import json
 import warnings
 import logging
+import time
 from datetime import datetime
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, send_file, stream_with_context
 from flask_cors import CORS
-import PyPDF2
-import io
 
-from test_gemini.crew import TestGemini
+from test_gemini.batch import get_batch_manager
+# train, replay and test live in cli.py; re-exported for `python main.py train|replay|test`
+from test_gemini.cli import build_crew, replay, test, train
+from test_gemini.cache import get_stage_cache
+from test_gemini.category_design import design_test_cases, should_parallelize
+from test_gemini.compile_check import check_implementation, should_check
+from test_gemini.crew_pool import get_crew_pool
+from test_gemini.stages import STAGE_GRAPH, ArtifactNotFound, execute_stage, get_stage_store, upstream_of
+from test_gemini.documents import DocumentNotFound, get_document_store, text_from_upload, topic_label
+from test_gemini.handoff import handoff, should_structure, structured_output
+from test_gemini.implementation_shards import implement_sharded, implementation_files, regenerate_shard, should_shard
+from test_gemini.mapreduce import analyze_requirements_chunked, should_chunk
+from test_gemini.pipelining import run_pipelined, should_pipeline
+from test_gemini.run_files import PIPELINE_RESULT_FILE, get_run_file_store, inline_result
+from test_gemini.jobs import QueueFullError, get_job_manager
+from test_gemini.revisions import bind_revision, get_revision_store
+from test_gemini.retrieval import get_retrieval_index, index_stage_output, retrieval_tools
+from test_gemini.metrics import get_metrics, install_event_handlers as install_metrics_handlers, track_in_flight
+from test_gemini.settings import env_int, is_truthy
+from test_gemini.singleflight import get_single_flight, single_flight
+from test_gemini.streaming import RunEventStream, bind_stream, format_sse, llm_streaming, publish
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -20,134 +39,530 @@ logger = logging.getLogger(__name__)
 warnings.filterwarnings("ignore", category=SyntaxWarning, module="pysbd")
 
 # -------------------------------
-# 📄 PDF Processing Function
+# 🧠 Individual Agent Functions
 # -------------------------------
-def extract_text_from_pdf(pdf_file):
+def _cached_result(stage: str, inputs: dict, use_cache: bool, meta: dict = None):
     """
-    Extract text content from uploaded PDF file.
+    Consult the stage result cache. Returns (cache_key, cached_result), where
+    cached_result is None on a miss or when the caller bypassed the cache.
     """
-    try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text_content = ""
-        
-        for page in pdf_reader.pages:
-            text_content += page.extract_text() + "\n"
-        
-        if not text_content.strip():
-            raise Exception("No text content found in PDF")
-            
-        return text_content.strip()
-    
-    except Exception as e:
-        logger.error(f"Error extracting text from PDF: {str(e)}")
-        raise Exception(f"Failed to extract text from PDF: {str(e)}")
+    cache = get_stage_cache()
+    key = cache.key(stage, inputs)
+    if use_cache:
+        cached = cache.get(stage, key)
+        status = 'hit' if cached is not None else 'miss'
+    else:
+        cache.record_bypass(stage)
+        cached, status = None, 'bypass'
 
-# -------------------------------
-# 🧠 Individual Agent Functions
-# -------------------------------
-def run_requirements_analyst(topic: str, current_year: str = None):
+    if meta is not None:
+        meta['cache'] = status
+    return key, cached
+
+def _resolve_document(document_id: str, topic: str = None):
+    """
+    Text of a registered document and the topic it runs under (the caller's
+    topic, else a short label derived from the document). Returns (topic, text).
+    """
+    store = get_document_store()
+    record = store.get(document_id)
+    return topic or topic_label(record), store.text(record)
+
+def _run_tools(document: str, run_id: str = None):
+    """
+    Per-run tools added to the agents' own: retrieval over the source
+    document for agents that get upstream output as context, and the prior
+    artifact search without the run's own artifacts.
+    """
+    from test_gemini.tools.custom_tool import DocumentSearchTool
+    tools = retrieval_tools(run_id=run_id) if run_id else []
+    if document:
+        tools.insert(0, DocumentSearchTool(document=document))
+    return tools or None
+
+def _compile_checked(result: str, inputs: dict, meta: dict = None, compile_check: bool = None, document: str = None,
+                     run_id: str = None):
+    """
+    The generated test code after the optional compile check (and its
+    fix-up rounds, see compile_check.py), with the report in meta.
+    """
+    if not result or not should_check(compile_check):
+        return result
+    compile_stats = {}
+    result = check_implementation(result, inputs, stats=compile_stats, tools=_run_tools(document, run_id))
+    if meta is not None:
+        meta['compile_check'] = compile_stats
+    return result
+
+def _run_agent_stage(stage: str, title: str, topic: str, current_year: str, use_cache: bool,
+                     meta: dict, run_id: str, upstream_artifact_id: str, chunked: bool = None,
+                     document_id: str = None, parallel_design: bool = None, sharded: bool = None,
+                     shard: str = None, compile_check: bool = None):
+    """
+    Shared body of the run_* agent functions: resolve the upstream artifact
+    from the run, consult the cache, execute the stage and store its output
+    as a new artifact of the run. Returns (topic, result, served_from_cache).
+
+    A source document (document_id) is passed once as task context, or
+    through a retrieval tool when the task already gets upstream output;
+    only its short topic label fills the templates. Long documents go
+    through map-reduce requirements analysis (chunked=None decides by length);
+    test design from a requirements artifact runs per requirement category
+    unless parallel_design is False (see category_design.py), and the
+    implementation of a test design is generated per suite unless sharded is
+    False. shard regenerates one suite file of the run's latest sharded
+    implementation (see implementation_shards.py). The implementation is
+    compile-checked when compile_check (default COMPILE_CHECK) is on.
+
+    Upstream output reaches the agent in its compact structured form (see
+    handoff.py), and requirements and test designs are also returned as
+    JSON records in meta['structured'].
+    """
+    store = get_stage_store()
+    upstream_stage = upstream_of(stage)
+    context = None
+
+    if run_id:
+        topic = topic or store.topic_of(run_id)
+        document_id = document_id or store.document_of(run_id)
+        if upstream_stage:
+            try:
+                upstream = store.get(run_id, artifact_id=upstream_artifact_id, stage=upstream_stage)
+                context = upstream['content']
+                upstream_artifact_id = upstream['artifact_id']
+            except ArtifactNotFound:
+                # An explicit reference must exist; a bare run_id may simply
+                # not have produced the upstream stage yet
+                if upstream_artifact_id:
+                    raise
+    elif upstream_artifact_id:
+        raise ValueError("upstream_artifact_id requires the run_id it belongs to")
+
+    previous = None
+    if shard:
+        if stage != 'test-implementation' or not run_id:
+            raise ValueError("shard requires a test implementation run_id")
+        previous = store.get(run_id, stage='test-implementation')
+        if previous.get('upstream_artifact_id') and upstream_artifact_id != previous['upstream_artifact_id']:
+            # Regenerate against the design the implementation was built from
+            upstream = store.get(run_id, artifact_id=previous['upstream_artifact_id'])
+            context, upstream_artifact_id = upstream['content'], upstream['artifact_id']
+
+    document = None
+    if document_id:
+        topic, document = _resolve_document(document_id, topic)
+
+    if not topic:
+        raise ValueError("Topic is required (or a run_id whose artifacts record one)")
+
+    inputs = {
+        'topic': topic,
+        'current_year': current_year or str(datetime.now().year)
+    }
+    cache_inputs = dict(inputs)
+    if context:
+        cache_inputs['context'] = context
+    if document:
+        cache_inputs['document'] = document
+    chunked = stage == 'requirements' and should_chunk(document or topic, chunked)
+    if chunked:
+        cache_inputs['mode'] = 'chunked'
+    parallel_design = stage == 'test-design' and bool(context) and should_parallelize(parallel_design)
+    if parallel_design:
+        cache_inputs['mode'] = 'parallel-design'
+    sharded = stage == 'test-implementation' and bool(context) and should_shard(sharded)
+    if sharded:
+        cache_inputs['mode'] = 'sharded'
+    if context and should_structure():
+        cache_inputs['handoff'] = 'structured'
+
+    # Allocated up front so the agents' artifact search can leave the run out
+    run_id = run_id or store.new_id()
+    tools = _run_tools(document, run_id)
+
+    # Regenerating a shard replaces what the cache would return
+    key, cached = _cached_result(stage, cache_inputs, use_cache and not shard, meta)
+    if cached is not None:
+        logger.info(f"{title} served from cache for topic: {topic}")
+        result = cached
+    else:
+        if context:
+            logger.info(f"Starting {title} for topic: {topic} from {upstream_stage} artifact {upstream_artifact_id}")
+        else:
+            logger.info(f"Starting {title} for topic: {topic}")
+        task_context = context
+        if context:
+            handoff_stats = {}
+            task_context = handoff(stage, context, topic, stats=handoff_stats)
+            if meta is not None:
+                meta['handoff'] = {stage: handoff_stats}
+        if chunked:
+            chunk_stats = {}
+            result = analyze_requirements_chunked(
+                document or topic, inputs['current_year'], use_cache=use_cache, stats=chunk_stats,
+                topic=topic if document else None
+            )
+            if meta is not None:
+                meta['chunking'] = chunk_stats
+        elif parallel_design:
+            design_stats = {}
+            result = design_test_cases(
+                task_context, inputs, use_cache=use_cache, stats=design_stats, tools=tools, parallel=True
+            )
+            if meta is not None:
+                meta['test_design'] = design_stats
+        elif shard:
+            shard_stats = {}
+            result = regenerate_shard(
+                previous['content'], task_context, shard, inputs, stats=shard_stats, tools=tools
+            )
+            if meta is not None:
+                meta['implementation'] = shard_stats
+        elif sharded:
+            shard_stats = {}
+            result = implement_sharded(
+                task_context, inputs, use_cache=use_cache, stats=shard_stats, tools=tools, sharded=True
+            )
+            if meta is not None:
+                meta['implementation'] = shard_stats
+        elif document and not context:
+            result = execute_stage(stage, inputs, document, tools=_run_tools(None, run_id))
+        else:
+            result = execute_stage(stage, inputs, task_context, tools=tools)
+        get_stage_cache().put(stage, key, result)
+        logger.info(f"{title} completed for topic: {topic}")
+
+    if stage == 'test-implementation':
+        checked = _compile_checked(result, inputs, meta, compile_check, document, run_id)
+        if checked != result:
+            # Fix-ups replace the stored result
+            result = checked
+            get_stage_cache().put(stage, key, result)
+
+    record = store.save(
+        run_id, stage, result, topic=topic,
+        upstream_artifact_id=upstream_artifact_id if context else None,
+        document_id=document_id
+    )
+    if cached is None:
+        # A cached result was indexed when it was generated
+        index_stage_output(stage, result, topic=topic, run_id=run_id)
+    if meta is not None:
+        meta['run_id'] = run_id
+        meta['artifact_id'] = record['artifact_id']
+        if context:
+            meta['upstream_artifact_id'] = upstream_artifact_id
+        if document_id:
+            meta['topic'] = topic
+            meta['document_id'] = document_id
+    if stage == 'test-implementation':
+        # The generated C++ lives in the run's own directory, not a shared output_file
+        file_store = get_run_file_store()
+        files = [file_store.save(run_id, name, content) for name, content in implementation_files(result)]
+        if meta is not None:
+            meta['files'] = files
+            meta['result_file'] = files[0]
+    if meta is not None and stage in ('requirements', 'test-design'):
+        meta['structured'] = structured_output(stage, result, context)
+    publish('stage_output', stage=stage, run_id=run_id, artifact_id=record['artifact_id'], cached=cached is not None, content=result)
+
+    return topic, result, cached is not None
+
+@single_flight('requirements')
+@track_in_flight('requirements')
+def run_requirements_analyst(topic: str = None, current_year: str = None, use_cache: bool = True, meta: dict = None,
+                             run_id: str = None, upstream_artifact_id: str = None, chunked: bool = None,
+                             document_id: str = None):
     """
     Run only the Requirements Analyst agent.
+
+    The output is stored as the 'requirements' artifact of run_id (a new run
+    when omitted) so downstream agents can reuse it. Long specifications are
+    analyzed chunk by chunk and merged (see mapreduce.py).
     """
     try:
-        inputs = {
-            'topic': topic,
-            'current_year': current_year or str(datetime.now().year)
-        }
-        
-        logger.info(f"Starting Requirements Analysis for topic: {topic}")
-        
-        # Get the crew instance
-        crew_instance = TestGemini()
-        
-        # Execute only the requirements analyst task
-        # You'll need to modify this based on your actual crew structure
-        # This assumes you can access individual agents/tasks
-        requirements_result = crew_instance.crew().agents[0].execute_task(
-            crew_instance.crew().tasks[0], 
-            inputs
+        topic, requirements_result, cached = _run_agent_stage(
+            'requirements', 'Requirements Analysis', topic, current_year, use_cache, meta, run_id, upstream_artifact_id,
+            chunked=chunked, document_id=document_id
         )
-        
-        logger.info(f"Requirements Analysis completed for topic: {topic}")
-        return True, f"Requirements analysis completed for topic: {topic}", str(requirements_result)
+        return True, f"Requirements analysis completed for topic: {topic}" + (" (cached)" if cached else ""), requirements_result
 
     except Exception as e:
         logger.error(f"Requirements analysis failed for topic {topic}: {str(e)}")
         return False, f"Error in requirements analysis: {str(e)}", None
 
-def run_test_case_designer(topic: str, current_year: str = None):
+@single_flight('test-design')
+@track_in_flight('test-design')
+def run_test_case_designer(topic: str = None, current_year: str = None, use_cache: bool = True, meta: dict = None,
+                           run_id: str = None, upstream_artifact_id: str = None, document_id: str = None,
+                           parallel_design: bool = None):
     """
     Run only the Test Case Designer agent.
+
+    With run_id the designer works from the run's requirements artifact (the
+    latest one, or upstream_artifact_id) instead of re-deriving requirements,
+    designing each requirement category concurrently (parallel_design=None
+    follows TEST_DESIGN_PARALLEL).
     """
     try:
-        inputs = {
-            'topic': topic,
-            'current_year': current_year or str(datetime.now().year)
-        }
-        
-        logger.info(f"Starting Test Case Design for topic: {topic}")
-        
-        # Get the crew instance
-        crew_instance = TestGemini()
-        
-        # Execute only the test case designer task
-        test_design_result = crew_instance.crew().agents[1].execute_task(
-            crew_instance.crew().tasks[1], 
-            inputs
+        topic, test_design_result, cached = _run_agent_stage(
+            'test-design', 'Test Case Design', topic, current_year, use_cache, meta, run_id, upstream_artifact_id,
+            document_id=document_id, parallel_design=parallel_design
         )
-        
-        logger.info(f"Test Case Design completed for topic: {topic}")
-        return True, f"Test case design completed for topic: {topic}", str(test_design_result)
+        return True, f"Test case design completed for topic: {topic}" + (" (cached)" if cached else ""), test_design_result
 
     except Exception as e:
         logger.error(f"Test case design failed for topic {topic}: {str(e)}")
         return False, f"Error in test case design: {str(e)}", None
 
-def run_test_implementer(topic: str, current_year: str = None):
+@single_flight('test-implementation')
+@track_in_flight('test-implementation')
+def run_test_implementer(topic: str = None, current_year: str = None, use_cache: bool = True, meta: dict = None,
+                         run_id: str = None, upstream_artifact_id: str = None, document_id: str = None,
+                         sharded: bool = None, shard: str = None, compile_check: bool = None):
     """
     Run only the Test Implementation agent.
+
+    With run_id the implementer works from the run's test design artifact
+    (the latest one, or upstream_artifact_id), one suite file per shard
+    (sharded=None follows IMPLEMENTATION_SHARDED). shard (a file or suite
+    name) regenerates only that file of the run's latest implementation.
+    compile_check (default COMPILE_CHECK) syntax-checks the generated files
+    and returns the compiler diagnostics.
     """
     try:
-        inputs = {
-            'topic': topic,
-            'current_year': current_year or str(datetime.now().year)
-        }
-        
-        logger.info(f"Starting Test Implementation for topic: {topic}")
-        
-        # Get the crew instance
-        crew_instance = TestGemini()
-        
-        # Execute only the test implementer task
-        implementation_result = crew_instance.crew().agents[2].execute_task(
-            crew_instance.crew().tasks[2], 
-            inputs
+        topic, implementation_result, cached = _run_agent_stage(
+            'test-implementation', 'Test Implementation', topic, current_year, use_cache, meta, run_id, upstream_artifact_id,
+            document_id=document_id, sharded=sharded, shard=shard, compile_check=compile_check
         )
-        
-        logger.info(f"Test Implementation completed for topic: {topic}")
-        return True, f"Test implementation completed for topic: {topic}", str(implementation_result)
+        return True, f"Test implementation completed for topic: {topic}" + (" (cached)" if cached else ""), implementation_result
 
     except Exception as e:
         logger.error(f"Test implementation failed for topic {topic}: {str(e)}")
         return False, f"Error in test implementation: {str(e)}", None
 
+def _store_pipeline_artifacts(topic: str, stage_outputs: list, meta: dict = None, document_id: str = None,
+                              result: str = None, run_id: str = None, index: bool = True):
+    """
+    Record the per-task outputs of a full pipeline run as the artifacts of
+    run_id (default: a new run), chained along the stage graph (and in the
+    prior artifact index unless index is off, as for cached results), and
+    write the generated test code (plus the pipeline result when it
+    differs) to the run's files.
+    Returns the run ID.
+    """
+    store = get_stage_store()
+    run_id = run_id or store.new_id()
+    upstream_artifact_id = None
+    artifacts = {}
+    for stage, content in zip(STAGE_GRAPH, stage_outputs):
+        record = store.save(run_id, stage, content, topic=topic, upstream_artifact_id=upstream_artifact_id, document_id=document_id)
+        upstream_artifact_id = record['artifact_id']
+        artifacts[stage] = upstream_artifact_id
+        if index:
+            index_stage_output(stage, content, topic=topic, run_id=run_id)
+
+    file_store = get_run_file_store()
+    files = []
+    result_file = None
+    if len(stage_outputs) == len(STAGE_GRAPH):
+        files.extend(file_store.save(run_id, name, content) for name, content in implementation_files(stage_outputs[-1]))
+        if result == stage_outputs[-1]:
+            result_file = files[0]
+    if result is not None and result_file is None:
+        result_file = file_store.save(run_id, PIPELINE_RESULT_FILE, result)
+        files.append(result_file)
+
+    if meta is not None:
+        meta['run_id'] = run_id
+        meta['artifacts'] = artifacts
+        meta['files'] = files
+        if result_file:
+            meta['result_file'] = result_file
+    return run_id
+
 # -------------------------------
 # 🧠 Core CrewAI pipeline logic (existing)
 # -------------------------------
-def run_crew_pipeline(topic: str, current_year: str = None):
+def _run_staged_pipeline(inputs: dict, document: str, chunked: bool, use_cache: bool, meta: dict = None,
+                         parallel_design: bool = False, sharded: bool = False, pipelined: bool = False,
+                         run_id: str = None):
+    """
+    The pipeline stage by stage on pooled crews, for document sources, long
+    specifications, per-category test design and sharded implementation:
+    requirements come from the document passed once as task context (chunk
+    by chunk when chunked), test design and implementation build on the
+    upstream output and can look the document up through a retrieval tool.
+    With parallel_design the test cases of each requirement category are
+    designed concurrently, with sharded each test suite is implemented
+    concurrently into its own file. Each stage gets its upstream output in
+    the compact structured form (see handoff.py). pipelined overlaps the
+    three stages (see pipelining.py). The agents' artifact search leaves
+    run_id's own artifacts out. Returns the per-stage outputs in stage order.
+    """
+    pool = get_crew_pool()
+    started = time.perf_counter()
+    test_design = None
+    try:
+        tools = _run_tools(document, run_id)
+        if pipelined:
+            pipeline_stats = {}
+            requirements, test_design, implementation = run_pipelined(
+                inputs, document, use_cache=use_cache, stats=pipeline_stats, tools=tools,
+                requirements_tools=_run_tools(None, run_id)
+            )
+            if meta is not None:
+                meta['pipeline'] = pipeline_stats
+            if implementation is not None:
+                return [requirements, test_design, implementation]
+        elif chunked:
+            chunk_stats = {}
+            requirements = analyze_requirements_chunked(
+                document or inputs['topic'], inputs['current_year'], use_cache=use_cache, stats=chunk_stats,
+                topic=inputs['topic'] if document else None
+            )
+            if meta is not None:
+                meta['chunking'] = chunk_stats
+        else:
+            requirements = execute_stage('requirements', inputs, document, tools=_run_tools(None, run_id))
+        if not pipelined:
+            publish('stage_output', stage='requirements', content=requirements)
+
+        handoff_stats = {'test-design': {}, 'test-implementation': {}}
+        if test_design is None:
+            design_stats = {}
+            test_design = design_test_cases(
+                handoff('test-design', requirements, stats=handoff_stats['test-design']), inputs,
+                use_cache=use_cache, stats=design_stats, tools=tools, parallel=parallel_design
+            )
+            if meta is not None and parallel_design:
+                meta['test_design'] = design_stats
+        publish('stage_output', stage='test-design', content=test_design)
+        shard_stats = {}
+        implementation = implement_sharded(
+            handoff('test-implementation', test_design, inputs['topic'], stats=handoff_stats['test-implementation']), inputs,
+            use_cache=use_cache, stats=shard_stats, tools=tools, sharded=sharded
+        )
+        if meta is not None and sharded:
+            meta['implementation'] = shard_stats
+        if meta is not None and should_structure():
+            meta['handoff'] = handoff_stats
+        publish('stage_output', stage='test-implementation', content=implementation)
+    finally:
+        pool.record_execution('run', time.perf_counter() - started)
+    return [requirements, test_design, implementation]
+
+@single_flight('run')
+@track_in_flight('run')
+def run_crew_pipeline(topic: str = None, current_year: str = None, use_cache: bool = True, meta: dict = None,
+                      chunked: bool = None, document_id: str = None, parallel_design: bool = None,
+                      sharded: bool = None, document_key: str = None, compile_check: bool = None,
+                      pipelined: bool = None):
     """
     Run the crew for requirements analysis, test case design, and test script implementation.
+
+    With document_id the registered document is the source and a short
+    label fills {topic}; long specifications (or chunked=True) analyze
+    requirements chunk by chunk in parallel before the downstream agents run.
+    Test cases are designed per requirement category and implemented per
+    suite concurrently unless parallel_design (default TEST_DESIGN_PARALLEL)
+    and sharded (default IMPLEMENTATION_SHARDED) are off; downstream agents
+    get the compact structured form of the upstream output unless
+    STRUCTURED_HANDOFF is off. With all three off a topic-only run is a
+    plain sequential crew kickoff. pipelined (default PIPELINED_EXECUTION)
+    overlaps the stages, starting each category's test design and
+    implementation while the requirements are still streaming; it needs
+    per-category design and sharding and does not apply to chunked runs,
+    which stay staged.
+
+    document_key makes the run revision-aware (see revisions.py): a document
+    run under the key of an earlier revision reuses the results of its
+    unchanged sections, requirement categories and test suites.
+    compile_check (default COMPILE_CHECK) syntax-checks the generated test
+    code and returns the compiler diagnostics.
     """
     try:
+        document = None
+        if document_id:
+            topic, document = _resolve_document(document_id, topic)
+            if meta is not None:
+                meta['topic'] = topic
+                meta['document_id'] = document_id
+
         inputs = {
             'topic': topic,
             'current_year': current_year or str(datetime.now().year)
         }
+        revision = None
+        if document_key:
+            if not document:
+                raise ValueError("document_key requires a document source (document_id or a PDF upload)")
+            revision = get_revision_store().start(document_key, document)
+            # Stable chunks are what lets a revision reuse its predecessor's analysis
+            chunked = True
+        chunked = should_chunk(document or topic, chunked)
+        parallel_design = should_parallelize(parallel_design)
+        sharded = should_shard(sharded)
+        structured = should_structure()
+        pipelined = should_pipeline(pipelined)
+        if pipelined and (chunked or not parallel_design or not sharded):
+            logger.info("Pipelined execution needs unchunked requirements, per-category design and sharding; running staged")
+            pipelined = False
+        cache_inputs = dict(inputs)
+        if document:
+            cache_inputs['document'] = document
+        if chunked:
+            cache_inputs['mode'] = 'chunked'
+        if parallel_design:
+            cache_inputs['design'] = 'parallel'
+        if sharded:
+            cache_inputs['implementation'] = 'sharded'
+        if structured:
+            cache_inputs['handoff'] = 'structured'
+        if pipelined:
+            cache_inputs['execution'] = 'pipelined'
+        
+        # A revision always runs, so it is recorded; unchanged parts are reused anyway
+        key, cached = _cached_result('run', cache_inputs, use_cache and revision is None, meta)
+        if cached is not None:
+            logger.info(f"CrewAI pipeline served from cache for topic: {topic}")
+            for stage, content in zip(STAGE_GRAPH, cached['stage_outputs']):
+                publish('stage_output', stage=stage, cached=True, content=content)
+            if len(cached['stage_outputs']) == len(STAGE_GRAPH):
+                # Checks of unchanged code are served from the compile cache
+                _compile_checked(cached['stage_outputs'][-1], inputs, meta, compile_check, document)
+            _store_pipeline_artifacts(topic, cached['stage_outputs'], meta, document_id, result=cached['result'], index=False)
+            return True, f"Success: Requirements analysis, test case design, and test script implementation completed for topic: {topic} (cached)", cached['result']
+        
+        if document or chunked or parallel_design or sharded or structured:
+            logger.info(f"Starting staged CrewAI pipeline for topic: {topic}")
+            run_id = get_stage_store().new_id()
+            with bind_revision(revision):
+                stage_outputs = _run_staged_pipeline(inputs, document, chunked, use_cache, meta, parallel_design, sharded,
+                                                     pipelined, run_id)
+            stage_outputs[-1] = _compile_checked(stage_outputs[-1], inputs, meta, compile_check, document, run_id)
+            _store_pipeline_artifacts(topic, stage_outputs, meta, document_id, result=stage_outputs[-1], run_id=run_id)
+            get_stage_cache().put('run', key, {"result": stage_outputs[-1], "stage_outputs": stage_outputs})
+            if revision is not None:
+                get_revision_store().save(revision, document_id=document_id, run_id=run_id)
+                if meta is not None:
+                    meta['revision'] = revision.summary()
+            logger.info(f"Staged CrewAI pipeline completed successfully for topic: {topic}")
+            return True, f"Success: Requirements analysis, test case design, and test script implementation completed for topic: {topic}", stage_outputs[-1]
         
         logger.info(f"Starting CrewAI pipeline for topic: {topic}")
         
-        # Run CrewAI pipeline
-        crew_result = TestGemini().crew().kickoff(inputs=inputs)
+        # Run CrewAI pipeline on a pooled crew
+        pool = get_crew_pool()
+        with pool.checkout() as crew:
+            started = time.perf_counter()
+            try:
+                install_metrics_handlers()
+                agents = [(spec['agent'], crew.agents[spec['task_index']]) for spec in STAGE_GRAPH.values()]
+                with llm_streaming(crew.agents), get_metrics().llm_usage(agents):
+                    crew_result = crew.kickoff(inputs=inputs)
+            finally:
+                pool.record_execution('run', time.perf_counter() - started)
         
         # Process crew result
         if hasattr(crew_result, 'text'):
@@ -157,10 +572,20 @@ def run_crew_pipeline(topic: str, current_year: str = None):
         elif isinstance(crew_result, (list, dict)):
             crew_result_text = json.dumps(crew_result)
         elif crew_result is None:
-            return False, "crew_result is None"
+            return False, "crew_result is None", None
         else:
             crew_result_text = str(crew_result)
         
+        # Keep each task's output so downstream agents can be re-run from it
+        stage_outputs = [str(output.raw) for output in getattr(crew_result, 'tasks_output', None) or []]
+        if len(stage_outputs) == len(STAGE_GRAPH):
+            checked = _compile_checked(stage_outputs[-1], inputs, meta, compile_check)
+            if crew_result_text == stage_outputs[-1]:
+                crew_result_text = checked
+            stage_outputs[-1] = checked
+        _store_pipeline_artifacts(topic, stage_outputs, meta, result=crew_result_text)
+        get_stage_cache().put('run', key, {"result": crew_result_text, "stage_outputs": stage_outputs})
+        
         logger.info(f"CrewAI pipeline completed successfully for topic: {topic}")
         return True, f"Success: Requirements analysis, test case design, and test script implementation completed for topic: {topic}", crew_result_text
 
@@ -168,16 +593,293 @@ def run_crew_pipeline(topic: str, current_year: str = None):
         logger.error(f"Pipeline failed for topic {topic}: {str(e)}")
         return False, f"Error: {str(e)}", None
 
+# -------------------------------
+# 📬 Shared request/response helpers
+# -------------------------------
+# kind -> (response label key, label, runner)
+STAGE_KINDS = {
+    'run': ('pipeline', 'Full CrewAI Pipeline', run_crew_pipeline),
+    'requirements': ('agent', 'Requirements Analyst', run_requirements_analyst),
+    'test-design': ('agent', 'Test Case Designer', run_test_case_designer),
+    'test-implementation': ('agent', 'Test Implementer', run_test_implementer),
+}
+
+def build_stage_payload(kind, success, message, result, meta=None, inline=False, **fields):
+    """
+    Build the JSON payload returned for a pipeline or agent run. Large
+    generated files are left out in favour of their 'result_file'
+    reference unless inline is set.
+    """
+    result = inline_result(result, meta, inline)
+    label_key, label, _ = STAGE_KINDS[kind]
+    response_data = {
+        "status": "success" if success else "error",
+        label_key: label
+    }
+    response_data.update({name: value for name, value in fields.items() if value is not None})
+    response_data["message"] = message
+    response_data.update(meta or {})
+
+    if success and result:
+        response_data["result"] = result
+
+    return response_data
+
+def _pdf_upload_error():
+    """
+    Validate the 'pdf_file' upload; returns an error response or None.
+    """
+    if 'pdf_file' not in request.files:
+        return jsonify({
+            "status": "error",
+            "message": "PDF file is required"
+        }), 400
+
+    pdf_file = request.files['pdf_file']
+    if pdf_file.filename == '':
+        return jsonify({
+            "status": "error",
+            "message": "No file selected"
+        }), 400
+
+    if not pdf_file.filename.lower().endswith('.pdf'):
+        return jsonify({
+            "status": "error",
+            "message": "Only PDF files are allowed"
+        }), 400
+
+    return None
+
+def _extraction_summary(pdf_stats):
+    """The part of the PDF extraction stats worth echoing to clients."""
+    return {name: pdf_stats.get(name) for name in ('document_id', 'cache', 'pages', 'document_pages', 'chars', 'seconds', 'parallel', 'truncated')}
+
+def _document_error(data):
+    """
+    404 response when the request references an unknown document_id, else None.
+    """
+    document_id = (data or {}).get('document_id')
+    if not document_id:
+        return None
+    try:
+        get_document_store().get(document_id)
+    except DocumentNotFound as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 404
+    return None
+
+def _request_source(data):
+    """
+    Describe what a JSON request runs on: its 'topic', or the registered
+    document named by 'document_id'. Returns (log label, response fields).
+    """
+    topic = (data or {}).get('topic')
+    document_id = (data or {}).get('document_id')
+    if document_id:
+        record = get_document_store().get(document_id)
+        source = f"Document: {record.get('filename') or document_id}"
+        return source, {"topic": topic, "source": source}
+    return f"topic: {topic}", {"topic": topic}
+
+def _request_flag(options, name):
+    """Read a boolean request option from the body/form, falling back to the query string."""
+    return is_truthy((options or {}).get(name)) or is_truthy(request.args.get(name))
+
+def _request_value(options, name):
+    """Read a request option from the body/form, falling back to the query string."""
+    value = (options or {}).get(name)
+    return value if value not in (None, '') else request.args.get(name)
+
+def _run_options(kind, options):
+    """
+    Per-request keyword arguments for the run_* functions.
+    """
+    run_kwargs = {
+        'use_cache': not _request_flag(options, 'no_cache'),
+        # The source document travels separately; only a short topic label
+        # fills the agent and task templates
+        'document_id': _request_value(options, 'document_id')
+    }
+    if kind in STAGE_GRAPH:
+        # Per-agent runs can attach to a run and build on its upstream artifacts
+        run_kwargs['run_id'] = _request_value(options, 'run_id')
+        run_kwargs['upstream_artifact_id'] = _request_value(options, 'upstream_artifact_id')
+    if kind in ('run', 'requirements'):
+        # Map-reduce requirements analysis: forced on/off, or decided by length
+        chunked = _request_value(options, 'chunked')
+        run_kwargs['chunked'] = None if chunked is None else is_truthy(chunked)
+    if kind in ('run', 'test-design'):
+        # Per-category test design: forced on/off, or TEST_DESIGN_PARALLEL
+        parallel_design = _request_value(options, 'parallel_design')
+        run_kwargs['parallel_design'] = None if parallel_design is None else is_truthy(parallel_design)
+    if kind == 'run':
+        # Revision-aware runs of a document that is re-uploaded under one key
+        run_kwargs['document_key'] = _request_value(options, 'document_key')
+        # Overlapped stages: forced on/off, or PIPELINED_EXECUTION
+        pipelined = _request_value(options, 'pipelined')
+        run_kwargs['pipelined'] = None if pipelined is None else is_truthy(pipelined)
+    if kind in ('run', 'test-implementation'):
+        # One file per test suite: forced on/off, or IMPLEMENTATION_SHARDED
+        sharded = _request_value(options, 'sharded')
+        run_kwargs['sharded'] = None if sharded is None else is_truthy(sharded)
+        # Syntax-check the generated C++: forced on/off, or COMPILE_CHECK
+        compile_check = _request_value(options, 'compile_check')
+        run_kwargs['compile_check'] = None if compile_check is None else is_truthy(compile_check)
+    if kind == 'test-implementation':
+        # Regenerate a single suite file of the run's implementation
+        run_kwargs['shard'] = _request_value(options, 'shard')
+    return run_kwargs
+
+def _run_stage(kind, run_topic, current_year, options=None, document_id=None, **fields):
+    """
+    Run a pipeline/agent request, either inline or as a background job when
+    the client passed 'async'. fields are echoed in the response (topic/source).
+    """
+    run_kwargs = _run_options(kind, options)
+    if document_id:
+        run_kwargs['document_id'] = document_id
+    inline = _request_flag(options, 'inline_result')
+    if _request_flag(options, 'async'):
+        return _submit_stage_job(kind, run_topic, current_year, run_kwargs, inline=inline, **fields)
+
+    meta = {}
+    success, message, result = STAGE_KINDS[kind][2](run_topic, current_year, meta=meta, **run_kwargs)
+    payload = build_stage_payload(kind, success, message, result, meta=meta, inline=inline, **fields)
+    return jsonify(payload), 200 if success else 500
+
+def _submit_stage_job(kind, run_topic, current_year, run_kwargs=None, inline=False, **fields):
+    """
+    Queue a pipeline/agent run on the job manager and answer 202 with the job ID.
+    """
+    runner = STAGE_KINDS[kind][2]
+    meta = {}
+    try:
+        job = get_job_manager().submit(
+            kind,
+            runner,
+            run_topic,
+            current_year,
+            meta=meta,
+            describe=fields,
+            build_payload=lambda success, message, result: build_stage_payload(kind, success, message, result, meta=meta, inline=inline, **fields),
+            **(run_kwargs or {})
+        )
+    except QueueFullError as e:
+        logger.warning(f"Rejected {kind} job: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 503
+
+    return jsonify({
+        "status": "accepted",
+        "job_id": job.id,
+        "kind": kind,
+        "job_status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "result_url": f"/jobs/{job.id}/result"
+    }), 202
+
+def _batch_items(data):
+    """
+    Normalize a batch request into item dicts: 'items' may hold topic
+    strings or objects with 'topic'/'document_id'/'current_year'; 'topics'
+    and 'document_ids' are shorthand lists.
+    """
+    items = []
+    for entry in data.get('items') or []:
+        items.append({'topic': entry} if isinstance(entry, str) else dict(entry))
+    items.extend({'topic': topic} for topic in data.get('topics') or [])
+    items.extend({'document_id': document_id} for document_id in data.get('document_ids') or [])
+    for item in items:
+        item.setdefault('current_year', data.get('current_year'))
+    return items
+
+def _stream_stage(kind, run_topic, current_year, options=None, document_id=None, **fields):
+    """
+    Run a pipeline/agent request as a job and answer with a Server-Sent
+    Events stream of its progress: task start/finish, agent steps, LLM
+    tokens (when the model streams), each stage output as soon as it is
+    ready and finally the usual response payload as the 'result' event.
+    """
+    run_kwargs = _run_options(kind, options)
+    if document_id:
+        run_kwargs['document_id'] = document_id
+    runner = STAGE_KINDS[kind][2]
+    inline = _request_flag(options, 'inline_result')
+    stream = RunEventStream()
+    meta = {}
+
+    def streamed_runner(*args, **kwargs):
+        with bind_stream(stream):
+            publish('run_started', kind=kind)
+            return runner(*args, **kwargs)
+
+    def build_payload(success, message, result):
+        payload = build_stage_payload(kind, success, message, result, meta=meta, inline=inline, **fields)
+        stream.publish('result', **payload)
+        stream.close()
+        return payload
+
+    try:
+        job = get_job_manager().submit(
+            kind,
+            streamed_runner,
+            run_topic,
+            current_year,
+            meta=meta,
+            describe=fields,
+            build_payload=build_payload,
+            **run_kwargs
+        )
+    except QueueFullError as e:
+        logger.warning(f"Rejected streamed {kind} run: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 503
+
+    def events():
+        # First frame right away so clients see the stream open
+        yield format_sse('queued', {"job_id": job.id, "kind": kind, "status_url": f"/jobs/{job.id}"})
+        yield from stream.sse(finished=lambda: job.finished)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 # -------------------------------
 # 🚀 Flask App inside run()
 # -------------------------------
-def run():
+def create_app():
+    """
+    Build the Flask application with all routes. Used by run() for the
+    development server and by server.py (gunicorn) for production.
+    """
     app = Flask(__name__)
     app.secret_key = 'crew_ai_secret_key'
     
     # Enable CORS for localhost:3000
     CORS(app, origins=['http://localhost:3000'])
 
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            metrics = get_metrics()
+            metrics.inc('http_requests_total', route=route, method=request.method, status=response.status_code)
+            metrics.observe('http_request_duration_seconds', time.perf_counter() - started, route=route, method=request.method)
+        return response
+
     @app.route('/')
     def index():
         return jsonify({
@@ -185,7 +887,8 @@ def run():
             "usage": {
                 "full_pipeline": {
                     "run_crew": "POST /run with {'topic': 'Your Topic'}",
-                    "run_crew_pdf": "POST /run/pdf with PDF file upload"
+                    "run_crew_pdf": "POST /run/pdf with PDF file upload",
+                    "stream": "GET /run/stream?topic=... or POST /run/stream (JSON) / /run/stream/pdf for Server-Sent Events: queued, run_started, task_started, agent_step, token, task_completed, stage_output, result"
                 },
                 "individual_agents": {
                     "requirements": "POST /requirements with {'topic': 'Your Topic'} or GET /requirements/<topic>",
@@ -195,6 +898,34 @@ def run():
                     "test_implementation": "POST /test-implementation with {'topic': 'Your Topic'} or GET /test-implementation/<topic>",
                     "test_implementation_pdf": "POST /test-implementation/pdf with PDF file upload"
                 },
+                "documents": {
+                    "register": "POST /documents with PDF file upload -> document_id",
+                    "use": "Pass 'document_id' instead of 'topic' to /run, /requirements, /test-design, /test-implementation or /jobs",
+                    "details": "GET /documents/<document_id>?include_text=true"
+                },
+                "chunked_analysis": "Long specifications are split on section boundaries and analyzed in parallel; pass 'chunked': true/false to /run or /requirements to force it on or off",
+                "runs": {
+                    "graph": "GET /stages shows which stage consumes which upstream output",
+                    "reuse": "Pass 'run_id' (and optionally 'upstream_artifact_id') to /test-design or /test-implementation to build on a stored upstream output",
+                    "list": "GET /runs/<run_id>",
+                    "artifact": "GET /runs/<run_id>/artifacts/<artifact_id>",
+                    "files": "GET /runs/<run_id>/files/<name> downloads generated test code; responses carry 'result_file' instead of large results unless 'inline_result': true"
+                },
+                "batch": {
+                    "submit": "POST /run/batch with {'topics': [...], 'document_ids': [...], 'concurrency': 4}; add 'stream': true for NDJSON results as items finish",
+                    "status": "GET /run/batch/<batch_id>",
+                    "results": "GET /run/batch/<batch_id>/results (NDJSON, ?follow=true to stream)",
+                    "cancel": "DELETE /run/batch/<batch_id>"
+                },
+                "jobs": {
+                    "async": "Add 'async': true (or ?async=true) to any run/agent request to get a job ID back immediately",
+                    "submit": "POST /jobs with {'kind': 'run|requirements|test-design|test-implementation', 'topic': 'Your Topic'}",
+                    "submit_pdf": "POST /jobs/pdf with PDF file upload and 'kind' form field",
+                    "list": "GET /jobs?status=&kind=&limit=",
+                    "status": "GET /jobs/<job_id>",
+                    "result": "GET /jobs/<job_id>/result",
+                    "cancel": "DELETE /jobs/<job_id>"
+                },
                 "training": {
                     "train": "POST /train with training parameters",
                     "test": "POST /test with testing parameters",
@@ -202,6 +933,9 @@ def run():
                 }
             },
             "health_check": "/health",
+            "crew_pool": "/pool",
+            "metrics": "GET /metrics (Prometheus text format)",
+            "stage_cache": "GET /cache for hit/miss counters, DELETE /cache to clear; pass 'no_cache': true (or ?no_cache=true) to bypass",
             "version": "2.1.0"
         })
 
@@ -214,29 +948,21 @@ def run():
         """POST endpoint for Requirements Analysis only"""
         try:
             data = request.get_json()
-            if not data or 'topic' not in data:
+            if not data or not (data.get('topic') or data.get('document_id')):
                 return jsonify({
                     "status": "error",
-                    "message": "Topic is required in request body"
+                    "message": "Topic or document_id is required in request body"
                 }), 400
             
-            topic = data['topic']
-            current_year = data.get('current_year')
+            document_error = _document_error(data)
+            if document_error:
+                return document_error
             
-            logger.info(f"Processing requirements analysis for topic: {topic}")
-            success, message, result = run_requirements_analyst(topic, current_year)
-            
-            response_data = {
-                "status": "success" if success else "error",
-                "agent": "Requirements Analyst",
-                "topic": topic,
-                "message": message
-            }
-            
-            if success and result:
-                response_data["result"] = result
+            label, fields = _request_source(data)
+            current_year = data.get('current_year')
             
-            return jsonify(response_data), 200 if success else 500
+            logger.info(f"Processing requirements analysis for {label}")
+            return _run_stage('requirements', data.get('topic'), current_year, data, **fields)
             
         except Exception as e:
             logger.error(f"Error in requirements endpoint: {str(e)}")
@@ -249,43 +975,19 @@ def run():
     def requirements_analysis_pdf():
         """POST endpoint for Requirements Analysis with PDF upload"""
         try:
-            if 'pdf_file' not in request.files:
-                return jsonify({
-                    "status": "error",
-                    "message": "PDF file is required"
-                }), 400
+            upload_error = _pdf_upload_error()
+            if upload_error:
+                return upload_error
             
             pdf_file = request.files['pdf_file']
-            if pdf_file.filename == '':
-                return jsonify({
-                    "status": "error",
-                    "message": "No file selected"
-                }), 400
-            
-            if not pdf_file.filename.lower().endswith('.pdf'):
-                return jsonify({
-                    "status": "error",
-                    "message": "Only PDF files are allowed"
-                }), 400
             
-            # Extract text from PDF
-            pdf_content = extract_text_from_pdf(pdf_file)
+            # Extract text from PDF (cached by content hash)
+            pdf_stats = {}
+            record, _ = text_from_upload(pdf_file, stats=pdf_stats)
             current_year = request.form.get('current_year')
             
             logger.info(f"Processing requirements analysis for PDF: {pdf_file.filename}")
-            success, message, result = run_requirements_analyst(pdf_content, current_year)
-            
-            response_data = {
-                "status": "success" if success else "error",
-                "agent": "Requirements Analyst",
-                "source": f"PDF: {pdf_file.filename}",
-                "message": message
-            }
-            
-            if success and result:
-                response_data["result"] = result
-            
-            return jsonify(response_data), 200 if success else 500
+            return _run_stage('requirements', request.form.get('topic'), current_year, request.form, document_id=record['document_id'], source=f"PDF: {pdf_file.filename}", extraction=_extraction_summary(pdf_stats))
             
         except Exception as e:
             logger.error(f"Error in requirements PDF endpoint: {str(e)}")
@@ -304,48 +1006,28 @@ def run():
             }), 400
         
         logger.info(f"Processing requirements analysis for topic: {topic}")
-        success, message, result = run_requirements_analyst(topic)
-        
-        response_data = {
-            "status": "success" if success else "error",
-            "agent": "Requirements Analyst",
-            "topic": topic,
-            "message": message
-        }
-        
-        if success and result:
-            response_data["result"] = result
-        
-        return jsonify(response_data), 200 if success else 500
+        return _run_stage('requirements', topic, None, None, topic=topic)
 
     @app.route('/test-design', methods=['POST'])
     def test_design_post():
         """POST endpoint for Test Case Design only"""
         try:
             data = request.get_json()
-            if not data or 'topic' not in data:
+            if not data or not (data.get('topic') or data.get('document_id') or data.get('run_id')):
                 return jsonify({
                     "status": "error",
-                    "message": "Topic is required in request body"
+                    "message": "Topic, document_id or the run_id of an earlier stage is required in request body"
                 }), 400
             
-            topic = data['topic']
-            current_year = data.get('current_year')
-            
-            logger.info(f"Processing test case design for topic: {topic}")
-            success, message, result = run_test_case_designer(topic, current_year)
+            document_error = _document_error(data)
+            if document_error:
+                return document_error
             
-            response_data = {
-                "status": "success" if success else "error",
-                "agent": "Test Case Designer",
-                "topic": topic,
-                "message": message
-            }
-            
-            if success and result:
-                response_data["result"] = result
+            label, fields = _request_source(data)
+            current_year = data.get('current_year')
             
-            return jsonify(response_data), 200 if success else 500
+            logger.info(f"Processing test case design for {label}")
+            return _run_stage('test-design', data.get('topic'), current_year, data, **fields)
             
         except Exception as e:
             logger.error(f"Error in test design endpoint: {str(e)}")
@@ -358,43 +1040,19 @@ def run():
     def test_design_pdf():
         """POST endpoint for Test Case Design with PDF upload"""
         try:
-            if 'pdf_file' not in request.files:
-                return jsonify({
-                    "status": "error",
-                    "message": "PDF file is required"
-                }), 400
+            upload_error = _pdf_upload_error()
+            if upload_error:
+                return upload_error
             
             pdf_file = request.files['pdf_file']
-            if pdf_file.filename == '':
-                return jsonify({
-                    "status": "error",
-                    "message": "No file selected"
-                }), 400
             
-            if not pdf_file.filename.lower().endswith('.pdf'):
-                return jsonify({
-                    "status": "error",
-                    "message": "Only PDF files are allowed"
-                }), 400
-            
-            # Extract text from PDF
-            pdf_content = extract_text_from_pdf(pdf_file)
+            # Extract text from PDF (cached by content hash)
+            pdf_stats = {}
+            record, _ = text_from_upload(pdf_file, stats=pdf_stats)
             current_year = request.form.get('current_year')
             
             logger.info(f"Processing test case design for PDF: {pdf_file.filename}")
-            success, message, result = run_test_case_designer(pdf_content, current_year)
-            
-            response_data = {
-                "status": "success" if success else "error",
-                "agent": "Test Case Designer",
-                "source": f"PDF: {pdf_file.filename}",
-                "message": message
-            }
-            
-            if success and result:
-                response_data["result"] = result
-            
-            return jsonify(response_data), 200 if success else 500
+            return _run_stage('test-design', request.form.get('topic'), current_year, request.form, document_id=record['document_id'], source=f"PDF: {pdf_file.filename}", extraction=_extraction_summary(pdf_stats))
             
         except Exception as e:
             logger.error(f"Error in test design PDF endpoint: {str(e)}")
@@ -413,48 +1071,28 @@ def run():
             }), 400
         
         logger.info(f"Processing test case design for topic: {topic}")
-        success, message, result = run_test_case_designer(topic)
-        
-        response_data = {
-            "status": "success" if success else "error",
-            "agent": "Test Case Designer",
-            "topic": topic,
-            "message": message
-        }
-        
-        if success and result:
-            response_data["result"] = result
-        
-        return jsonify(response_data), 200 if success else 500
+        return _run_stage('test-design', topic, None, None, topic=topic)
 
     @app.route('/test-implementation', methods=['POST'])
     def test_implementation_post():
         """POST endpoint for Test Implementation only"""
         try:
             data = request.get_json()
-            if not data or 'topic' not in data:
+            if not data or not (data.get('topic') or data.get('document_id') or data.get('run_id')):
                 return jsonify({
                     "status": "error",
-                    "message": "Topic is required in request body"
+                    "message": "Topic, document_id or the run_id of an earlier stage is required in request body"
                 }), 400
             
-            topic = data['topic']
-            current_year = data.get('current_year')
-            
-            logger.info(f"Processing test implementation for topic: {topic}")
-            success, message, result = run_test_implementer(topic, current_year)
-            
-            response_data = {
-                "status": "success" if success else "error",
-                "agent": "Test Implementer",
-                "topic": topic,
-                "message": message
-            }
+            document_error = _document_error(data)
+            if document_error:
+                return document_error
             
-            if success and result:
-                response_data["result"] = result
+            label, fields = _request_source(data)
+            current_year = data.get('current_year')
             
-            return jsonify(response_data), 200 if success else 500
+            logger.info(f"Processing test implementation for {label}")
+            return _run_stage('test-implementation', data.get('topic'), current_year, data, **fields)
             
         except Exception as e:
             logger.error(f"Error in test implementation endpoint: {str(e)}")
@@ -467,43 +1105,19 @@ def run():
     def test_implementation_pdf():
         """POST endpoint for Test Implementation with PDF upload"""
         try:
-            if 'pdf_file' not in request.files:
-                return jsonify({
-                    "status": "error",
-                    "message": "PDF file is required"
-                }), 400
+            upload_error = _pdf_upload_error()
+            if upload_error:
+                return upload_error
             
             pdf_file = request.files['pdf_file']
-            if pdf_file.filename == '':
-                return jsonify({
-                    "status": "error",
-                    "message": "No file selected"
-                }), 400
             
-            if not pdf_file.filename.lower().endswith('.pdf'):
-                return jsonify({
-                    "status": "error",
-                    "message": "Only PDF files are allowed"
-                }), 400
-            
-            # Extract text from PDF
-            pdf_content = extract_text_from_pdf(pdf_file)
+            # Extract text from PDF (cached by content hash)
+            pdf_stats = {}
+            record, _ = text_from_upload(pdf_file, stats=pdf_stats)
             current_year = request.form.get('current_year')
             
             logger.info(f"Processing test implementation for PDF: {pdf_file.filename}")
-            success, message, result = run_test_implementer(pdf_content, current_year)
-            
-            response_data = {
-                "status": "success" if success else "error",
-                "agent": "Test Implementer",
-                "source": f"PDF: {pdf_file.filename}",
-                "message": message
-            }
-            
-            if success and result:
-                response_data["result"] = result
-            
-            return jsonify(response_data), 200 if success else 500
+            return _run_stage('test-implementation', request.form.get('topic'), current_year, request.form, document_id=record['document_id'], source=f"PDF: {pdf_file.filename}", extraction=_extraction_summary(pdf_stats))
             
         except Exception as e:
             logger.error(f"Error in test implementation PDF endpoint: {str(e)}")
@@ -522,19 +1136,7 @@ def run():
             }), 400
         
         logger.info(f"Processing test implementation for topic: {topic}")
-        success, message, result = run_test_implementer(topic)
-        
-        response_data = {
-            "status": "success" if success else "error",
-            "agent": "Test Implementer",
-            "topic": topic,
-            "message": message
-        }
-        
-        if success and result:
-            response_data["result"] = result
-        
-        return jsonify(response_data), 200 if success else 500
+        return _run_stage('test-implementation', topic, None, None, topic=topic)
 
     # -------------------------------
     # 🔄 Full Pipeline Endpoints
@@ -545,29 +1147,21 @@ def run():
         """POST endpoint to run crew pipeline with topic"""
         try:
             data = request.get_json()
-            if not data or 'topic' not in data:
+            if not data or not (data.get('topic') or data.get('document_id')):
                 return jsonify({
                     "status": "error",
-                    "message": "Topic is required in request body"
+                    "message": "Topic or document_id is required in request body"
                 }), 400
             
-            topic = data['topic']
-            current_year = data.get('current_year')
-            
-            logger.info(f"Processing crew pipeline for topic: {topic}")
-            success, message, result = run_crew_pipeline(topic, current_year)
-            
-            response_data = {
-                "status": "success" if success else "error",
-                "pipeline": "Full CrewAI Pipeline",
-                "topic": topic,
-                "message": message
-            }
+            document_error = _document_error(data)
+            if document_error:
+                return document_error
             
-            if success and result:
-                response_data["result"] = result
+            label, fields = _request_source(data)
+            current_year = data.get('current_year')
             
-            return jsonify(response_data), 200 if success else 500
+            logger.info(f"Processing crew pipeline for {label}")
+            return _run_stage('run', data.get('topic'), current_year, data, **fields)
             
         except Exception as e:
             logger.error(f"Error in run endpoint: {str(e)}")
@@ -580,43 +1174,19 @@ def run():
     def run_pipeline_pdf():
         """POST endpoint to run crew pipeline with PDF upload"""
         try:
-            if 'pdf_file' not in request.files:
-                return jsonify({
-                    "status": "error",
-                    "message": "PDF file is required"
-                }), 400
+            upload_error = _pdf_upload_error()
+            if upload_error:
+                return upload_error
             
             pdf_file = request.files['pdf_file']
-            if pdf_file.filename == '':
-                return jsonify({
-                    "status": "error",
-                    "message": "No file selected"
-                }), 400
-            
-            if not pdf_file.filename.lower().endswith('.pdf'):
-                return jsonify({
-                    "status": "error",
-                    "message": "Only PDF files are allowed"
-                }), 400
             
-            # Extract text from PDF
-            pdf_content = extract_text_from_pdf(pdf_file)
+            # Extract text from PDF (cached by content hash)
+            pdf_stats = {}
+            record, _ = text_from_upload(pdf_file, stats=pdf_stats)
             current_year = request.form.get('current_year')
             
             logger.info(f"Processing crew pipeline for PDF: {pdf_file.filename}")
-            success, message, result = run_crew_pipeline(pdf_content, current_year)
-            
-            response_data = {
-                "status": "success" if success else "error",
-                "pipeline": "Full CrewAI Pipeline",
-                "source": f"PDF: {pdf_file.filename}",
-                "message": message
-            }
-            
-            if success and result:
-                response_data["result"] = result
-            
-            return jsonify(response_data), 200 if success else 500
+            return _run_stage('run', request.form.get('topic'), current_year, request.form, document_id=record['document_id'], source=f"PDF: {pdf_file.filename}", extraction=_extraction_summary(pdf_stats))
             
         except Exception as e:
             logger.error(f"Error in run PDF endpoint: {str(e)}")
@@ -635,19 +1205,323 @@ def run():
             }), 400
         
         logger.info(f"Processing crew pipeline for topic: {topic}")
-        success, message, result = run_crew_pipeline(topic)
-        
-        response_data = {
-            "status": "success" if success else "error",
-            "pipeline": "Full CrewAI Pipeline",
-            "topic": topic,
-            "message": message
-        }
-        
-        if success and result:
-            response_data["result"] = result
-        
-        return jsonify(response_data), 200 if success else 500
+        return _run_stage('run', topic, None, None, topic=topic)
+
+    @app.route('/run/stream', methods=['GET', 'POST'])
+    def run_pipeline_stream():
+        """Stream a pipeline (or single-agent 'kind') run as Server-Sent Events"""
+        try:
+            data = request.get_json(silent=True) or request.args.to_dict()
+            if not (data.get('topic') or data.get('document_id') or data.get('run_id')):
+                return jsonify({
+                    "status": "error",
+                    "message": "Topic, document_id or the run_id of an earlier stage is required"
+                }), 400
+
+            kind = data.get('kind', 'run')
+            if kind not in STAGE_KINDS:
+                return jsonify({
+                    "status": "error",
+                    "message": f"Unknown kind '{kind}'. Use one of: {', '.join(STAGE_KINDS)}"
+                }), 400
+
+            document_error = _document_error(data)
+            if document_error:
+                return document_error
+
+            label, fields = _request_source(data)
+            logger.info(f"Streaming {kind} for {label}")
+            return _stream_stage(kind, data.get('topic'), data.get('current_year'), data, **fields)
+
+        except Exception as e:
+            logger.error(f"Error in streaming endpoint: {str(e)}")
+            return jsonify({
+                "status": "error",
+                "message": f"Internal server error: {str(e)}"
+            }), 500
+
+    @app.route('/run/stream/pdf', methods=['POST'])
+    def run_pipeline_stream_pdf():
+        """Stream a pipeline (or single-agent 'kind') run for an uploaded PDF"""
+        try:
+            upload_error = _pdf_upload_error()
+            if upload_error:
+                return upload_error
+
+            kind = request.form.get('kind', 'run')
+            if kind not in STAGE_KINDS:
+                return jsonify({
+                    "status": "error",
+                    "message": f"Unknown kind '{kind}'. Use one of: {', '.join(STAGE_KINDS)}"
+                }), 400
+
+            pdf_file = request.files['pdf_file']
+            pdf_stats = {}
+            record, _ = text_from_upload(pdf_file, stats=pdf_stats)
+
+            logger.info(f"Streaming {kind} for PDF: {pdf_file.filename}")
+            return _stream_stage(kind, request.form.get('topic'), request.form.get('current_year'), request.form, document_id=record['document_id'], source=f"PDF: {pdf_file.filename}", extraction=_extraction_summary(pdf_stats))
+
+        except Exception as e:
+            logger.error(f"Error in streaming PDF endpoint: {str(e)}")
+            return jsonify({
+                "status": "error",
+                "message": f"Internal server error: {str(e)}"
+            }), 500
+
+    # -------------------------------
+    # 📦 Batch Runs
+    # -------------------------------
+
+    @app.route('/run/batch', methods=['POST'])
+    def run_batch():
+        """Run many topics/documents concurrently; stream NDJSON or return a batch ID"""
+        try:
+            data = request.get_json()
+            if not data:
+                return jsonify({
+                    "status": "error",
+                    "message": "Request body with 'items', 'topics' or 'document_ids' is required"
+                }), 400
+
+            kind = data.get('kind', 'run')
+            if kind not in STAGE_KINDS:
+                return jsonify({
+                    "status": "error",
+                    "message": f"Unknown kind '{kind}'. Use one of: {', '.join(STAGE_KINDS)}"
+                }), 400
+
+            items = _batch_items(data)
+            invalid = [index for index, item in enumerate(items) if not (item.get('topic') or item.get('document_id'))]
+            if not items or invalid:
+                return jsonify({
+                    "status": "error",
+                    "message": "Every batch item needs a topic or document_id" if items else "Batch has no items",
+                    "invalid_items": invalid
+                }), 400
+
+            max_items = env_int('BATCH_MAX_ITEMS', 500)
+            if len(items) > max_items:
+                return jsonify({
+                    "status": "error",
+                    "message": f"Batch has {len(items)} items; the limit is {max_items}"
+                }), 400
+
+            for item in items:
+                document_error = _document_error(item)
+                if document_error:
+                    return document_error
+
+            run_kwargs = _run_options(kind, data)
+            for name in ('run_id', 'upstream_artifact_id', 'document_id', 'shard', 'document_key'):
+                run_kwargs.pop(name, None)
+            try:
+                concurrency = int(data['concurrency']) if data.get('concurrency') else None
+            except (TypeError, ValueError):
+                concurrency = None
+
+            batch = get_batch_manager().submit(kind, items, STAGE_KINDS[kind][2], concurrency=concurrency, run_kwargs=run_kwargs)
+
+            if _request_flag(data, 'stream') or 'application/x-ndjson' in request.headers.get('Accept', ''):
+                return Response(
+                    stream_with_context(batch.iter_lines(timeout=env_int('STREAM_HEARTBEAT_SECONDS', 15))),
+                    mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Batch-Id': batch.id}
+                )
+
+            return jsonify({
+                "status": "accepted",
+                **batch.to_dict(),
+                "status_url": f"/run/batch/{batch.id}",
+                "results_url": f"/run/batch/{batch.id}/results"
+            }), 202
+
+        except Exception as e:
+            logger.error(f"Error in batch endpoint: {str(e)}")
+            return jsonify({
+                "status": "error",
+                "message": f"Internal server error: {str(e)}"
+            }), 500
+
+    @app.route('/run/batch/<batch_id>', methods=['GET'])
+    def batch_status(batch_id):
+        """Batch progress with per-item status"""
+        batch = get_batch_manager().get(batch_id)
+        if batch is None:
+            return jsonify({
+                "status": "error",
+                "message": f"Batch not found: {batch_id}"
+            }), 404
+        return jsonify({"status": "success", "batch": batch.to_dict(include_items=True)})
+
+    @app.route('/run/batch/<batch_id>/results', methods=['GET'])
+    def batch_results(batch_id):
+        """NDJSON results; ?follow=true streams until the batch finishes"""
+        manager = get_batch_manager()
+        batch = manager.get(batch_id)
+        if batch is not None and is_truthy(request.args.get('follow')):
+            return Response(
+                stream_with_context(batch.iter_lines(timeout=env_int('STREAM_HEARTBEAT_SECONDS', 15))),
+                mimetype='application/x-ndjson',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+
+        path = manager.results_path(batch_id)
+        if batch is None and path is None:
+            return jsonify({
+                "status": "error",
+                "message": f"Batch not found: {batch_id}"
+            }), 404
+        if path is None or not os.path.exists(path):
+            return Response('', mimetype='application/x-ndjson')
+        return send_file(os.path.abspath(path), mimetype='application/x-ndjson', max_age=0)
+
+    @app.route('/run/batch/<batch_id>', methods=['DELETE'])
+    def cancel_batch(batch_id):
+        """Cancel the items of a batch that have not started yet"""
+        batch = get_batch_manager().get(batch_id)
+        if batch is None:
+            return jsonify({
+                "status": "error",
+                "message": f"Batch not found: {batch_id}"
+            }), 404
+        cancelled = batch.cancel()
+        return jsonify({
+            "status": "success",
+            "message": f"Cancelled {cancelled} pending items",
+            "batch": batch.to_dict()
+        })
+
+    # -------------------------------
+    # 📬 Job Endpoints
+    # -------------------------------
+
+    @app.route('/jobs', methods=['POST'])
+    def submit_job():
+        """Queue a pipeline or single-agent run and return its job ID"""
+        try:
+            data = request.get_json()
+            if not data or not (data.get('topic') or data.get('document_id') or data.get('run_id')):
+                return jsonify({
+                    "status": "error",
+                    "message": "Topic, document_id or the run_id of an earlier stage is required in request body"
+                }), 400
+
+            kind = data.get('kind', 'run')
+            if kind not in STAGE_KINDS:
+                return jsonify({
+                    "status": "error",
+                    "message": f"Unknown job kind '{kind}'. Use one of: {', '.join(STAGE_KINDS)}"
+                }), 400
+
+            if kind not in STAGE_GRAPH and not (data.get('topic') or data.get('document_id')):
+                return jsonify({
+                    "status": "error",
+                    "message": "Topic or document_id is required in request body"
+                }), 400
+
+            document_error = _document_error(data)
+            if document_error:
+                return document_error
+
+            _, fields = _request_source(data)
+            return _submit_stage_job(kind, data.get('topic'), data.get('current_year'), _run_options(kind, data), inline=_request_flag(data, 'inline_result'), **fields)
+
+        except Exception as e:
+            logger.error(f"Error in job submit endpoint: {str(e)}")
+            return jsonify({
+                "status": "error",
+                "message": f"Internal server error: {str(e)}"
+            }), 500
+
+    @app.route('/jobs/pdf', methods=['POST'])
+    def submit_job_pdf():
+        """Queue a pipeline or single-agent run for an uploaded PDF"""
+        try:
+            upload_error = _pdf_upload_error()
+            if upload_error:
+                return upload_error
+
+            kind = request.form.get('kind', 'run')
+            if kind not in STAGE_KINDS:
+                return jsonify({
+                    "status": "error",
+                    "message": f"Unknown job kind '{kind}'. Use one of: {', '.join(STAGE_KINDS)}"
+                }), 400
+
+            pdf_file = request.files['pdf_file']
+            pdf_stats = {}
+            record, _ = text_from_upload(pdf_file, stats=pdf_stats)
+            run_kwargs = dict(_run_options(kind, request.form), document_id=record['document_id'])
+            return _submit_stage_job(kind, request.form.get('topic'), request.form.get('current_year'), run_kwargs, inline=_request_flag(request.form, 'inline_result'), source=f"PDF: {pdf_file.filename}", extraction=_extraction_summary(pdf_stats))
+
+        except Exception as e:
+            logger.error(f"Error in job PDF submit endpoint: {str(e)}")
+            return jsonify({
+                "status": "error",
+                "message": f"Internal server error: {str(e)}"
+            }), 500
+
+    @app.route('/jobs', methods=['GET'])
+    def list_jobs():
+        """List recent jobs, newest first"""
+        try:
+            limit = int(request.args.get('limit', 50))
+        except ValueError:
+            limit = 50
+        manager = get_job_manager()
+        jobs = manager.list(status=request.args.get('status'), kind=request.args.get('kind'), limit=limit)
+        return jsonify({
+            "status": "success",
+            "jobs": [job.to_dict() for job in jobs],
+            "stats": manager.stats()
+        })
+
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    def job_status(job_id):
+        """Return the status of a job"""
+        job = get_job_manager().get(job_id)
+        if not job:
+            return jsonify({
+                "status": "error",
+                "message": f"Job not found: {job_id}"
+            }), 404
+        return jsonify({"status": "success", "job": job.to_dict()})
+
+    @app.route('/jobs/<job_id>/result', methods=['GET'])
+    def job_result(job_id):
+        """Return the result of a finished job (202 while it is still pending)"""
+        job = get_job_manager().get(job_id)
+        if not job:
+            return jsonify({
+                "status": "error",
+                "message": f"Job not found: {job_id}"
+            }), 404
+        if not job.finished:
+            return jsonify({"status": "pending", "job": job.to_dict()}), 202
+        if job.payload is not None:
+            return jsonify(job.payload), 200 if job.status == 'succeeded' else 500
+        return jsonify({
+            "status": "error",
+            "job": job.to_dict(),
+            "message": job.message
+        }), 500
+
+    @app.route('/jobs/<job_id>', methods=['DELETE'])
+    def cancel_job(job_id):
+        """Cancel a job that is still queued"""
+        manager = get_job_manager()
+        if not manager.get(job_id):
+            return jsonify({
+                "status": "error",
+                "message": f"Job not found: {job_id}"
+            }), 404
+        if not manager.cancel(job_id):
+            return jsonify({
+                "status": "error",
+                "message": "Only queued jobs can be cancelled"
+            }), 409
+        return jsonify({"status": "success", "message": f"Job cancelled: {job_id}"})
 
     # -------------------------------
     # 🎓 Training/Testing Endpoints (existing)
@@ -674,7 +1548,7 @@ def run():
                 'current_year': current_year
             }
             
-            TestGemini().crew().train(n_iterations=n_iterations, filename=filename, inputs=inputs)
+            build_crew().train(n_iterations=n_iterations, filename=filename, inputs=inputs)
             
             return jsonify({
                 "status": "success",
@@ -708,7 +1582,7 @@ def run():
                 "current_year": current_year
             }
             
-            result = TestGemini().crew().test(n_iterations=n_iterations, eval_llm=eval_llm, inputs=inputs)
+            result = build_crew().test(n_iterations=n_iterations, eval_llm=eval_llm, inputs=inputs)
             
             return jsonify({
                 "status": "success",
@@ -734,7 +1608,7 @@ def run():
                 }), 400
             
             task_id = data['task_id']
-            TestGemini().crew().replay(task_id=task_id)
+            build_crew().replay(task_id=task_id)
             
             return jsonify({
                 "status": "success",
@@ -747,6 +1621,171 @@ def run():
                 "message": f"Replay error: {str(e)}"
             }), 500
 
+    # -------------------------------
+    # 📚 Document Registry
+    # -------------------------------
+
+    @app.route('/documents', methods=['POST'])
+    def register_document():
+        """Register a PDF once and get a document ID to use in later calls"""
+        try:
+            upload_error = _pdf_upload_error()
+            if upload_error:
+                return upload_error
+
+            pdf_file = request.files['pdf_file']
+            pdf_stats = {}
+            record, _ = text_from_upload(pdf_file, stats=pdf_stats)
+            return jsonify({
+                "status": "success",
+                "document": get_document_store().summary(record),
+                "extraction": _extraction_summary(pdf_stats)
+            }), 200 if pdf_stats.get('cache') == 'hit' else 201
+
+        except Exception as e:
+            logger.error(f"Error in document registration endpoint: {str(e)}")
+            return jsonify({
+                "status": "error",
+                "message": f"Internal server error: {str(e)}"
+            }), 500
+
+    @app.route('/documents/<document_id>', methods=['GET'])
+    def document_details(document_id):
+        """Document metadata; add ?include_text=true for the extracted text"""
+        store = get_document_store()
+        try:
+            record = store.get(document_id)
+        except DocumentNotFound as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 404
+
+        response_data = {"status": "success", "document": store.summary(record)}
+        if is_truthy(request.args.get('include_text')):
+            response_data["text"] = store.text(record)
+        return jsonify(response_data)
+
+    @app.route('/documents/<document_id>', methods=['DELETE'])
+    def delete_document(document_id):
+        """Forget a registered document"""
+        get_document_store().delete(document_id)
+        return jsonify({
+            "status": "success",
+            "message": f"Document removed: {document_id}"
+        })
+
+    # -------------------------------
+    # 🧩 Stage Runs & Artifacts
+    # -------------------------------
+
+    @app.route('/stages', methods=['GET'])
+    def stage_graph():
+        """The agent stage DAG: which stage consumes which upstream artifact"""
+        return jsonify({
+            "status": "success",
+            "stages": {stage: {"upstream": node['upstream']} for stage, node in STAGE_GRAPH.items()}
+        })
+
+    @app.route('/runs/<run_id>', methods=['GET'])
+    def run_artifacts(run_id):
+        """List the stage artifacts stored for a run"""
+        try:
+            return jsonify({
+                "status": "success",
+                "run_id": run_id,
+                "artifacts": get_stage_store().list(run_id)
+            })
+        except ArtifactNotFound as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 404
+
+    @app.route('/runs/<run_id>/artifacts/<artifact_id>', methods=['GET'])
+    def run_artifact(run_id, artifact_id):
+        """Fetch one stored stage artifact, including its content"""
+        try:
+            return jsonify({
+                "status": "success",
+                "artifact": get_stage_store().get(run_id, artifact_id=artifact_id)
+            })
+        except ArtifactNotFound as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 404
+
+    @app.route('/runs/<run_id>/files', methods=['GET'])
+    def run_files(run_id):
+        """List the files generated by a run"""
+        try:
+            return jsonify({
+                "status": "success",
+                "run_id": run_id,
+                "files": get_run_file_store().list(run_id)
+            })
+        except ArtifactNotFound as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 404
+
+    @app.route('/runs/<run_id>/files/<name>', methods=['GET'])
+    def run_file(run_id, name):
+        """Download a generated file, streamed from disk"""
+        try:
+            path = get_run_file_store().path(run_id, name)
+        except ArtifactNotFound as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 404
+        mimetype = 'application/json' if name.endswith('.json') else 'text/x-c++src'
+        return send_file(
+            path,
+            mimetype=mimetype,
+            as_attachment=is_truthy(request.args.get('download', 'true')),
+            download_name=name,
+            conditional=True
+        )
+
+    @app.route('/pool', methods=['GET'])
+    def crew_pool_stats():
+        """Crew pool usage plus crew construction time vs. LLM execution time, the LLM governor's waits and coalesced runs"""
+        from test_gemini.governor import get_llm_governor, should_govern
+        return jsonify({
+            "status": "success",
+            "crew_pool": get_crew_pool().stats(),
+            "llm_governor": get_llm_governor().stats() if should_govern() else None,
+            "single_flight": get_single_flight().stats()
+        })
+
+    @app.route('/cache', methods=['GET'])
+    def stage_cache_stats():
+        """Stage result cache hit/miss counters and size, and the prior artifact index"""
+        from test_gemini.llm_cache import get_llm_cache
+        return jsonify({
+            "status": "success",
+            "stage_cache": get_stage_cache().stats(),
+            "llm_cache": get_llm_cache().stats(),
+            "retrieval_index": get_retrieval_index().stats()
+        })
+
+    @app.route('/cache', methods=['DELETE'])
+    def stage_cache_clear():
+        """Drop every cached stage result"""
+        get_stage_cache().clear()
+        return jsonify({
+            "status": "success",
+            "message": "Stage cache cleared"
+        })
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Prometheus metrics: requests, stage durations, LLM tokens, PDF extraction, runs in flight"""
+        return Response(get_metrics().render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
     # Health check endpoint
     @app.route('/health')
     def health_check():
@@ -761,7 +1800,13 @@ def run():
                     "individual_agents_pdf": ["/requirements/pdf", "/test-design/pdf", "/test-implementation/pdf"],
                     "full_pipeline": ["/run"],
                     "full_pipeline_pdf": ["/run/pdf"],
-                    "training": ["/train", "/test", "/replay"]
+                    "streaming": ["/run/stream", "/run/stream/pdf"],
+                    "batch": ["/run/batch", "/run/batch/<batch_id>", "/run/batch/<batch_id>/results"],
+                    "jobs": ["/jobs", "/jobs/pdf", "/jobs/<job_id>", "/jobs/<job_id>/result"],
+                    "documents": ["/documents", "/documents/<document_id>"],
+                    "runs": ["/stages", "/runs/<run_id>", "/runs/<run_id>/artifacts/<artifact_id>", "/runs/<run_id>/files", "/runs/<run_id>/files/<name>"],
+                    "training": ["/train", "/test", "/replay"],
+                    "monitoring": ["/pool", "/cache", "/metrics"]
                 }
             })
         except Exception as e:
@@ -770,46 +1815,24 @@ def run():
                 "error": str(e)
             })
 
-    # Get port from environment variable or default to 5067
-    port = int(os.environ.get('PORT', 5067))
-    logger.info(f"Starting CrewAI API server on port {port}")
-    app.run(host='0.0.0.0', port=port, debug=False)
+    return app
 
-# -------------------------------
-# Optional CLI: train, test, replay (existing)
-# -------------------------------
-def train():
-    """Train the crew for a given number of iterations."""
-    inputs = {
-        "topic": "Real-time Operating System (RTOS)",
-        'current_year': str(datetime.now().year)
-    }
+def prewarm_crews():
+    """Build crews before taking traffic so requests skip crew construction."""
     try:
-        TestGemini().crew().train(n_iterations=int(sys.argv[2]), filename=sys.argv[3], inputs=inputs)
-        print(f"Training completed for {sys.argv[2]} iterations, results saved to {sys.argv[3]}")
+        get_crew_pool().prewarm(env_int('CREW_POOL_PREWARM', get_crew_pool().size))
     except Exception as e:
-        raise Exception(f"Error training the crew: {e}")
+        logger.warning(f"Crew pool pre-warm failed, crews will be built on demand: {str(e)}")
 
-def replay():
-    """Replay the crew execution from a specific task."""
-    try:
-        TestGemini().crew().replay(task_id=sys.argv[2])
-        print(f"Replay completed for task: {sys.argv[2]}")
-    except Exception as e:
-        raise Exception(f"Error replaying: {e}")
+def run():
+    """Start the API on Flask's development server (use serve() in production)."""
+    app = create_app()
+    prewarm_crews()
 
-def test():
-    """Test the crew execution and returns the results."""
-    inputs = {
-        "topic": "Automotive Control Unit Testing",
-        "current_year": str(datetime.now().year)
-    }
-    try:
-        result = TestGemini().crew().test(n_iterations=int(sys.argv[2]), eval_llm=sys.argv[3], inputs=inputs)
-        print(f"Testing completed for {sys.argv[2]} iterations using {sys.argv[3]} as evaluation LLM")
-        return result
-    except Exception as e:
-        raise Exception(f"Error testing the crew: {e}")
+    # Get port from environment variable or default to 5067
+    port = int(os.environ.get('PORT', 5067))
+    logger.info(f"Starting CrewAI API server on port {port}")
+    app.run(host='0.0.0.0', port=port, debug=False)
 
 # -------------------------------
 # 🧭 Main entry
@@ -819,6 +1842,9 @@ if __name__ == "__main__":
         cmd = sys.argv[1].lower()
         if cmd == "run":
             run()  # 🔥 Start Flask app
+        elif cmd == "serve":
+            from test_gemini.server import serve
+            serve()  # 🚀 Multi-worker production server
         elif cmd == "train":
             if len(sys.argv) < 4:
                 print("Usage: python main.py train <n_iterations> <filename>")
@@ -835,7 +1861,7 @@ if __name__ == "__main__":
             else:
                 test()
         else:
-            print("Invalid command. Use: run | train | replay | test")
+            print("Invalid command. Use: run | serve | train | replay | test")
     else:
         # Default behavior: Start Flask app
         print("Starting CrewAI Requirements & Testing API...")
@@ -0,0 +1,268 @@
+"""
+Map-reduce requirements analysis for long specification documents.
+
+Instead of sending a whole specification to one requirements_analysis_task
+call, the document is split on section boundaries (see sections.py), the
+requirements_engineer analyzes the chunks concurrently on pooled crews, and
+a reduce step merges the categorized requirements of every chunk into one
+document in the format tasks.yaml asks for, dropping duplicates that
+several chunks reported.
+"""
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from test_gemini.cache import get_stage_cache, normalize_text
+from test_gemini.crew_pool import get_crew_pool
+from test_gemini.revisions import bind_revision, current_revision, reuse_or_generate
+from test_gemini.sections import chunk_text
+from test_gemini.settings import env_int
+from test_gemini.stages import execute_stage
+from test_gemini.streaming import bind_stream, current_stream, publish
+
+logger = logging.getLogger(__name__)
+
+# Categories in the order requirements_analysis_task's expected_output lists them
+REQUIREMENT_CATEGORIES = (
+    ('Functional Requirements', re.compile(r'(?<!non-)(?<!non )\bfunctional\b', re.IGNORECASE)),
+    ('Interface Requirements', re.compile(r'\binterfaces?\b', re.IGNORECASE)),
+    ('Performance Requirements', re.compile(r'\b(?:performance|timing)\b', re.IGNORECASE)),
+    ('Error Handling Requirements', re.compile(r'\b(?:error|fault|exception)s?\b', re.IGNORECASE)),
+    ('Hardware Requirements', re.compile(r'\bhardware\b', re.IGNORECASE)),
+    ('Safety Requirements', re.compile(r'\bsafety\b', re.IGNORECASE)),
+    ('Power Management Requirements', re.compile(r'\bpower\b', re.IGNORECASE)),
+)
+OTHER_CATEGORY = 'Other Requirements'
+
+_BULLET = re.compile(r'^(\s*)(?:[-*+•]|\d+[.)]|[a-z][.)])\s+')
+_REQUIREMENT_ID = re.compile(r'^\s*\**\[?[A-Z]{1,6}(?:-[A-Z]{1,6})*[-_ ]?\d+(?:\.\d+)*\]?\**\s*[:.)\-–]?\s*')
+_EMPHASIS = re.compile(r'[*_`]+')
+# Unlike _REQUIREMENT_ID, no space before the number ('CAN 2.0' is not an ID)
+_ID_TOKEN = re.compile(r'\b[A-Z]{1,6}(?:-[A-Z]{1,6})*[-_]?\d+(?:\.\d+)*')
+
+
+def should_chunk(text, chunked=None):
+    """
+    Whether text should go through the map-reduce path: an explicit
+    request wins, otherwise documents longer than
+    REQUIREMENTS_CHUNK_THRESHOLD characters are chunked (0 = never).
+    """
+    if chunked is not None:
+        return bool(chunked)
+    threshold = env_int('REQUIREMENTS_CHUNK_THRESHOLD', 24000)
+    return bool(threshold) and len(text or '') > threshold
+
+
+def heading_category(line):
+    """The category a heading line names, or None if it is not a heading."""
+    stripped = line.strip()
+    bullet = _BULLET.match(line)
+    body = line[bullet.end():].strip() if bullet else stripped
+    is_markdown_heading = body.startswith('#')
+    body = body.lstrip('#').strip()
+    is_emphasized = body.startswith(('**', '__')) and body.rstrip(':').endswith(('**', '__'))
+    title = _EMPHASIS.sub('', body).strip().rstrip(':').strip()
+    if not title or len(title) > 60:
+        return None
+    if not (is_markdown_heading or is_emphasized or re.search(r'\brequirements?$', title, re.IGNORECASE)):
+        return None
+    if bullet and not (is_emphasized or is_markdown_heading):
+        return None
+    for category, pattern in REQUIREMENT_CATEGORIES:
+        if pattern.search(title):
+            return category
+    return OTHER_CATEGORY if re.search(r'\brequirements?\b', title, re.IGNORECASE) else None
+
+
+def parse_requirements(text):
+    """
+    Parse a requirements document into {category: [requirement, ...]}.
+
+    Top-level list items become requirements; nested items and wrapped
+    lines stay attached to the requirement they belong to. Text that is not
+    under a recognized category heading is kept under OTHER_CATEGORY.
+    """
+    categorized = {}
+    category = None
+    current = None
+    base_indent = None
+
+    def flush():
+        if current:
+            categorized.setdefault(category or OTHER_CATEGORY, []).append('\n'.join(current).strip())
+
+    for line in (text or '').splitlines():
+        if not line.strip():
+            continue
+        heading = heading_category(line)
+        if heading:
+            flush()
+            category, current, base_indent = heading, None, None
+            continue
+        if line.lstrip().startswith('#'):
+            # A heading that names no category (e.g. the document title)
+            continue
+
+        bullet = _BULLET.match(line)
+        indent = len(line) - len(line.lstrip())
+        if bullet and (base_indent is None or indent <= base_indent):
+            flush()
+            base_indent = indent if base_indent is None else min(base_indent, indent)
+            current = [line[bullet.end():].strip()]
+        elif current is not None:
+            current.append(line.rstrip())
+        elif category:
+            # Paragraph-style requirements without list markers
+            current = [line.strip()]
+            flush()
+            current = None
+    flush()
+    return categorized
+
+
+def requirement_id(requirement):
+    """The ID a requirement starts with (e.g. 'REQ-F001'), or None."""
+    match = _REQUIREMENT_ID.match(re.sub(r'[*`]+', '', requirement.splitlines()[0]) if requirement else '')
+    if not match:
+        return None
+    token = _ID_TOKEN.search(match.group())
+    return token.group() if token else None
+
+
+def strip_requirement_id(requirement):
+    """The requirement text without its leading ID."""
+    if not requirement_id(requirement):
+        return requirement.strip()
+    first, *rest = requirement.splitlines()
+    return '\n'.join([_REQUIREMENT_ID.sub('', re.sub(r'[*`]+', '', first), count=1), *rest]).strip()
+
+
+def _dedupe_key(requirement):
+    """
+    The whole requirement without its ID, emphasis and layout, so
+    requirements that open the same way ("The system shall:") but differ in
+    their body are kept apart.
+    """
+    first_line, *body = requirement.splitlines()
+    text = '\n'.join([_REQUIREMENT_ID.sub('', _EMPHASIS.sub('', first_line))] + [_EMPHASIS.sub('', line) for line in body])
+    return normalize_text(text).lower().rstrip('.;:')
+
+
+def merge_requirements(documents):
+    """
+    Reduce step: merge the categorized requirements of several chunk
+    analyses, dropping duplicates. Returns (categorized, duplicates_removed).
+    """
+    merged = {}
+    seen = set()
+    duplicates = 0
+    for document in documents:
+        for category, requirements in parse_requirements(document).items():
+            for requirement in requirements:
+                key = (category, _dedupe_key(requirement))
+                if not key[1]:
+                    continue
+                if key in seen:
+                    duplicates += 1
+                    continue
+                seen.add(key)
+                merged.setdefault(category, []).append(requirement)
+    return merged, duplicates
+
+
+def render_requirements(categorized, topic_label=None):
+    """Render merged requirements as the categorized requirements document."""
+    title = f"# Requirements Document: {topic_label}" if topic_label else "# Requirements Document"
+    lines = [title, '']
+    for category in [name for name, _ in REQUIREMENT_CATEGORIES] + [OTHER_CATEGORY]:
+        requirements = categorized.get(category)
+        if not requirements:
+            continue
+        lines.append(f"## {category}")
+        lines.append('')
+        for requirement in requirements:
+            first, *rest = requirement.splitlines()
+            lines.append(f"- {first}")
+            lines.extend(f"  {line.strip()}" if not line.startswith(' ') else line for line in rest)
+        lines.append('')
+    return '\n'.join(lines).strip() + '\n'
+
+
+def _analyze_chunk(index, chunk, current_year, use_cache, topic=None, stream=None, revision=None):
+    with bind_stream(stream), bind_revision(revision):
+        result, cached = _analyze_chunk_cached(index, chunk, current_year, use_cache, topic)
+        publish('chunk_completed', stage='requirements', chunk=index + 1, cached=cached)
+    return result, cached
+
+
+def _analyze_chunk_cached(index, chunk, current_year, use_cache, topic):
+    cache = get_stage_cache()
+    if topic:
+        # The chunk goes in once as task context; the templates get the label
+        inputs, context = {'topic': topic, 'current_year': current_year}, chunk
+    else:
+        inputs, context = {'topic': chunk, 'current_year': current_year}, None
+    key = cache.key('requirements-chunk', dict(inputs, context=context) if context else inputs)
+
+    def generate():
+        if use_cache:
+            cached = cache.get('requirements-chunk', key)
+            if cached is not None:
+                return cached, True
+        else:
+            cache.record_bypass('requirements-chunk')
+
+        started = time.perf_counter()
+        result = execute_stage('requirements', inputs, context)
+        cache.put('requirements-chunk', key, result)
+        logger.info(f"Requirements chunk {index + 1} analyzed in {time.perf_counter() - started:.1f}s")
+        return result, False
+
+    return reuse_or_generate('requirements-chunk', key, generate)
+
+
+def analyze_requirements_chunked(text, current_year, use_cache=True, stats=None, topic=None):
+    """
+    Map-reduce requirements analysis of a long document. Chunks of at most
+    REQUIREMENTS_CHUNK_CHARS characters are analyzed by the
+    requirements_engineer with up to REQUIREMENTS_MAP_CONCURRENCY running at
+    once (each on its own pooled crew); the results are merged into one
+    requirements document. With a topic label each chunk is passed as task
+    context; without one the chunk itself fills {topic}. stats (a dict)
+    receives chunk counts and timings. Revision-aware runs chunk stably and
+    reuse the previous revision's analysis of unchanged chunks.
+    """
+    stats = stats if stats is not None else {}
+    revision = current_revision()
+    chunks = chunk_text(text, max(1000, env_int('REQUIREMENTS_CHUNK_CHARS', 12000)), stable=revision is not None)
+    concurrency = max(1, min(
+        env_int('REQUIREMENTS_MAP_CONCURRENCY', 4),
+        get_crew_pool().size,
+        len(chunks)
+    ))
+    logger.info(f"Analyzing requirements in {len(chunks)} chunks, {concurrency} at a time")
+    publish('chunking', stage='requirements', chunks=len(chunks), concurrency=concurrency)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='requirements-map') as executor:
+        futures = [
+            executor.submit(_analyze_chunk, index, chunk, current_year, use_cache, topic, current_stream(), revision)
+            for index, chunk in enumerate(chunks)
+        ]
+        outcomes = [future.result() for future in futures]
+    map_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    merged, duplicates = merge_requirements([result for result, _ in outcomes])
+    document = render_requirements(merged, topic)
+    stats.update({
+        "chunks": len(chunks),
+        "concurrency": concurrency,
+        "cached_chunks": sum(1 for _, cached in outcomes if cached),
+        "requirements": sum(len(requirements) for requirements in merged.values()),
+        "duplicates_removed": duplicates,
+        "map_seconds": round(map_seconds, 3),
+        "reduce_seconds": round(time.perf_counter() - started, 3)
+    })
+    return document
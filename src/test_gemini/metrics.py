@@ -0,0 +1,323 @@
+"""
+Prometheus metrics without a client library or collector.
+
+The process keeps counters, gauges and histograms in memory and renders
+them in the Prometheus text exposition format for GET /metrics. Under the
+multi-worker server (see server.py), METRICS_DIR is set. Each worker then
+writes a snapshot of its values there every METRICS_FLUSH_SECONDS, and a
+scrape, whichever worker serves it, adds up the snapshots of all workers.
+
+What is measured:
+- HTTP requests and latency per route;
+- stage durations for the three TestGemini tasks;
+- LLM calls and tokens per agent, as deltas of each agent's token counters;
+- PDF extraction time and page counts;
+- runs in flight;
+- compile checks of the generated test code;
+- LLM call waits and rate-limit responses under the governor;
+- runs coalesced with an identical run in flight.
+"""
+import functools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from test_gemini.settings import env_float
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'test_gemini_'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+STAGE_BUCKETS = (1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 600, 1200)
+PAGE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'http_requests_total': ('counter', "HTTP requests by route, method and status", None),
+    'http_request_duration_seconds': ('histogram', "Time to the response (first byte for streams) by route", LATENCY_BUCKETS),
+    'stage_duration_seconds': ('histogram', "Execution time of a TestGemini task by stage", STAGE_BUCKETS),
+    'llm_calls_total': ('counter', "Successful LLM calls by agent", None),
+    'llm_tokens_total': ('counter', "LLM tokens by agent and type (prompt, completion, cached_prompt)", None),
+    'llm_cache_total': ('counter', "LLM completion cache lookups and stores by agent and outcome (hits, misses, stores)", None),
+    'pdf_extraction_seconds': ('histogram', "PDF text extraction time by mode (serial, parallel)", LATENCY_BUCKETS),
+    'pdf_pages': ('histogram', "Pages extracted per PDF", PAGE_BUCKETS),
+    'runs_in_flight': ('gauge', "Pipeline and agent runs currently executing by kind", None),
+    'compile_checks_total': ('counter', "Compile checks of generated files by outcome (passed, failed, cached)", None),
+    'llm_governor_wait_seconds': ('histogram', "Time an LLM call waited for the rate limits, a call slot or a backoff by agent", LATENCY_BUCKETS),
+    'llm_rate_limits_total': ('counter', "Rate-limit responses to LLM calls by agent and outcome (retried, failed)", None),
+    'coalesced_calls_total': ('counter', "Runs coalesced with an identical run in flight by kind and outcome (attached, queued)", None),
+}
+
+# TokenProcess attribute -> llm_tokens_total type label
+_TOKEN_TYPES = {
+    'prompt_tokens': 'prompt',
+    'completion_tokens': 'completion',
+    'cached_prompt_tokens': 'cached_prompt',
+}
+
+
+class Metrics:
+    """In-process metric values, optionally shared with other workers through a directory."""
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.pid = os.getpid()
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._values = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _key(self, name, labels):
+        if name not in METRICS:
+            raise KeyError(f"Unknown metric: {name}")
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """Add value to a counter or gauge."""
+        if not value:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+        self._start_flusher()
+
+    def observe(self, name, value, **labels):
+        """Record one observation in a histogram."""
+        key = self._key(name, labels)
+        buckets = METRICS[name][2]
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+        self._start_flusher()
+
+    @contextmanager
+    def in_flight(self, kind):
+        self.inc('runs_in_flight', 1, kind=kind)
+        try:
+            yield
+        finally:
+            self.inc('runs_in_flight', -1, kind=kind)
+
+    @contextmanager
+    def llm_usage(self, agents):
+        """
+        Count the LLM calls and tokens of agents ((label, agent) pairs)
+        made inside the block, from their token counters. Pooled crews are
+        checked out exclusively, so the deltas belong to this execution.
+        """
+        before = [(label, agent, _token_counts(agent)) for label, agent in agents]
+        try:
+            yield
+        finally:
+            for label, agent, counts in before:
+                after = _token_counts(agent)
+                if not counts or not after:
+                    continue
+                self.inc('llm_calls_total', after['successful_requests'] - counts['successful_requests'], agent=label)
+                for attribute, token_type in _TOKEN_TYPES.items():
+                    self.inc('llm_tokens_total', after[attribute] - counts[attribute], agent=label, type=token_type)
+
+    def snapshot(self):
+        """This process's values as JSON-serializable series."""
+        with self._lock:
+            return [
+                [name, dict(labels), dict(value, buckets=list(value['buckets'])) if isinstance(value, dict) else value]
+                for (name, labels), value in self._values.items()
+            ]
+
+    def flush(self, drop_gauges=False):
+        """Write this process's snapshot to the shared directory."""
+        if not self.directory:
+            return
+        series = self.snapshot()
+        if drop_gauges:
+            series = [entry for entry in series if METRICS[entry[0]][0] != 'gauge']
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as handle:
+            json.dump({'pid': self.pid, 'series': series}, handle)
+        os.replace(tmp_path, os.path.join(self.directory, f"{self.pid}.json"))
+
+    def _start_flusher(self):
+        if not self.directory or self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                logger.warning(f"Could not write metrics snapshot: {str(e)}")
+
+    def collect(self):
+        """All series to expose: this process's, plus the other workers' snapshots."""
+        merged = {}
+
+        def add(name, labels, value):
+            if name not in METRICS:
+                return
+            key = (name, tuple(sorted(labels.items())))
+            current = merged.get(key)
+            if isinstance(value, dict):
+                if current is None:
+                    merged[key] = dict(value, buckets=list(value['buckets']))
+                else:
+                    current['buckets'] = [a + b for a, b in zip(current['buckets'], value['buckets'])]
+                    current['sum'] += value['sum']
+                    current['count'] += value['count']
+            else:
+                merged[key] = (current or 0) + value
+
+        for name, labels, value in self.snapshot():
+            add(name, labels, value)
+        if self.directory:
+            for entry in os.listdir(self.directory):
+                if not entry.endswith('.json') or entry == f"{self.pid}.json":
+                    continue
+                try:
+                    with open(os.path.join(self.directory, entry), 'r', encoding='utf-8') as handle:
+                        data = json.load(handle)
+                except (OSError, ValueError):
+                    continue
+                for name, labels, value in data.get('series', []):
+                    add(name, labels, value)
+        return merged
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        merged = self.collect()
+        lines = []
+        for name, (metric_type, help_text, buckets) in METRICS.items():
+            series = sorted((labels, value) for (series_name, labels), value in merged.items() if series_name == name)
+            lines.append(f"# HELP {PREFIX}{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}{name} {metric_type}")
+            for labels, value in series:
+                if metric_type != 'histogram':
+                    lines.append(f"{PREFIX}{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                for bound, count in zip(buckets, value['buckets']):
+                    lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {count}")
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {value['count']}")
+                lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {_format_value(value['sum'])}")
+                lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {value['count']}")
+        return '\n'.join(lines) + '\n'
+
+
+def _token_counts(agent):
+    token_process = getattr(agent, '_token_process', None)
+    if token_process is None:
+        return None
+    summary = token_process.get_summary()
+    return {
+        attribute: getattr(summary, attribute, 0) or 0
+        for attribute in ('successful_requests', *_TOKEN_TYPES)
+    }
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{label}="{_escape(value)}"' for label, value in labels) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def track_in_flight(kind):
+    """Decorator counting the wrapped run_* function in runs_in_flight while it executes."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with get_metrics().in_flight(kind):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+_handlers_installed = False
+_handlers_lock = threading.Lock()
+_task_starts = threading.local()
+
+
+def install_event_handlers():
+    """
+    Time tasks run by Crew.kickoff through the crewai event bus (stages run
+    with execute_stage time themselves). Registered once per process.
+    """
+    global _handlers_installed
+    with _handlers_lock:
+        if _handlers_installed:
+            return
+        _handlers_installed = True
+
+    from crewai.utilities.events import crewai_event_bus
+    from crewai.utilities.events.task_events import TaskCompletedEvent, TaskFailedEvent, TaskStartedEvent
+
+    from test_gemini.streaming import TASK_STAGES
+
+    def starts():
+        if not hasattr(_task_starts, 'value'):
+            _task_starts.value = {}
+        return _task_starts.value
+
+    @crewai_event_bus.on(TaskStartedEvent)
+    def on_task_started(source, event):
+        starts()[id(event.task)] = time.perf_counter()
+
+    def finished(event):
+        started = starts().pop(id(event.task), None)
+        stage = TASK_STAGES.get(getattr(event.task, 'name', None))
+        if started is not None and stage:
+            get_metrics().observe('stage_duration_seconds', time.perf_counter() - started, stage=stage)
+
+    @crewai_event_bus.on(TaskCompletedEvent)
+    def on_task_completed(source, event):
+        finished(event)
+
+    @crewai_event_bus.on(TaskFailedEvent)
+    def on_task_failed(source, event):
+        finished(event)
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """
+    Return this process's Metrics (a forked worker gets its own instead of
+    the copy inherited from the parent), configured from the environment.
+    """
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None or _metrics.pid != os.getpid():
+            _metrics = Metrics(
+                directory=os.environ.get('METRICS_DIR') or None,
+                flush_interval=env_float('METRICS_FLUSH_SECONDS', 5.0)
+            )
+        return _metrics
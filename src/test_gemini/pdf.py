@@ -0,0 +1,195 @@
+"""
+PDF text extraction.
+
+Pages are streamed one at a time from PyPDF2 and joined once at the end,
+so extraction cost grows linearly with the document. Large documents can be
+split into page ranges and extracted in parallel on a process pool. Page
+and character caps keep runaway uploads bounded.
+"""
+import atexit
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from test_gemini.metrics import get_metrics
+from test_gemini.settings import env_bool, env_int
+
+logger = logging.getLogger(__name__)
+
+
+class PDFExtractionError(Exception):
+    """Raised when a PDF cannot be read or contains no text."""
+
+
+def _open_reader(pdf_source):
+    if isinstance(pdf_source, (bytes, bytearray)):
+        pdf_source = io.BytesIO(pdf_source)
+    # Imported on first use so processes that never read a PDF skip PyPDF2
+    import PyPDF2
+    return PyPDF2.PdfReader(pdf_source)
+
+
+def iter_pdf_pages(pdf_source, start=0, stop=None):
+    """
+    Yield (page_index, text, seconds) for each page in [start, stop).
+
+    pdf_source may be raw bytes, a path or a binary file object.
+    """
+    reader = _open_reader(pdf_source)
+    total = len(reader.pages)
+    stop = total if stop is None else min(stop, total)
+    for index in range(start, stop):
+        started = time.perf_counter()
+        text = reader.pages[index].extract_text() or ''
+        yield index, text, time.perf_counter() - started
+
+
+def count_pages(pdf_source):
+    return len(_open_reader(pdf_source).pages)
+
+
+def _extract_range(pdf_bytes, start, stop):
+    """Process-pool worker: extract one page range."""
+    return list(iter_pdf_pages(pdf_bytes, start, stop))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = env_int('PDF_WORKERS', os.cpu_count() or 2)
+            # spawn: the API server is multi-threaded, so forking it is unsafe
+            _executor = ProcessPoolExecutor(
+                max_workers=max(1, workers),
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            atexit.register(_executor.shutdown, wait=False)
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _iter_parallel(pdf_bytes, total_pages, workers, chunk_pages):
+    """Extract page ranges on the process pool, yielding pages in order."""
+    chunk_pages = max(1, chunk_pages or -(-total_pages // (workers * 4)))
+    next_page = 0
+    futures = []
+    try:
+        executor = _get_executor()
+        futures = [
+            executor.submit(_extract_range, pdf_bytes, start, min(start + chunk_pages, total_pages))
+            for start in range(0, total_pages, chunk_pages)
+        ]
+        for future in futures:
+            for page in future.result():
+                next_page = page[0] + 1
+                yield page
+    except BrokenProcessPool as e:
+        # Fall back to in-process extraction for whatever is left
+        logger.warning(f"PDF process pool failed, extracting sequentially: {str(e)}")
+        _reset_executor()
+        for page in iter_pdf_pages(pdf_bytes, next_page, total_pages):
+            yield page
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def stream_pdf_pages(pdf_bytes, max_pages=None, parallel=None, stats=None):
+    """
+    Yield (page_index, text, seconds) for the document, in page order.
+
+    parallel=None decides automatically: documents with at least
+    PDF_PARALLEL_MIN_PAGES pages are extracted on the process pool when
+    PDF_PARALLEL is enabled.
+    """
+    document_pages = count_pages(pdf_bytes)
+    total_pages = min(document_pages, max_pages) if max_pages else document_pages
+
+    workers = env_int('PDF_WORKERS', os.cpu_count() or 2)
+    if parallel is None:
+        parallel = (
+            env_bool('PDF_PARALLEL', True)
+            and workers > 1
+            and total_pages >= env_int('PDF_PARALLEL_MIN_PAGES', 64)
+        )
+    if stats is not None:
+        stats['document_pages'] = document_pages
+        stats['parallel'] = bool(parallel)
+
+    if parallel:
+        return _iter_parallel(pdf_bytes, total_pages, workers, env_int('PDF_CHUNK_PAGES', 0))
+    return iter_pdf_pages(pdf_bytes, 0, total_pages)
+
+
+def read_pdf_bytes(pdf_file):
+    """Raw bytes of a file object (e.g. a Flask upload), a path or bytes."""
+    if hasattr(pdf_file, 'read'):
+        return pdf_file.read()
+    if isinstance(pdf_file, (bytes, bytearray)):
+        return bytes(pdf_file)
+    with open(pdf_file, 'rb') as handle:
+        return handle.read()
+
+
+def extract_pdf_pages(pdf_bytes, max_pages=None, parallel=None, stats=None):
+    """
+    Extract the text of every page (up to max_pages, default PDF_MAX_PAGES)
+    as a list. When stats is a dict it receives page counts and timings.
+    """
+    max_pages = max_pages if max_pages is not None else env_int('PDF_MAX_PAGES', 0)
+    stats = stats if stats is not None else {}
+
+    started = time.perf_counter()
+    pages = []
+    page_seconds = []
+    stream = stream_pdf_pages(pdf_bytes, max_pages=max_pages or None, parallel=parallel, stats=stats)
+    try:
+        for _, text, seconds in stream:
+            pages.append(text)
+            page_seconds.append(round(seconds, 4))
+    finally:
+        if hasattr(stream, 'close'):
+            stream.close()
+
+    stats.update({
+        "pages": len(pages),
+        "seconds": round(time.perf_counter() - started, 4),
+        "page_seconds": page_seconds,
+        "truncated": len(pages) < stats.get('document_pages', 0)
+    })
+    metrics = get_metrics()
+    metrics.observe('pdf_extraction_seconds', stats['seconds'], mode='parallel' if stats.get('parallel') else 'serial')
+    metrics.observe('pdf_pages', len(pages))
+    return pages
+
+
+def join_pages(pages, max_chars=None, stats=None):
+    """
+    Join page texts into one document, honouring max_chars (default
+    PDF_MAX_CHARS; 0 = no cap).
+    """
+    max_chars = max_chars if max_chars is not None else env_int('PDF_MAX_CHARS', 0)
+    text_content = "\n".join(pages).strip()
+    truncated = bool(max_chars) and len(text_content) > max_chars
+    if truncated:
+        text_content = text_content[:max_chars]
+    if stats is not None:
+        stats['chars'] = len(text_content)
+        stats['truncated'] = stats.get('truncated', False) or truncated
+    return text_content
@@ -0,0 +1,310 @@
+"""
+Pipelined stage execution on partial upstream output.
+
+The staged pipeline runs requirements analysis, test design and test
+implementation one after the other, even when design and implementation
+are split per requirement category and per suite (see category_design.py
+and implementation_shards.py). In pipelined mode the three stages overlap:
+- the requirements analysis streams, and RequirementSections watches its
+  final answer: as soon as the next category heading shows that a
+  category's section is complete, its test design subtask starts;
+- once the requirements are complete, the shared header is written from
+  them while the category designs are still running;
+- each completed category design goes straight on to the implementation of
+  its suites, which only wait for the header.
+End-to-end latency then approaches the requirements analysis plus the
+slowest category's design and implementation, instead of the sum of the
+three stages.
+
+The complete requirements output stays authoritative. A category whose
+final requirements differ from the streamed section it was dispatched with
+(the model came back to it, or the section was cut short) is designed again;
+the queued design and shards of the superseded dispatch are cancelled, and
+a design already running is not implemented.
+When the model does not stream (LLM_STREAM=false, a cached completion), the
+categories are dispatched when the requirements are complete, and only
+design and implementation overlap. Requirements with fewer than two
+categories are left to the staged pipeline, together with the design of
+their one category if it was already finished early.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from test_gemini.category_design import TEST_CASE_ID, design_category, identify_requirements, render_test_design
+from test_gemini.crew_pool import get_crew_pool
+from test_gemini.handoff import handoff
+from test_gemini.implementation_shards import (
+    HEADER_FILE, generate_shard, implement_header, render_manifest, split_suites
+)
+from test_gemini.mapreduce import heading_category, parse_requirements
+from test_gemini.settings import env_bool, env_int
+from test_gemini.stages import execute_stage
+from test_gemini.streaming import bind_chunk_listener, current_stream, publish
+
+logger = logging.getLogger(__name__)
+
+_FINAL_ANSWER = 'Final Answer:'
+
+
+def should_pipeline(pipelined=None):
+    """Whether a run overlaps its stages: an explicit request wins, else PIPELINED_EXECUTION."""
+    if pipelined is not None:
+        return bool(pipelined)
+    return env_bool('PIPELINED_EXECUTION', False)
+
+
+class RequirementSections:
+    """
+    Chunk listener (see streaming.bind_chunk_listener) that splits the
+    streamed final answer of the requirements stage into category sections
+    and calls on_section(category, requirements) for each one as soon as the
+    next category heading completes it. A category is reported once; text
+    before "Final Answer:" (reasoning, tool calls) is ignored.
+    """
+
+    def __init__(self, on_section):
+        self.on_section = on_section
+        self.reported = set()
+        self.restart()
+
+    def restart(self):
+        self._pending = ''
+        self._answering = False
+        self._section = None
+
+    def feed(self, chunk):
+        self._pending += chunk
+        *lines, self._pending = self._pending.split('\n')
+        for line in lines:
+            self._line(line)
+
+    def _line(self, line):
+        if not self._answering:
+            if _FINAL_ANSWER not in line:
+                return
+            self._answering = True
+            line = line.split(_FINAL_ANSWER, 1)[1]
+        category = heading_category(line)
+        if category:
+            self._complete()
+            self._section = (category, [line])
+        elif self._section is not None:
+            self._section[1].append(line)
+
+    def _complete(self):
+        if self._section is None or self._section[0] in self.reported:
+            return
+        category, lines = self._section
+        requirements = parse_requirements('\n'.join(lines)).get(category)
+        if requirements:
+            self.reported.add(category)
+            self.on_section(category, requirements)
+
+
+class _Dispatch:
+    """One category's requirements handed to test design, with the suite shards that follow."""
+
+    def __init__(self, requirements, entries, early):
+        self.requirements = requirements
+        self.entries = entries
+        self.early = early
+        self.future = None
+        self.shards = []
+        self.superseded = False
+
+
+class _Pipeline:
+    """The in-flight category designs and suite implementations of one pipelined run."""
+
+    def __init__(self, inputs, use_cache, tools):
+        self.inputs = inputs
+        self.use_cache = use_cache
+        self.tools = tools
+        self.stream = current_stream()
+        self.header = Future()
+        # Off when the design goes back to the staged pipeline instead
+        self.implementing = True
+        # category -> its current _Dispatch
+        self.dispatched = {}
+        self.redesigned = []
+        self.started = time.perf_counter()
+        self.first_dispatch = None
+        self._lock = threading.Lock()
+        pool_size = get_crew_pool().size
+        self.designs = ThreadPoolExecutor(
+            max_workers=max(1, min(env_int('TEST_DESIGN_CONCURRENCY', 7), pool_size)),
+            thread_name_prefix='pipeline-design'
+        )
+        self.shards = ThreadPoolExecutor(
+            max_workers=max(1, min(env_int('IMPLEMENTATION_SHARD_CONCURRENCY', 4), pool_size)),
+            thread_name_prefix='pipeline-shard'
+        )
+
+    def dispatch(self, category, requirements, early=True):
+        """Start designing (and then implementing) one category's requirements, superseding an earlier dispatch."""
+        dispatch = _Dispatch(requirements, identify_requirements({category: requirements})[0][1], early)
+        with self._lock:
+            previous = self.dispatched.get(category)
+            if previous is not None:
+                self.redesigned.append(category)
+                self._supersede(previous)
+            if self.first_dispatch is None:
+                self.first_dispatch = time.perf_counter() - self.started
+            self.dispatched[category] = dispatch
+            dispatch.future = self.designs.submit(self._category, category, dispatch)
+        logger.info(f"Dispatched the {category} to test design" + (" while the requirements stream" if early else ""))
+        publish('section_ready', stage='requirements', category=category, requirements=len(dispatch.entries), early=early)
+
+    @staticmethod
+    def _supersede(dispatch):
+        """Drop the queued work of a dispatch; a design already running finishes, but is not implemented."""
+        dispatch.superseded = True
+        dispatch.future.cancel()
+        for _, future in dispatch.shards:
+            future.cancel()
+
+    def finish(self, requirements):
+        """
+        Reconcile the dispatched sections with the complete requirements
+        output: dispatch the categories not seen yet and redesign those that
+        changed. Requirements with fewer than two categories dispatch
+        nothing more (see hand_back). Returns [(category, entries), ...] in
+        document order.
+        """
+        categorized = parse_requirements(requirements)
+        identified = identify_requirements(categorized)
+        with self._lock:
+            # A streamed section that the final output does not have
+            for category, dispatch in self.dispatched.items():
+                if category not in categorized:
+                    self._supersede(dispatch)
+        if len(identified) < 2:
+            return identified
+        for category, _ in identified:
+            dispatched = self.dispatched.get(category)
+            if dispatched is None or dispatched.requirements != categorized[category]:
+                self.dispatch(category, categorized[category], early=False)
+        return [(category, self.dispatched[category].entries) for category, _ in identified]
+
+    def hand_back(self, requirements, identified):
+        """
+        For requirements with fewer than two categories, which the staged
+        pipeline designs as a whole: the test design of their one category
+        when it was dispatched early with its final requirements, else None.
+        Nothing is implemented here either way.
+        """
+        with self._lock:
+            self.implementing = False
+            for dispatch in self.dispatched.values():
+                for _, future in dispatch.shards:
+                    future.cancel()
+        if len(identified) != 1:
+            return None
+        category, _ = identified[0]
+        dispatch = self.dispatched.get(category)
+        if dispatch is None or dispatch.requirements != parse_requirements(requirements)[category]:
+            return None
+        design, _, _ = dispatch.future.result()
+        return render_test_design({category: design}, [(category, dispatch.entries)], self.inputs.get('topic'))[0]
+
+    def _category(self, category, dispatch):
+        design, cached = design_category(category, dispatch.entries, self.inputs, self.use_cache, self.tools, self.stream)
+        if dispatch.superseded or not self.implementing:
+            return design, cached, []
+        document, _ = render_test_design({category: design}, [(category, dispatch.entries)], self.inputs.get('topic'))
+        suites = split_suites(handoff('test-implementation', document, self.inputs.get('topic')), minimum=1)
+        if not suites:
+            logger.warning(f"The test design for the {category} has no test cases to implement")
+        with self._lock:
+            if not dispatch.superseded and self.implementing:
+                dispatch.shards = [
+                    (file_name, self.shards.submit(self._shard, dispatch, suite, file_name, text))
+                    for suite, file_name, text in suites
+                ]
+        return design, cached, dispatch.shards
+
+    def _shard(self, dispatch, suite, file_name, text):
+        header = self.header.result()
+        if dispatch.superseded or not self.implementing:
+            return None, False
+        return generate_shard(suite, file_name, text, header, self.inputs, self.use_cache, self.tools, self.stream)
+
+    def close(self, error=None):
+        if not self.header.done():
+            self.header.set_exception(error or RuntimeError("The pipelined run ended before the shared header was written"))
+        self.designs.shutdown(wait=True, cancel_futures=True)
+        self.shards.shutdown(wait=True, cancel_futures=True)
+
+
+def run_pipelined(inputs, document=None, use_cache=True, stats=None, tools=None, requirements_tools=None):
+    """
+    The three stages of a run, overlapped (see the module docstring).
+    document is the requirements source (default: the topic); tools are
+    added to the design and implementation agents, requirements_tools to
+    the requirements agent. Returns [requirements, test_design,
+    implementation]. When the requirements have fewer than two categories,
+    implementation is None for the caller to continue stage by stage, and
+    so is test_design unless a design of the one category was already
+    finished early (see _Pipeline.hand_back). stats (a dict) receives the
+    overlap and timings.
+    """
+    stats = stats if stats is not None else {}
+    pipeline = _Pipeline(inputs, use_cache, tools)
+    error = None
+    try:
+        sections = RequirementSections(pipeline.dispatch)
+        with bind_chunk_listener(sections):
+            requirements = execute_stage('requirements', inputs, document, tools=requirements_tools)
+        requirements_seconds = time.perf_counter() - pipeline.started
+        publish('stage_output', stage='requirements', content=requirements)
+
+        identified = pipeline.finish(requirements)
+        if len(identified) < 2:
+            test_design = pipeline.hand_back(requirements, identified)
+            stats.update({"pipelined": False, "categories": len(identified), "design_handed_back": test_design is not None})
+            return [requirements, test_design, None]
+
+        header_started = time.perf_counter()
+        header, header_cached = implement_header(
+            handoff('test-design', requirements), [category for category, _ in identified], inputs, use_cache, tools
+        )
+        pipeline.header.set_result(header)
+        header_seconds = time.perf_counter() - header_started
+
+        designs, files, cached_categories, cached_shards = {}, {HEADER_FILE: header}, 0, 0
+        for category, _ in identified:
+            design, cached, shards = pipeline.dispatched[category].future.result()
+            designs[category] = design
+            cached_categories += cached
+            for file_name, future in shards:
+                files[file_name], shard_cached = future.result()
+                cached_shards += shard_cached
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        pipeline.close(error)
+
+    test_design, matrix = render_test_design(designs, identified, inputs.get('topic'))
+    publish('stage_output', stage='test-design', content=test_design)
+    implementation = render_manifest(files, inputs.get('topic'))
+    publish('stage_output', stage='test-implementation', content=implementation)
+    stats.update({
+        "pipelined": True,
+        "categories": len(identified),
+        "early_categories": sum(1 for category, _ in identified if pipeline.dispatched[category].early),
+        "redesigned_categories": pipeline.redesigned,
+        "cached_categories": cached_categories,
+        "requirements": len(matrix),
+        "uncovered_requirements": [rid for rid, _, test_cases in matrix if not test_cases],
+        "test_cases": len({test_case for design in designs.values() for test_case in TEST_CASE_ID.findall(design)}),
+        "files": list(files),
+        "cached_shards": cached_shards + (1 if header_cached else 0),
+        "first_section_seconds": round(pipeline.first_dispatch, 3),
+        "requirements_seconds": round(requirements_seconds, 3),
+        "header_seconds": round(header_seconds, 3),
+        "seconds": round(time.perf_counter() - pipeline.started, 3)
+    })
+    return [requirements, test_design, implementation]
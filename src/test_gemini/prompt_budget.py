@@ -0,0 +1,132 @@
+"""
+Prompt-size accounting for the three agents.
+
+Renders the prompt each agent sends on the first LLM call of its task (role,
+goal and backstory, the task description and expected output, tools and
+context) the way crewai assembles it, and counts its tokens. Comparing a
+document interpolated into {topic} (how the PDF endpoints used to run)
+with the document channel (a short topic label in the templates, the
+document passed once as context or looked up through DocumentSearchTool)
+shows how much prompt the channel saves for a given PDF:
+
+    prompt_tokens path/to/spec.pdf [topic label]
+"""
+import json
+import math
+import sys
+from datetime import datetime
+
+from test_gemini.stages import STAGE_GRAPH
+
+_encoder = None
+_tokenizer = None
+
+
+def count_tokens(text):
+    """Token count with tiktoken's cl100k_base, or ~4 characters per token when it cannot be loaded."""
+    global _encoder, _tokenizer
+    if _tokenizer is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding('cl100k_base')
+            _tokenizer = 'cl100k_base'
+        except Exception:
+            _tokenizer = 'approx-4-chars-per-token'
+    if _encoder is not None:
+        return len(_encoder.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 4)
+
+
+def tokenizer_name():
+    count_tokens('')
+    return _tokenizer
+
+
+def render_stage_prompt(crew, stage, inputs, context=None, tools=None):
+    """The prompt the stage's agent sends on its first LLM call."""
+    from crewai.utilities.agent_utils import get_tool_names, parse_tools, render_text_description_and_args
+    from crewai.utilities.prompts import Prompts
+
+    index = STAGE_GRAPH[stage]['task_index']
+    agent = crew.agents[index]
+    task = crew.tasks[index]
+    agent.interpolate_inputs(inputs)
+    task.interpolate_inputs_and_add_conversation_history(inputs)
+
+    task_prompt = task.prompt()
+    if context:
+        task_prompt = agent.i18n.slice("task_with_context").format(task=task_prompt, context=context)
+
+    parsed_tools = parse_tools(tools or [])
+    prompt = Prompts(
+        agent=agent,
+        has_tools=bool(parsed_tools),
+        i18n=agent.i18n,
+        use_system_prompt=agent.use_system_prompt,
+        system_template=agent.system_template,
+        prompt_template=agent.prompt_template,
+        response_template=agent.response_template
+    ).task_execution()
+    rendered = prompt.get('system', '') + prompt.get('user', '') if 'system' in prompt else prompt['prompt']
+    return (
+        rendered
+        .replace("{input}", task_prompt)
+        .replace("{tool_names}", get_tool_names(parsed_tools))
+        .replace("{tools}", render_text_description_and_args(parsed_tools))
+    )
+
+
+def compare_prompt_tokens(document, topic, current_year=None):
+    """
+    Prompt tokens per stage for a document interpolated into {topic}
+    ('inline') versus the document channel ('channel'). Upstream stage
+    output is left out of both: it is the same in either mode.
+    """
+    from test_gemini.crew import TestGemini
+    from test_gemini.tools.custom_tool import DocumentSearchTool
+
+    crew = TestGemini().crew()
+    current_year = current_year or str(datetime.now().year)
+    inline_inputs = {'topic': document, 'current_year': current_year}
+    channel_inputs = {'topic': topic, 'current_year': current_year}
+    tools = [DocumentSearchTool(document=document)]
+
+    stages = {}
+    for stage in STAGE_GRAPH:
+        inline = count_tokens(render_stage_prompt(crew, stage, inline_inputs))
+        if STAGE_GRAPH[stage]['upstream'] is None:
+            channel = count_tokens(render_stage_prompt(crew, stage, channel_inputs, context=document))
+        else:
+            channel = count_tokens(render_stage_prompt(crew, stage, channel_inputs, tools=tools))
+        stages[stage] = {"inline": inline, "channel": channel}
+
+    inline_total = sum(counts['inline'] for counts in stages.values())
+    channel_total = sum(counts['channel'] for counts in stages.values())
+    return {
+        "tokenizer": tokenizer_name(),
+        "document_tokens": count_tokens(document),
+        "topic": topic,
+        "stages": stages,
+        "total": {"inline": inline_total, "channel": channel_total},
+        "saved_ratio": round(1 - channel_total / inline_total, 4) if inline_total else 0.0
+    }
+
+
+def main():
+    """
+    Print the prompt-token comparison for a PDF as JSON.
+    Usage: prompt_tokens <pdf_path> [topic label]
+    """
+    if len(sys.argv) < 2:
+        raise Exception("Usage: prompt_tokens <pdf_path> [topic label]")
+
+    from test_gemini.documents import topic_label
+    from test_gemini.pdf import extract_pdf_pages, join_pages, read_pdf_bytes
+
+    pdf_path = sys.argv[1]
+    pages = extract_pdf_pages(read_pdf_bytes(pdf_path))
+    document = join_pages(pages)
+    topic = sys.argv[2] if len(sys.argv) > 2 else topic_label({
+        "document_id": "", "filename": pdf_path, "pages": pages
+    })
+    print(json.dumps(compare_prompt_tokens(document, topic), indent=2))
@@ -0,0 +1,356 @@
+"""
+Local retrieval index over previously generated artifacts.
+
+Every completed stage adds its output to an offline BM25 index, broken
+into the units a later generation can build on:
+- each requirement of a requirements output;
+- each test case of a test design (in its compact form, see handoff.py);
+- each class and struct (mocks, fixtures, helpers) of the generated C++.
+
+The agents query the index through the "Search prior test artifacts" tool
+(tools/custom_tool.py) for the top-k most similar prior artifacts, so a
+generation for a component similar to one already covered can start from
+proven material.
+
+The index is an append-only JSON-lines log under RETRIEVAL_INDEX_DIR.
+Appends happen under flock and skip artifacts that are already indexed
+(by a hash of their kind and normalized text). Each process keeps the
+inverted index in memory and reads only the lines appended since its last
+query, so the server's workers share one index that grows incrementally as
+runs complete. No network or model is involved.
+
+The log is bounded: when it holds artifacts older than
+RETRIEVAL_INDEX_TTL or more than RETRIEVAL_INDEX_MAX_DOCS artifacts, it is
+compacted to the newest ones within both bounds. This happens on load and
+at most every few minutes after. Compaction rewrites the log atomically;
+other processes notice the new file and reload it.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from test_gemini.cache import normalize_text
+from test_gemini.settings import env_bool, env_int, state_path
+
+logger = logging.getLogger(__name__)
+
+REQUIREMENT = 'requirement'
+TEST_CASE = 'test_case'
+FIXTURE = 'fixture'
+KINDS = (REQUIREMENT, TEST_CASE, FIXTURE)
+# The kind of artifact each stage produces (see STAGE_GRAPH)
+STAGE_KINDS = {'requirements': REQUIREMENT, 'test-design': TEST_CASE, 'test-implementation': FIXTURE}
+
+# BM25 parameters
+_K1 = 1.5
+_B = 0.75
+
+_WORD = re.compile(r'[A-Za-z][a-z]+|[A-Z]+(?![a-z])|\d+')
+_STOPWORDS = frozenset(
+    'a an and are as at be by for from has in is it its of on or shall should that the this to was were will with '
+    'when within must may can not all each into test tests case cases'.split()
+)
+_CLASS_HEAD = re.compile(r'^[ \t]*(?:template\s*<[^;{]*>\s*)?(?:class|struct)\s+(\w+)[^;{()]*\{', re.MULTILINE)
+_MAX_TEXT = 6000
+_MAX_DOCS = 20000
+_TTL_SECONDS = 90 * 24 * 3600
+_COMPACT_INTERVAL = 300
+
+
+def should_index():
+    """Whether completed stages are indexed and agents get the retrieval tool (RETRIEVAL_INDEX)."""
+    return env_bool('RETRIEVAL_INDEX', True)
+
+
+def tokenize(text):
+    """Lowercased words of text, identifiers split at camelCase and underscores, without stopwords."""
+    return [word for word in (token.lower() for token in _WORD.findall(text or '')) if word not in _STOPWORDS]
+
+
+def cpp_classes(code):
+    """[(name, definition), ...] of the classes and structs defined in C++ code."""
+    classes = []
+    for match in _CLASS_HEAD.finditer(code or ''):
+        depth = 0
+        for position in range(match.end() - 1, len(code)):
+            if code[position] == '{':
+                depth += 1
+            elif code[position] == '}':
+                depth -= 1
+                if not depth:
+                    end = code.find(';', position)
+                    classes.append((match.group(1), code[match.start():(end if end != -1 else position) + 1].strip()))
+                    break
+    # A class nested in an earlier one is part of its definition
+    return [(name, text) for index, (name, text) in enumerate(classes)
+            if not any(text in earlier for _, earlier in classes[:index])]
+
+
+def stage_artifacts(stage, content):
+    """The indexable units of a stage output: [(kind, title, text), ...]."""
+    from test_gemini.handoff import HandoffError, render_test_case, structure_requirements, structure_test_design
+    from test_gemini.implementation_shards import source_files
+
+    try:
+        if stage == 'requirements':
+            return [
+                (REQUIREMENT, f"{requirement.id} ({requirement.category})", f"{requirement.id}: {requirement.text}")
+                for requirement in structure_requirements(content).requirements
+            ]
+        if stage == 'test-design':
+            return [
+                (TEST_CASE, f"{test_case.id}: {test_case.title}".rstrip(': '), render_test_case(test_case))
+                for test_case in structure_test_design(content).test_cases
+            ]
+    except HandoffError:
+        return []
+    if stage == 'test-implementation':
+        return [
+            (FIXTURE, f"{name} ({file_name})", text)
+            for file_name, code in source_files(content).items()
+            for name, text in cpp_classes(code)
+        ]
+    return []
+
+
+class ArtifactIndex:
+    """BM25 index over prior artifacts, backed by a shared append-only log."""
+
+    def __init__(self, directory, max_text=_MAX_TEXT, max_docs=_MAX_DOCS, ttl_seconds=_TTL_SECONDS,
+                 compact_interval=_COMPACT_INTERVAL):
+        self.directory = directory
+        self.max_text = max_text
+        self.max_docs = max_docs
+        self.ttl_seconds = ttl_seconds
+        self.compact_interval = compact_interval
+        self.path = os.path.join(directory, 'artifacts.jsonl')
+        # Appends and compaction lock this file, which compaction never replaces
+        self.lock_path = os.path.join(directory, 'artifacts.lock')
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._last_compaction_check = None
+        self._reset()
+
+    def _reset(self):
+        self._inode = None
+        self._offset = 0
+        self._documents = []
+        self._ids = set()
+        self._postings = {}
+        self._lengths = []
+        self._total_length = 0
+
+    @staticmethod
+    def artifact_id(kind, text):
+        return hashlib.sha256(f"{kind}\n{normalize_text(text)}".encode('utf-8')).hexdigest()[:32]
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.lock_path, 'a') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Index the log lines other processes (or this one) appended since the last refresh. Call with _lock held."""
+        try:
+            with open(self.path, 'rb') as handle:
+                inode = os.fstat(handle.fileno()).st_ino
+                if inode != self._inode:
+                    # First load, or the log was compacted since
+                    self._reset()
+                    self._inode = inode
+                handle.seek(self._offset)
+                data = handle.read()
+        except FileNotFoundError:
+            self._reset()
+            return
+        # A line still being written is picked up next time
+        complete = data[:data.rfind(b'\n') + 1]
+        self._offset += len(complete)
+        for line in complete.splitlines():
+            try:
+                self._index(json.loads(line))
+            except (ValueError, KeyError, TypeError):
+                logger.warning("Skipping an unreadable retrieval index entry")
+
+    def _index(self, document):
+        if document['id'] in self._ids:
+            return
+        position = len(self._documents)
+        terms = tokenize(f"{document.get('title', '')} {document['text']}")
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            self._postings.setdefault(term, []).append((position, count))
+        self._documents.append(document)
+        self._ids.add(document['id'])
+        self._lengths.append(len(terms))
+        self._total_length += len(terms)
+
+    def _over_bounds(self):
+        if self.max_docs and len(self._documents) > self.max_docs:
+            return True
+        return bool(self.ttl_seconds and self._documents
+                    and time.time() - self._documents[0].get('added_at', 0) > self.ttl_seconds)
+
+    def _sync(self):
+        """Refresh, compacting the log on load and then at most every compact_interval seconds. Call with _lock held."""
+        self._refresh()
+        now = time.monotonic()
+        if self._last_compaction_check is not None and now - self._last_compaction_check < self.compact_interval:
+            return
+        self._last_compaction_check = now
+        if self._over_bounds():
+            with self._file_lock():
+                self._refresh()
+                if self._over_bounds():
+                    self._compact()
+
+    def _compact(self):
+        """Rewrite the log with the newest artifacts within the TTL and max_docs. Call with both locks held."""
+        cutoff = time.time() - self.ttl_seconds if self.ttl_seconds else None
+        kept = [document for document in self._documents if cutoff is None or document.get('added_at', 0) >= cutoff]
+        if self.max_docs:
+            kept = kept[-self.max_docs:]
+        dropped = len(self._documents) - len(kept)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as handle:
+                handle.write(''.join(json.dumps(document) + '\n' for document in kept))
+            os.replace(tmp_path, self.path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._refresh()
+        logger.info(f"Compacted the retrieval index: dropped {dropped} artifacts, kept {len(kept)}")
+
+    def add(self, artifacts, topic=None, run_id=None):
+        """Append [(kind, title, text), ...] not indexed yet. Returns how many were added."""
+        entries = []
+        with self._lock:
+            with self._file_lock():
+                self._refresh()
+                for kind, title, text in artifacts:
+                    text = (text or '').strip()[:self.max_text]
+                    artifact_id = self.artifact_id(kind, text)
+                    if not text or artifact_id in self._ids or any(entry['id'] == artifact_id for entry in entries):
+                        continue
+                    entries.append({
+                        "id": artifact_id, "kind": kind, "title": title, "text": text,
+                        "topic": topic, "run_id": run_id, "added_at": time.time()
+                    })
+                if entries:
+                    with open(self.path, 'a', encoding='utf-8') as handle:
+                        handle.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+            self._sync()
+        return len(entries)
+
+    def add_stage_output(self, stage, content, topic=None, run_id=None):
+        """Index the requirements, test cases or C++ classes of a stage output."""
+        started = time.perf_counter()
+        added = self.add(stage_artifacts(stage, content), topic=topic, run_id=run_id)
+        if added:
+            logger.info(f"Indexed {added} {stage} artifacts in {time.perf_counter() - started:.2f}s")
+        return added
+
+    def search(self, query, k=5, kind=None, exclude_run_id=None):
+        """The k best BM25 matches for query: [(score, document), ...], best first."""
+        terms = set(tokenize(query))
+        with self._lock:
+            self._sync()
+            count = len(self._documents)
+            if not terms or not count:
+                return []
+            average = self._total_length / count or 1
+            scores = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for position, frequency in postings:
+                    norm = frequency + _K1 * (1 - _B + _B * self._lengths[position] / average)
+                    scores[position] = scores.get(position, 0.0) + idf * frequency * (_K1 + 1) / norm
+            ranked = []
+            for position, score in sorted(scores.items(), key=lambda item: item[1], reverse=True):
+                document = self._documents[position]
+                if kind and document['kind'] != kind:
+                    continue
+                if exclude_run_id and document.get('run_id') == exclude_run_id:
+                    continue
+                ranked.append((score, document))
+                if len(ranked) >= k:
+                    break
+            return ranked
+
+    def stats(self):
+        with self._lock:
+            self._sync()
+            by_kind = {}
+            for document in self._documents:
+                by_kind[document['kind']] = by_kind.get(document['kind'], 0) + 1
+            return {
+                "artifacts": len(self._documents), "by_kind": by_kind, "terms": len(self._postings),
+                "max_docs": self.max_docs, "ttl_seconds": self.ttl_seconds
+            }
+
+
+def index_stage_output(stage, content, topic=None, run_id=None):
+    """Add a completed stage output to the index; indexing never fails a run."""
+    if not content or not should_index():
+        return 0
+    try:
+        return get_retrieval_index().add_stage_output(stage, content, topic=topic, run_id=run_id)
+    except Exception as e:
+        logger.warning(f"Could not index the {stage} output: {str(e)}")
+        return 0
+
+
+def retrieval_tools(agent_name=None, run_id=None):
+    """
+    The prior artifact search tool for an agent (its own kind of artifact
+    first, else the kind of the stage it runs), or [] when indexing is off.
+    With run_id the tool never returns that run's own artifacts.
+    """
+    if not should_index():
+        return []
+    from test_gemini.tools.custom_tool import PriorArtifactSearchTool
+    default_kind = {
+        'requirements_engineer': REQUIREMENT,
+        'test_case_designer': TEST_CASE,
+        'test_script_developer': FIXTURE,
+    }.get(agent_name)
+    return [PriorArtifactSearchTool(default_kind=default_kind, top_k=env_int('RETRIEVAL_TOP_K', 5), exclude_run_id=run_id)]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_retrieval_index():
+    """Return the process-wide ArtifactIndex configured from the environment."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ArtifactIndex(
+                directory=os.environ.get('RETRIEVAL_INDEX_DIR') or state_path('retrieval'),
+                max_text=env_int('RETRIEVAL_MAX_ARTIFACT_CHARS', _MAX_TEXT),
+                max_docs=env_int('RETRIEVAL_INDEX_MAX_DOCS', _MAX_DOCS),
+                ttl_seconds=env_int('RETRIEVAL_INDEX_TTL', _TTL_SECONDS)
+            )
+        return _index
@@ -0,0 +1,210 @@
+"""
+Revision-aware pipeline runs for documents that are revised and re-uploaded.
+
+A pipeline run with a document_key (for example the specification's file
+name) records a revision of that document. It stores the section
+fingerprints of the text and every intermediate result the run produced,
+keyed the way the stage cache keys them: requirements per chunk, test
+design per requirement category, and the shared header and each suite of
+the implementation. The next run of the same key diffs the sections
+against the previous revision. It reuses every intermediate result whose
+inputs did not change, so only the chunks of edited sections, the
+requirement categories they affect and those categories' test suites go
+back to the model. Chunking is stable in this mode (see
+sections.chunk_text), so an edit does not shift the other chunks.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from test_gemini.cache import normalize_text
+from test_gemini.sections import split_sections
+from test_gemini.settings import env_int, state_path
+from test_gemini.storage import DiskStore
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def section_fingerprints(text):
+    """[(title, body hash), ...] of the text's sections, whitespace-insensitive."""
+    return [
+        (normalize_text(title), hashlib.sha256(normalize_text(body).encode('utf-8')).hexdigest()[:16])
+        for title, body in split_sections(text)
+    ]
+
+
+def diff_sections(previous, current):
+    """
+    Compare two section fingerprint lists. Sections are matched by title
+    (repeated titles in order). Returns {"changed", "added", "removed"}
+    title lists and the "unchanged" count.
+    """
+    def by_title(fingerprints):
+        sections = {}
+        for title, digest in fingerprints:
+            sections.setdefault(title, []).append(digest)
+        return sections
+
+    before, after = by_title(previous), by_title(current)
+    diff = {"changed": [], "added": [], "removed": [], "unchanged": 0}
+    for title, digests in after.items():
+        old = before.get(title, [])
+        for index, digest in enumerate(digests):
+            if index >= len(old):
+                diff["added"].append(title or '(untitled)')
+            elif old[index] != digest:
+                diff["changed"].append(title or '(untitled)')
+            else:
+                diff["unchanged"] += 1
+    for title, digests in before.items():
+        extra = len(digests) - len(after.get(title, []))
+        diff["removed"].extend([title or '(untitled)'] * max(0, extra))
+    return diff
+
+
+class Revision:
+    """
+    One revision-aware run: the previous revision's intermediate results
+    (by stage-cache key) to reuse, and the results this run produces.
+    """
+
+    def __init__(self, document_key, text, previous=None):
+        self.document_key = document_key
+        self.previous = previous
+        self.number = (previous or {}).get('revision', 0) + 1
+        self.sections = section_fingerprints(text)
+        self._reusable = dict((previous or {}).get('results') or {})
+        self._results = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, kind, key):
+        """The previous revision's result for key, or None."""
+        result = self._reusable.get(key)
+        if result is not None:
+            self._keep(kind, key, result, 'reused')
+        return result
+
+    def record(self, kind, key, result):
+        """Remember a result this run produced (from the model or the stage cache)."""
+        if result is not None:
+            self._keep(kind, key, result, 'new')
+
+    def _keep(self, kind, key, result, outcome):
+        with self._lock:
+            self._results[key] = result
+            counts = self._counts.setdefault(kind, {'reused': 0, 'new': 0})
+            counts[outcome] += 1
+
+    def summary(self):
+        previous = self.previous or {}
+        summary = {
+            "document_key": self.document_key,
+            "revision": self.number,
+            "previous_document_id": previous.get('document_id'),
+            "previous_run_id": previous.get('run_id'),
+            "reused": {kind: dict(counts) for kind, counts in self._counts.items()}
+        }
+        if previous.get('sections') is not None:
+            summary["sections"] = diff_sections([tuple(entry) for entry in previous['sections']], self.sections)
+        return summary
+
+    def to_record(self, document_id=None, run_id=None):
+        with self._lock:
+            results = dict(self._results)
+        return {
+            "document_key": self.document_key,
+            "revision": self.number,
+            "document_id": document_id,
+            "run_id": run_id,
+            "created_at": datetime.now().isoformat(),
+            "sections": [list(entry) for entry in self.sections],
+            "results": results
+        }
+
+
+@contextmanager
+def bind_revision(revision):
+    """Make revision the current thread's revision for the duration of the block."""
+    previous = getattr(_local, 'revision', None)
+    _local.revision = revision
+    try:
+        yield revision
+    finally:
+        _local.revision = previous
+
+
+def current_revision():
+    return getattr(_local, 'revision', None)
+
+
+def reuse_or_generate(kind, key, generate, revision=None):
+    """
+    Serve key from the previous revision when the current (or given)
+    revision has it, else call generate() -> (result, cached) and record
+    the result. Returns (result, reused_or_cached).
+    """
+    revision = revision or current_revision()
+    if revision is not None:
+        reused = revision.lookup(kind, key)
+        if reused is not None:
+            return reused, True
+    result, cached = generate()
+    if revision is not None:
+        revision.record(kind, key, result)
+    return result, cached
+
+
+class RevisionStore:
+    """Latest revision record per document key, compressed on disk."""
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, ttl_seconds=90 * 24 * 3600):
+        self.disk = DiskStore(directory, max_bytes=max_bytes, ttl_seconds=ttl_seconds, compress=True)
+
+    @staticmethod
+    def _key(document_key):
+        return hashlib.sha256(document_key.encode('utf-8')).hexdigest()
+
+    def start(self, document_key, text):
+        """A Revision of document_key for text, building on the latest recorded revision."""
+        return Revision(document_key, text, previous=self.disk.get(self._key(document_key)))
+
+    def save(self, revision, document_id=None, run_id=None):
+        record = revision.to_record(document_id, run_id)
+        started = time.perf_counter()
+        try:
+            self.disk.put(self._key(revision.document_key), record)
+        except OSError as e:
+            logger.warning(f"Could not record revision {record['revision']} of {revision.document_key}: {str(e)}")
+            return None
+        logger.info(f"Recorded revision {record['revision']} of {revision.document_key} in {time.perf_counter() - started:.2f}s")
+        return record
+
+    def get(self, document_key):
+        return self.disk.get(self._key(document_key))
+
+    def delete(self, document_key):
+        self.disk.delete(self._key(document_key))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_revision_store():
+    """Return the process-wide RevisionStore configured from the environment."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RevisionStore(
+                directory=os.environ.get('REVISION_STORE_DIR') or state_path('revisions'),
+                max_bytes=env_int('REVISION_STORE_MAX_BYTES', 256 * 1024 * 1024),
+                ttl_seconds=env_int('REVISION_STORE_TTL', 90 * 24 * 3600)
+            )
+        return _store
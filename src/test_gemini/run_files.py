@@ -0,0 +1,171 @@
+"""
+Per-run store for generated files (the Google Test C++ implementation).
+
+Every run writes its files into its own directory,
+<directory>/<run_id>/<name>, so concurrent pipelines never overwrite each
+other's output the way the crew's shared output_file did. Files are served
+from disk by the download endpoint, and responses carry a reference
+instead of the file body once it is larger than CODE_INLINE_MAX_BYTES.
+Runs older than RUN_FILES_TTL, and the oldest runs beyond
+RUN_FILES_MAX_BYTES, are garbage-collected.
+"""
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from test_gemini.settings import env_int, state_path
+from test_gemini.stages import ArtifactNotFound, StageArtifactStore
+
+logger = logging.getLogger(__name__)
+
+IMPLEMENTATION_FILE = 'test_implementation.cpp'
+PIPELINE_RESULT_FILE = 'crew_output.json'
+
+_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_][A-Za-z0-9_.-]{0,127}$')
+
+
+class RunFileStore:
+    """Generated files on disk, one directory per run."""
+
+    def __init__(self, directory, ttl_seconds=7 * 24 * 3600, max_bytes=1024 * 1024 * 1024, gc_interval=60):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.gc_interval = gc_interval
+        self._last_gc = 0.0
+        self._gc_lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def valid_name(name):
+        return bool(name) and bool(_NAME_PATTERN.match(name)) and '..' not in name
+
+    def _run_dir(self, run_id):
+        if not StageArtifactStore.valid_id(run_id):
+            raise ArtifactNotFound(f"Invalid run ID: {run_id}")
+        return os.path.join(self.directory, run_id)
+
+    def save(self, run_id, name, content):
+        """Write a file of the run atomically and return its reference."""
+        if not self.valid_name(name):
+            raise ValueError(f"Invalid file name: {name}")
+        run_dir = self._run_dir(run_id)
+        os.makedirs(run_dir, exist_ok=True)
+
+        data = content.encode('utf-8') if isinstance(content, str) else content
+        fd, tmp_path = tempfile.mkstemp(dir=run_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(data)
+        os.replace(tmp_path, os.path.join(run_dir, name))
+
+        self.maybe_gc()
+        return self._reference(run_id, name, len(data), hashlib.sha256(data).hexdigest())
+
+    def list(self, run_id):
+        """References of the run's files."""
+        run_dir = self._run_dir(run_id)
+        if not os.path.isdir(run_dir):
+            return []
+        return [self.describe(run_id, name) for name in sorted(os.listdir(run_dir)) if self.valid_name(name)]
+
+    def path(self, run_id, name):
+        """Absolute path of a stored file; raises ArtifactNotFound."""
+        if not self.valid_name(name):
+            raise ArtifactNotFound(f"Invalid file name: {name}")
+        path = os.path.join(self._run_dir(run_id), name)
+        if not os.path.isfile(path):
+            raise ArtifactNotFound(f"No file {name} in run {run_id}")
+        return os.path.abspath(path)
+
+    def describe(self, run_id, name):
+        """Reference of a stored file (hashes it from disk in blocks)."""
+        path = self.path(run_id, name)
+        digest = hashlib.sha256()
+        with open(path, 'rb') as handle:
+            for block in iter(lambda: handle.read(1024 * 1024), b''):
+                digest.update(block)
+        return self._reference(run_id, name, os.path.getsize(path), digest.hexdigest())
+
+    @staticmethod
+    def _reference(run_id, name, size, sha256):
+        return {
+            "run_id": run_id,
+            "name": name,
+            "size": size,
+            "sha256": sha256,
+            "url": f"/runs/{run_id}/files/{name}"
+        }
+
+    def maybe_gc(self):
+        """Run gc() at most once per gc_interval seconds."""
+        now = time.time()
+        with self._gc_lock:
+            if now - self._last_gc < self.gc_interval:
+                return
+            self._last_gc = now
+        self.gc()
+
+    def gc(self):
+        """Remove expired runs, then the least recently written ones over max_bytes."""
+        now = time.time()
+        runs = []
+        for name in os.listdir(self.directory):
+            run_dir = os.path.join(self.directory, name)
+            try:
+                if not os.path.isdir(run_dir):
+                    continue
+                mtime = os.path.getmtime(run_dir)
+                if self.ttl_seconds and now - mtime > self.ttl_seconds:
+                    shutil.rmtree(run_dir, ignore_errors=True)
+                    continue
+                size = sum(entry.stat().st_size for entry in os.scandir(run_dir) if entry.is_file())
+                runs.append((mtime, size, run_dir))
+            except FileNotFoundError:
+                continue
+
+        total = sum(size for _, size, _ in runs)
+        if not self.max_bytes or total <= self.max_bytes:
+            return
+        for _, size, run_dir in sorted(runs):
+            shutil.rmtree(run_dir, ignore_errors=True)
+            total -= size
+            if total <= self.max_bytes:
+                break
+        logger.info(f"Run file store trimmed to {total} bytes")
+
+
+def inline_result(result, meta, inline=False):
+    """
+    The result to embed in a JSON response: None when it is stored as a
+    run file (meta['result_file']) larger than CODE_INLINE_MAX_BYTES, in
+    which case clients download it from the file reference.
+    """
+    reference = (meta or {}).get('result_file')
+    if inline or not reference or result is None:
+        return result
+    limit = env_int('CODE_INLINE_MAX_BYTES', 32 * 1024)
+    if limit and reference['size'] <= limit:
+        return result
+    return None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_run_file_store():
+    """Return the process-wide RunFileStore configured from the environment."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RunFileStore(
+                directory=os.environ.get('RUN_FILES_DIR') or state_path('run_files'),
+                ttl_seconds=env_int('RUN_FILES_TTL', 7 * 24 * 3600),
+                max_bytes=env_int('RUN_FILES_MAX_BYTES', 1024 * 1024 * 1024)
+            )
+        return _store
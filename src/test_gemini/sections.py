@@ -0,0 +1,126 @@
+"""
+Section-aware splitting of specification text.
+
+Extracted PDF text is split on section headings (markdown headings,
+numbered headings such as "3.2 Power Management", "Section 4" and
+all-caps titles) and the sections are packed into chunks of bounded size,
+so a long document can be processed piece by piece without cutting a
+section in half unless it is larger than a chunk on its own. Stable
+chunking also starts a new chunk at every top-level heading, so an edit
+only changes the chunks of its own top-level section.
+"""
+import re
+
+_HEADING_PATTERNS = (
+    re.compile(r'^#{1,6}\s+\S'),
+    re.compile(r'^(?:section|chapter|part|appendix)\s+[0-9A-Z]+\b', re.IGNORECASE),
+    re.compile(r'^\d+(?:\.\d+)*\.?\s+[A-Z][^.!?;]*$'),
+    re.compile(r'^[A-Z][A-Z0-9 ,/&()\-]{3,}$'),
+)
+_MAX_HEADING_CHARS = 80
+# Headings that open a top-level section ("3 Power Management", "# Safety", "CHAPTER 2")
+_TOP_LEVEL_PATTERNS = (
+    re.compile(r'^#\s+\S'),
+    re.compile(r'^(?:section|chapter|part|appendix)\s+[0-9A-Z]+\b', re.IGNORECASE),
+    re.compile(r'^\d+\.?\s+[A-Z]'),
+    re.compile(r'^[A-Z][A-Z0-9 ,/&()\-]{3,}$'),
+)
+
+
+def is_heading(line):
+    """Whether a line looks like a section heading."""
+    line = line.strip()
+    if not line or len(line) > _MAX_HEADING_CHARS or line.endswith((',', ';')):
+        return False
+    return any(pattern.match(line) for pattern in _HEADING_PATTERNS)
+
+
+def is_top_level_heading(line):
+    """Whether a heading line opens a top-level section rather than a subsection."""
+    line = line.strip()
+    return is_heading(line) and any(pattern.match(line) for pattern in _TOP_LEVEL_PATTERNS)
+
+
+def split_sections(text):
+    """
+    Split text into (title, body) sections. Text before the first heading
+    becomes a section with an empty title.
+    """
+    sections = []
+    title, lines = '', []
+    for line in (text or '').splitlines():
+        if is_heading(line):
+            if title or any(existing.strip() for existing in lines):
+                sections.append((title, '\n'.join(lines).strip()))
+            title, lines = line.strip(), []
+        else:
+            lines.append(line)
+    if title or any(existing.strip() for existing in lines):
+        sections.append((title, '\n'.join(lines).strip()))
+    return sections
+
+
+def _section_text(title, body):
+    return f"{title}\n{body}".strip() if title else body
+
+
+def _split_oversized(text, max_chars):
+    """Split one section on paragraph, then line boundaries, then hard cuts."""
+    pieces = []
+    for separator in ('\n\n', '\n'):
+        parts = text.split(separator)
+        if len(parts) > 1:
+            current = ''
+            for part in parts:
+                candidate = f"{current}{separator}{part}" if current else part
+                if len(candidate) <= max_chars:
+                    current = candidate
+                    continue
+                if current:
+                    pieces.append(current)
+                current = part
+            if current:
+                pieces.append(current)
+            break
+    else:
+        pieces = [text]
+
+    chunks = []
+    for piece in pieces:
+        if len(piece) <= max_chars:
+            chunks.append(piece)
+        elif piece is text:
+            chunks.extend(text[start:start + max_chars] for start in range(0, len(text), max_chars))
+        else:
+            chunks.extend(_split_oversized(piece, max_chars))
+    return chunks
+
+
+def chunk_text(text, max_chars, stable=False):
+    """
+    Pack consecutive sections of text into chunks of at most max_chars
+    characters (a section that is larger on its own is split further).
+    With stable, chunks never span top-level sections.
+    """
+    chunks = []
+    current = ''
+    for title, body in split_sections(text):
+        section = _section_text(title, body)
+        if stable and current and is_top_level_heading(title):
+            chunks.append(current)
+            current = ''
+        if len(section) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.extend(_split_oversized(section, max_chars))
+            continue
+        candidate = f"{current}\n\n{section}" if current else section
+        if len(candidate) <= max_chars:
+            current = candidate
+        else:
+            chunks.append(current)
+            current = section
+    if current:
+        chunks.append(current)
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
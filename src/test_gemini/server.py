@@ -0,0 +1,105 @@
+"""
+Production server: the API under gunicorn with several worker processes.
+
+The app is loaded once in the gunicorn master before the workers fork
+(preload), so crewai and test_gemini.crew are imported a single time and
+shared copy-on-write instead of once per worker. Crews are not built
+before the fork: their LLM clients and HTTP connection pools must not be
+shared between processes, so each worker pre-warms its own crew pool
+after the fork (post_fork).
+Workers use threads (gthread) because runs and SSE streams hold a request
+open for minutes. On SIGTERM each worker stops accepting connections,
+finishes its in-flight requests and running jobs within
+SERVER_GRACEFUL_TIMEOUT seconds and cancels the jobs still queued.
+
+    serve                       # or: python -m test_gemini.main serve
+"""
+import logging
+import multiprocessing
+import os
+
+from test_gemini.settings import env_bool, env_int, state_path
+
+logger = logging.getLogger(__name__)
+
+
+def server_options():
+    """gunicorn settings from the environment."""
+    return {
+        'bind': f"{os.environ.get('HOST', '0.0.0.0')}:{env_int('PORT', 5067)}",
+        'workers': max(1, env_int('SERVER_WORKERS', min(4, multiprocessing.cpu_count()))),
+        'worker_class': 'gthread',
+        'threads': max(1, env_int('SERVER_THREADS', 16)),
+        'timeout': env_int('SERVER_TIMEOUT', 120),
+        'graceful_timeout': env_int('SERVER_GRACEFUL_TIMEOUT', 300),
+        'keepalive': env_int('SERVER_KEEPALIVE', 5),
+        'preload_app': env_bool('SERVER_PRELOAD', True),
+        'accesslog': os.environ.get('SERVER_ACCESS_LOG') or None,
+        'on_starting': on_starting,
+        'post_fork': post_fork,
+        'worker_exit': worker_exit,
+    }
+
+
+def on_starting(server):
+    logger.info(f"Starting {server.cfg.workers} workers with {server.cfg.threads} threads each")
+
+
+def post_fork(server, worker):
+    """Build the worker's own crews (and their LLM clients) before it takes traffic."""
+    from test_gemini.main import prewarm_crews
+
+    prewarm_crews()
+    logger.info(f"Worker {worker.pid} ready")
+
+
+def worker_exit(server, worker):
+    """Graceful drain of the worker's background jobs."""
+    from test_gemini.jobs import get_job_manager
+    from test_gemini.metrics import get_metrics
+
+    cancelled = get_job_manager().drain(timeout=server.cfg.graceful_timeout)
+    # Keep the worker's counters in the shared metrics, minus its gauges
+    get_metrics().flush(drop_gauges=True)
+    logger.info(f"Worker {worker.pid} drained ({cancelled} queued jobs cancelled)")
+
+
+def load_app():
+    """
+    Import the crew modules and build the app (in the master when
+    preloading); crews are built per worker in post_fork.
+    """
+    # create_app() defers these imports to the first crew; load them here
+    # so that preloading shares them with the workers
+    import test_gemini.crew  # noqa: F401 (pulls in crewai)
+    from test_gemini.main import create_app
+
+    return create_app()
+
+
+def serve():
+    """Run the API under gunicorn (pip install gunicorn)."""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise Exception("Production serve mode needs gunicorn: pip install 'test_gemini[server]'")
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for name, value in server_options().items():
+                if value is not None:
+                    self.cfg.set(name, value)
+
+        def load(self):
+            return load_app()
+
+    # Workers share their metrics through snapshots in METRICS_DIR; start
+    # from an empty directory so a previous server's workers are not counted
+    metrics_dir = os.environ.setdefault('METRICS_DIR', state_path('metrics'))
+    os.makedirs(metrics_dir, exist_ok=True)
+    for name in os.listdir(metrics_dir):
+        if name.endswith('.json'):
+            os.remove(os.path.join(metrics_dir, name))
+
+    Application().run()
+
@@ -0,0 +1,54 @@
+"""
+Environment-driven settings for the TestGemini API server.
+
+Every knob is read from an environment variable so the same build can be
+tuned per deployment (the same way PORT is handled in main.run()).
+"""
+import os
+
+
+def env_int(name: str, default: int) -> int:
+    """Read an integer setting, falling back to default when unset or invalid."""
+    value = os.environ.get(name)
+    if value is None or value.strip() == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    """Read a float setting, falling back to default when unset or invalid."""
+    value = os.environ.get(name)
+    if value is None or value.strip() == '':
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return default
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    """Read a boolean setting ('1', 'true', 'yes', 'on' are truthy)."""
+    value = os.environ.get(name)
+    if value is None or value.strip() == '':
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def is_truthy(value) -> bool:
+    """Interpret a request flag coming from JSON, form data or a query string."""
+    if isinstance(value, bool):
+        return value
+    if value is None:
+        return False
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def state_path(*parts: str) -> str:
+    """
+    Path under the server's working-state directory (TEST_GEMINI_STATE_DIR,
+    default '.crew_state'), where caches and stored artifacts live.
+    """
+    return os.path.join(os.environ.get('TEST_GEMINI_STATE_DIR', '.crew_state'), *parts)
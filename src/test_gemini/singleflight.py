@@ -0,0 +1,195 @@
+"""
+Single-flight coalescing of identical runs in flight.
+
+The frontend and CI often start the same run at nearly the same moment.
+run_crew_pipeline and the per-agent run_* functions are wrapped with
+single_flight(kind). Calls with the same normalized arguments (keyed like
+the stage cache, so the crew config and the model are part of the key)
+attach to the execution already in flight in the process. They wait for
+it and receive its result and a copy of its meta, marked "coalesced".
+Calls from other worker processes cannot share the result in memory.
+Instead they queue behind the running execution on a lock file under
+SINGLE_FLIGHT_DIR, and then usually get the result it just cached.
+
+Streamed calls are not coalesced, because each stream needs its own
+progress events.
+"""
+import copy
+import fcntl
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from test_gemini.cache import get_stage_cache
+from test_gemini.metrics import get_metrics
+from test_gemini.settings import env_bool, state_path
+from test_gemini.streaming import current_stream
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """One execution in flight and the callers attached to it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.followers = 0
+        self.outcome = None
+        self.meta = None
+        self.error = None
+
+
+class SingleFlight:
+    """In-flight executions by key, shared by the threads of the process and, through lock files, other processes."""
+
+    def __init__(self, directory=None, shared=True):
+        self.directory = directory
+        self.shared = shared and bool(directory)
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._last_gc = 0.0
+        if self.shared:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def run(self, kind, key, function, meta=None):
+        """
+        function(meta) -> outcome, executed once per key at a time. A caller
+        that finds key in flight waits and gets the same outcome; its meta
+        receives a copy of the executing call's meta.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.followers += 1
+
+        if not leader:
+            self._count(kind, 'attached')
+            logger.info(f"Coalesced a {kind} call with the identical one in flight")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            if meta is not None:
+                meta.update(copy.deepcopy(flight.meta))
+                meta['coalesced'] = True
+            return flight.outcome
+
+        own_meta = {}
+        try:
+            with self._process_lock(kind, key):
+                flight.outcome = function(own_meta)
+            return flight.outcome
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            flight.meta = own_meta
+            if meta is not None:
+                meta.update(own_meta)
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    @contextmanager
+    def _process_lock(self, kind, key):
+        """Exclusive lock on key across the processes sharing the directory (a no-op when not shared)."""
+        if not self.shared:
+            yield
+            return
+        self._maybe_gc()
+        with open(os.path.join(self.directory, f"{key}.lock"), 'a') as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._count(kind, 'queued')
+                logger.info(f"Waiting for the identical {kind} call running in another worker")
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _maybe_gc(self, max_age=24 * 3600):
+        """Delete lock files unused for a day (at most once an hour)."""
+        now = time.time()
+        with self._lock:
+            if now - self._last_gc < 3600:
+                return
+            self._last_gc = now
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if not name.endswith('.lock') or now - os.path.getmtime(path) < max_age:
+                    continue
+                with open(path, 'a') as handle:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    os.remove(path)
+            except (OSError, BlockingIOError):
+                continue
+
+    def _count(self, kind, outcome):
+        with self._lock:
+            counters = self._counters.setdefault(kind, {})
+            counters[outcome] = counters.get(outcome, 0) + 1
+        get_metrics().inc('coalesced_calls_total', kind=kind, outcome=outcome)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "waiting": sum(flight.followers for flight in self._flights.values()),
+                "coalesced": {kind: dict(counters) for kind, counters in self._counters.items()},
+                "shared": self.shared
+            }
+
+
+def single_flight(kind):
+    """
+    Decorator coalescing concurrent calls of a run_* function with the same
+    arguments (see SingleFlight). The meta out-parameter is not part of the
+    key. SINGLE_FLIGHT=false turns coalescing off.
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not env_bool('SINGLE_FLIGHT', True) or current_stream() is not None:
+                return function(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            meta = arguments.pop('meta', None)
+            arguments['current_year'] = arguments.get('current_year') or str(datetime.now().year)
+            key = get_stage_cache().key(f"single-flight:{kind}", arguments)
+
+            def execute(own_meta):
+                return function(**dict(bound.arguments, meta=own_meta))
+
+            return get_single_flight().run(kind, key, execute, meta)
+        return wrapper
+    return decorator
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """Return the process-wide SingleFlight configured from the environment."""
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight(
+                directory=os.environ.get('SINGLE_FLIGHT_DIR') or state_path('single_flight'),
+                shared=env_bool('SINGLE_FLIGHT_SHARED', True)
+            )
+        return _single_flight
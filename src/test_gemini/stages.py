@@ -0,0 +1,221 @@
+"""
+Stage graph and stage artifact store.
+
+The three agents form a DAG: requirements -> test-design ->
+test-implementation. Every stage output is stored as an artifact under a
+run (session) ID, so a downstream stage can be run on its own against an
+upstream artifact instead of re-deriving it, and several downstream
+attempts can fan out from one upstream result.
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from test_gemini.crew_pool import get_crew_pool
+from test_gemini.metrics import get_metrics
+from test_gemini.settings import env_int, state_path
+from test_gemini.streaming import llm_streaming, publish, stage_context
+
+logger = logging.getLogger(__name__)
+
+# stage -> task index in TestGemini.crew().tasks (and of its agent, named as
+# in agents.yaml) and the stage it consumes
+STAGE_GRAPH = {
+    'requirements': {'task_index': 0, 'agent': 'requirements_engineer', 'upstream': None},
+    'test-design': {'task_index': 1, 'agent': 'test_case_designer', 'upstream': 'requirements'},
+    'test-implementation': {'task_index': 2, 'agent': 'test_script_developer', 'upstream': 'test-design'},
+}
+
+_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class ArtifactNotFound(Exception):
+    """Raised when a referenced run or stage artifact does not exist."""
+
+
+def upstream_of(stage):
+    return STAGE_GRAPH[stage]['upstream']
+
+
+def execute_stage(stage, inputs, context=None, tools=None):
+    """
+    Execute a single stage's task with its agent on a pooled crew.
+
+    context is the upstream stage output (what crewai would pass between
+    sequential tasks) or the source document; inputs fill the YAML
+    templates. tools are added to the agent's own tools (e.g. the prior
+    artifact search) for this execution.
+    """
+    index = STAGE_GRAPH[stage]['task_index']
+    pool = get_crew_pool()
+    with pool.checkout() as crew:
+        agent = crew.agents[index]
+        task = crew.tasks[index]
+        if tools:
+            names = {tool.name for tool in tools}
+            tools = list(tools) + [tool for tool in agent.tools or [] if tool.name not in names]
+
+        # Pooled agents/tasks keep the previous run's interpolation, so always
+        # re-render role, goal, backstory and description for this run
+        agent.interpolate_inputs(inputs)
+        task.interpolate_inputs_and_add_conversation_history(inputs)
+
+        metrics = get_metrics()
+        publish('task_started', stage=stage)
+        started = time.perf_counter()
+        try:
+            with stage_context(stage), llm_streaming([agent]), metrics.llm_usage([(STAGE_GRAPH[stage]['agent'], agent)]):
+                output = str(agent.execute_task(task, context=context, tools=tools))
+        finally:
+            seconds = time.perf_counter() - started
+            pool.record_execution(stage, seconds)
+            metrics.observe('stage_duration_seconds', seconds, stage=stage)
+        publish('task_completed', stage=stage, seconds=round(seconds, 3))
+        return output
+
+
+class StageArtifactStore:
+    """
+    Stage outputs on disk, one directory per run:
+    <directory>/<run_id>/<stage>--<artifact_id>.json
+    """
+
+    def __init__(self, directory, ttl_seconds=7 * 24 * 3600):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self._last_gc = 0.0
+        self._gc_lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def valid_id(value):
+        return bool(value) and bool(_ID_PATTERN.match(value))
+
+    def save(self, run_id, stage, content, topic=None, upstream_artifact_id=None, document_id=None):
+        """Store a stage output and return its artifact record."""
+        if stage not in STAGE_GRAPH:
+            raise ValueError(f"Unknown stage: {stage}")
+        if not self.valid_id(run_id):
+            raise ValueError(f"Invalid run ID: {run_id}")
+
+        record = {
+            "artifact_id": self.new_id(),
+            "run_id": run_id,
+            "stage": stage,
+            "topic": topic,
+            "upstream_artifact_id": upstream_artifact_id,
+            "document_id": document_id,
+            "created_at": datetime.now().isoformat(),
+            "content": content
+        }
+        run_dir = os.path.join(self.directory, run_id)
+        os.makedirs(run_dir, exist_ok=True)
+        path = os.path.join(run_dir, f"{stage}--{record['artifact_id']}.json")
+        fd, tmp_path = tempfile.mkstemp(dir=run_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as handle:
+            json.dump(record, handle)
+        os.replace(tmp_path, path)
+
+        self._maybe_gc()
+        return record
+
+    def list(self, run_id):
+        """Artifact records of a run (without content), oldest first."""
+        records = [self._summary(record) for record in self._records(run_id)]
+        records.sort(key=lambda record: record['created_at'])
+        return records
+
+    def get(self, run_id, artifact_id=None, stage=None):
+        """
+        Fetch an artifact by ID, or the latest artifact of a stage in the run.
+        """
+        candidates = []
+        for record in self._records(run_id):
+            if artifact_id and record['artifact_id'] != artifact_id:
+                continue
+            if stage and record['stage'] != stage:
+                continue
+            candidates.append(record)
+        if not candidates:
+            wanted = f"artifact {artifact_id}" if artifact_id else f"{stage} artifact"
+            raise ArtifactNotFound(f"No {wanted} in run {run_id}")
+        return max(candidates, key=lambda record: record['created_at'])
+
+    def topic_of(self, run_id):
+        """The topic the run was started with, if any artifact recorded one."""
+        for record in sorted(self._records(run_id), key=lambda record: record['created_at']):
+            if record.get('topic'):
+                return record['topic']
+        return None
+
+    def document_of(self, run_id):
+        """The registered document the run works on, if any."""
+        for record in sorted(self._records(run_id), key=lambda record: record['created_at']):
+            if record.get('document_id'):
+                return record['document_id']
+        return None
+
+    def _records(self, run_id):
+        if not self.valid_id(run_id):
+            raise ArtifactNotFound(f"Invalid run ID: {run_id}")
+        run_dir = os.path.join(self.directory, run_id)
+        if not os.path.isdir(run_dir):
+            raise ArtifactNotFound(f"Run not found: {run_id}")
+        for name in os.listdir(run_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(run_dir, name), 'r', encoding='utf-8') as handle:
+                    yield json.load(handle)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable artifact {name} in run {run_id}: {str(e)}")
+
+    @staticmethod
+    def _summary(record):
+        summary = {key: value for key, value in record.items() if key != 'content'}
+        summary['size'] = len(record.get('content') or '')
+        return summary
+
+    def _maybe_gc(self):
+        """Delete runs untouched for longer than the TTL (at most once a minute)."""
+        if not self.ttl_seconds:
+            return
+        now = time.time()
+        with self._gc_lock:
+            if now - self._last_gc < 60:
+                return
+            self._last_gc = now
+        for name in os.listdir(self.directory):
+            run_dir = os.path.join(self.directory, name)
+            try:
+                if os.path.isdir(run_dir) and now - os.path.getmtime(run_dir) > self.ttl_seconds:
+                    shutil.rmtree(run_dir, ignore_errors=True)
+            except FileNotFoundError:
+                continue
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_stage_store():
+    """Return the process-wide StageArtifactStore configured from the environment."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = StageArtifactStore(
+                directory=os.environ.get('STAGE_STORE_DIR') or state_path('stage_runs'),
+                ttl_seconds=env_int('STAGE_STORE_TTL', 7 * 24 * 3600)
+            )
+        return _store
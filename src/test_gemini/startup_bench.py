@@ -0,0 +1,174 @@
+"""
+Cold-start benchmark for the console-script entry points.
+
+Each entry point's target is imported the way its console script does it
+(`from module import function`) in fresh interpreters run with
+`-X importtime`. The report gives, per entry point, the median wall time
+and import time over several runs, the packages that cost the most (self
+time summed per top-level package) and whether crewai, Flask and PyPDF2 got
+loaded. Save a report and pass it back as --baseline to fail on regressions:
+
+    startup_bench > startup_baseline.json
+    startup_bench --baseline startup_baseline.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# console script -> target; used when the package metadata is not installed
+ENTRY_POINTS = {
+    'test_gemini': 'test_gemini.main:run',
+    'run_crew': 'test_gemini.main:run',
+    'serve': 'test_gemini.server:serve',
+    'train': 'test_gemini.cli:train',
+    'replay': 'test_gemini.cli:replay',
+    'test': 'test_gemini.cli:test',
+    'prompt_tokens': 'test_gemini.prompt_budget:main',
+}
+
+HEAVY_PACKAGES = ('crewai', 'litellm', 'flask', 'PyPDF2')
+
+# Absolute slack on top of --tolerance so sub-millisecond noise never fails a run
+REGRESSION_SLACK_MS = 25.0
+
+
+def entry_points():
+    """The package's console scripts from its installed metadata, else ENTRY_POINTS."""
+    try:
+        from importlib.metadata import entry_points as installed
+        scripts = {
+            entry.name: entry.value for entry in installed(group='console_scripts')
+            if entry.value.startswith('test_gemini.')
+        }
+    except Exception:
+        scripts = {}
+    return scripts or dict(ENTRY_POINTS)
+
+
+def parse_importtime(stderr):
+    """(module, self_us, cumulative_us, depth) for each line of -X importtime output."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            head, cumulative_us, name = line.split('|', 2)
+            self_us = int(head.split(':', 1)[1])
+            cumulative_us = int(cumulative_us)
+        except ValueError:
+            continue
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        modules.append((name.strip(), self_us, cumulative_us, depth))
+    return modules
+
+
+def measure_target(target, runs=5):
+    """Import target in `runs` fresh interpreters (after one warm-up for bytecode caches)."""
+    module, _, attribute = target.partition(':')
+    code = f"from {module} import {attribute}" if attribute else f"import {module}"
+    env = dict(os.environ, PYTHONWARNINGS='ignore')
+
+    walls, imports, modules = [], [], []
+    for attempt in range(runs + 1):
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            capture_output=True, text=True, env=env
+        )
+        wall = time.perf_counter() - started
+        if completed.returncode != 0:
+            raise RuntimeError(f"Importing {target} failed: {completed.stderr.strip().splitlines()[-1:]}")
+        if attempt == 0:
+            continue
+        modules = parse_importtime(completed.stderr)
+        walls.append(wall * 1000)
+        imports.append(sum(cumulative for _, _, cumulative, depth in modules if depth == 0) / 1000)
+    return walls, imports, modules
+
+
+def package_breakdown(modules, top=10):
+    """Self import time summed per top-level package, most expensive first."""
+    totals = {}
+    for name, self_us, _, _ in modules:
+        package = name.split('.')[0]
+        totals[package] = totals.get(package, 0) + self_us
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [{"package": package, "self_ms": round(micros / 1000, 1)} for package, micros in ranked]
+
+
+def benchmark(names=None, runs=5, top=10):
+    """Report for the selected console scripts (all of them by default)."""
+    scripts = entry_points()
+    selected = {name: scripts[name] for name in (names or scripts) if name in scripts}
+    unknown = sorted(set(names or ()) - set(selected))
+    if unknown:
+        raise ValueError(f"Unknown entry points: {', '.join(unknown)} (known: {', '.join(sorted(scripts))})")
+
+    results, measured = {}, {}
+    for name, target in selected.items():
+        if target not in measured:
+            measured[target] = measure_target(target, runs)
+        walls, imports, modules = measured[target]
+        loaded = {module for module, _, _, _ in modules}
+        results[name] = {
+            "target": target,
+            "wall_ms": round(statistics.median(walls), 1),
+            "import_ms": round(statistics.median(imports), 1),
+            "modules": len(modules),
+            "loads": {package: package in loaded for package in HEAVY_PACKAGES},
+            "packages": package_breakdown(modules, top)
+        }
+    return {
+        "python": sys.version.split()[0],
+        "runs": runs,
+        "entry_points": results
+    }
+
+
+def regressions(report, baseline, tolerance=0.2):
+    """Entry points whose median import time grew beyond tolerance (plus slack) over baseline."""
+    found = []
+    for name, result in report['entry_points'].items():
+        previous = baseline.get('entry_points', {}).get(name)
+        if not previous:
+            continue
+        limit = previous['import_ms'] * (1 + tolerance) + REGRESSION_SLACK_MS
+        if result['import_ms'] > limit:
+            found.append(f"{name}: {result['import_ms']} ms > {round(limit, 1)} ms (baseline {previous['import_ms']} ms)")
+        for package, loaded in result['loads'].items():
+            if loaded and not previous.get('loads', {}).get(package, True):
+                found.append(f"{name}: now imports {package}")
+    return found
+
+
+def main():
+    """
+    Print the startup report as JSON; exit 1 when --baseline shows a regression.
+    Usage: startup_bench [entry_point ...] [--runs N] [--top N] [--baseline report.json] [--tolerance 0.2]
+    """
+    parser = argparse.ArgumentParser(prog='startup_bench', description="Cold-start import time per entry point")
+    parser.add_argument('entry_points', nargs='*', help="console scripts to measure (default: all)")
+    parser.add_argument('--runs', type=int, default=5, help="fresh interpreters per entry point")
+    parser.add_argument('--top', type=int, default=10, help="packages listed per entry point")
+    parser.add_argument('--baseline', help="earlier report to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative import-time growth")
+    args = parser.parse_args()
+
+    try:
+        report = benchmark(args.entry_points, runs=max(1, args.runs), top=args.top)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as handle:
+            report['regressions'] = regressions(report, json.load(handle), args.tolerance)
+    print(json.dumps(report, indent=2))
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Small on-disk key/value store used by the caches.
+
+Values are JSON documents written atomically into a two-level sharded
+directory, optionally zlib-compressed. The store is bounded by total size
+and by age; eviction removes the least recently used files first (reads
+refresh a file's mtime).
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+class DiskStore:
+    """Size- and TTL-bounded JSON file store safe for concurrent writers."""
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, ttl_seconds=None, evict_interval=60.0, compress=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.evict_interval = evict_interval
+        self.compress = compress
+        self.suffix = '.json.z' if compress else '.json'
+        self._lock = threading.Lock()
+        self._last_evict = 0.0
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def valid_key(key):
+        """Keys are hashes or IDs; anything else could name a path outside the store."""
+        return isinstance(key, str) and bool(key) and key.replace('-', '').replace('_', '').isalnum()
+
+    def path_for(self, key):
+        if not self.valid_key(key):
+            raise ValueError(f"Invalid store key: {key!r}")
+        return os.path.join(self.directory, key[:2], f"{key}{self.suffix}")
+
+    def get(self, key):
+        """Return the stored value, or None when missing, expired or not a valid key."""
+        if not self.valid_key(key):
+            return None
+        path = self.path_for(key)
+        try:
+            if self.ttl_seconds and time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                self._remove(path)
+                return None
+            with open(path, 'rb') as handle:
+                data = handle.read()
+            value = json.loads(zlib.decompress(data) if self.compress else data)
+            os.utime(path, None)
+            return value
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, zlib.error) as e:
+            logger.warning(f"Dropping unreadable cache entry {path}: {str(e)}")
+            self._remove(path)
+            return None
+
+    def put(self, key, value):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            data = json.dumps(value).encode('utf-8')
+            with os.fdopen(fd, 'wb') as handle:
+                handle.write(zlib.compress(data, 6) if self.compress else data)
+            os.replace(tmp_path, path)
+        except Exception:
+            self._remove(tmp_path)
+            raise
+        self.maybe_evict()
+
+    def delete(self, key):
+        if self.valid_key(key):
+            self._remove(self.path_for(key))
+
+    def clear(self):
+        for path, _, _ in self._entries():
+            self._remove(path)
+
+    def size_bytes(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def maybe_evict(self):
+        """Run eviction at most once per evict_interval seconds."""
+        now = time.time()
+        with self._lock:
+            if now - self._last_evict < self.evict_interval:
+                return
+            self._last_evict = now
+        self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used until under max_bytes."""
+        now = time.time()
+        entries = []
+        total = 0
+        for path, size, mtime in self._entries():
+            if self.ttl_seconds and now - mtime > self.ttl_seconds:
+                self._remove(path)
+                continue
+            entries.append((mtime, size, path))
+            total += size
+
+        removed = 0
+        if self.max_bytes and total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+                removed += 1
+        if removed:
+            logger.info(f"Evicted {removed} entries from {self.directory}")
+
+    def _entries(self):
+        try:
+            shards = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for shard in shards:
+            shard_path = os.path.join(self.directory, shard)
+            if not os.path.isdir(shard_path):
+                continue
+            for name in os.listdir(shard_path):
+                if not name.endswith(self.suffix):
+                    continue
+                path = os.path.join(shard_path, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
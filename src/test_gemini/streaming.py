@@ -0,0 +1,241 @@
+"""
+Server-Sent Events for pipeline and agent runs.
+
+A RunEventStream is a queue of events for one run. The thread executing the
+run binds the stream (bind_stream); everything that happens on that thread
+is then published to it: task start/finish and stage outputs from our own
+stage code, agent steps through the agents' step_callback, and crewai event
+bus events (task lifecycle during Crew.kickoff, incremental LLM tokens when
+the model streams). Threads that run without a bound stream publish nothing.
+
+Independently of a stream, a thread can bind a chunk listener
+(bind_chunk_listener) that reads the tokens of its LLM calls as they
+arrive, for example to hand completed sections of an output downstream
+before the output is complete (see pipelining.py).
+"""
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from test_gemini.settings import env_bool, env_float
+
+logger = logging.getLogger(__name__)
+
+# crewai task name -> stage (see STAGE_GRAPH)
+TASK_STAGES = {
+    'requirements_analysis_task': 'requirements',
+    'test_case_design_task': 'test-design',
+    'test_script_implementation_task': 'test-implementation',
+}
+
+_CLOSED = object()
+_local = threading.local()
+
+
+class RunEventStream:
+    """Events of one run, consumed as an SSE response."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self.closed = False
+
+    def publish(self, event, **data):
+        if self.closed:
+            return
+        data.setdefault('ts', round(time.time(), 3))
+        self._queue.put((next(self._ids), event, data))
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._queue.put(_CLOSED)
+
+    def sse(self, finished=None, heartbeat=None):
+        """
+        Yield the events as SSE frames until the stream is closed. finished()
+        lets the consumer stop when the producer ended without closing (for
+        example a job cancelled before it ran).
+        """
+        heartbeat = heartbeat or env_float('STREAM_HEARTBEAT_SECONDS', 15.0)
+        while True:
+            try:
+                item = self._queue.get(timeout=heartbeat)
+            except queue.Empty:
+                if finished is not None and finished():
+                    yield format_sse('end', {"reason": "run finished without a result"})
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            if item is _CLOSED:
+                return
+            event_id, event, data = item
+            yield format_sse(event, data, event_id)
+
+
+def format_sse(event, data, event_id=None):
+    frame = f"id: {event_id}\n" if event_id is not None else ""
+    return frame + f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def current_stream():
+    return getattr(_local, 'stream', None)
+
+
+def current_stage():
+    return getattr(_local, 'stage', None)
+
+
+@contextmanager
+def bind_stream(stream):
+    """Publish what happens on this thread to stream for the duration."""
+    previous, previous_stage = current_stream(), current_stage()
+    _local.stream = stream
+    if stream is not None:
+        install_event_handlers()
+    try:
+        yield stream
+    finally:
+        _local.stream, _local.stage = previous, previous_stage
+
+
+def current_chunk_listener():
+    return getattr(_local, 'chunk_listener', None)
+
+
+@contextmanager
+def bind_chunk_listener(listener):
+    """
+    Feed the LLM tokens streamed on this thread to listener.feed(chunk) for
+    the duration, calling listener.restart() at the start of every LLM call.
+    The agents' LLMs stream while a listener is bound (see llm_streaming).
+    """
+    previous = current_chunk_listener()
+    _local.chunk_listener = listener
+    install_event_handlers()
+    try:
+        yield listener
+    finally:
+        _local.chunk_listener = previous
+
+
+@contextmanager
+def stage_context(stage):
+    """Attribute agent steps and tokens on this thread to stage."""
+    previous = current_stage()
+    _local.stage = stage
+    try:
+        yield
+    finally:
+        _local.stage = previous
+
+
+def publish(event, **data):
+    """Publish to the stream bound to this thread, if any."""
+    stream = current_stream()
+    if stream is not None:
+        stream.publish(event, **data)
+
+
+@contextmanager
+def llm_streaming(agents):
+    """
+    While a stream or a chunk listener is bound, have the agents' LLMs
+    stream tokens (set LLM_STREAM=false for models that cannot). Pooled
+    crews are checked out exclusively, so toggling their LLMs for one
+    execution is safe.
+    """
+    if (current_stream() is None and current_chunk_listener() is None) or not env_bool('LLM_STREAM', True):
+        yield
+        return
+    toggled = []
+    for agent in agents:
+        llm = getattr(agent, 'llm', None)
+        if llm is not None and hasattr(llm, 'stream') and not llm.stream:
+            llm.stream = True
+            toggled.append(llm)
+    try:
+        yield
+    finally:
+        for llm in toggled:
+            llm.stream = False
+
+
+def _truncate(value, limit=2000):
+    text = str(value) if value is not None else None
+    if text and len(text) > limit:
+        return text[:limit] + '...'
+    return text
+
+
+def report_step(step):
+    """Agent step_callback: publish each reasoning/tool step of the agent."""
+    if current_stream() is None:
+        return
+    publish(
+        'agent_step',
+        stage=current_stage(),
+        step_type=type(step).__name__,
+        thought=_truncate(getattr(step, 'thought', None)),
+        tool=getattr(step, 'tool', None),
+        tool_input=_truncate(getattr(step, 'tool_input', None)),
+        result=_truncate(getattr(step, 'result', None) or getattr(step, 'output', None))
+    )
+
+
+_handlers_installed = False
+_handlers_lock = threading.Lock()
+
+
+def install_event_handlers():
+    """Register the crewai event bus handlers once per process."""
+    global _handlers_installed
+    with _handlers_lock:
+        if _handlers_installed:
+            return
+        _handlers_installed = True
+
+    from crewai.utilities.events import crewai_event_bus
+    from crewai.utilities.events.llm_events import LLMCallStartedEvent, LLMStreamChunkEvent
+    from crewai.utilities.events.task_events import TaskCompletedEvent, TaskFailedEvent, TaskStartedEvent
+
+    def task_stage(event):
+        return TASK_STAGES.get(getattr(getattr(event, 'task', None), 'name', None))
+
+    @crewai_event_bus.on(LLMStreamChunkEvent)
+    def on_token(source, event):
+        publish('token', stage=current_stage(), chunk=event.chunk)
+        listener = current_chunk_listener()
+        if listener is not None:
+            listener.feed(event.chunk)
+
+    @crewai_event_bus.on(LLMCallStartedEvent)
+    def on_llm_call_started(source, event):
+        listener = current_chunk_listener()
+        if listener is not None:
+            listener.restart()
+
+    # Task lifecycle during Crew.kickoff (single stages publish their own)
+    @crewai_event_bus.on(TaskStartedEvent)
+    def on_task_started(source, event):
+        if current_stream() is None:
+            return
+        stage = task_stage(event)
+        _local.stage = stage
+        publish('task_started', stage=stage)
+
+    @crewai_event_bus.on(TaskCompletedEvent)
+    def on_task_completed(source, event):
+        if current_stream() is None:
+            return
+        stage = task_stage(event)
+        publish('task_completed', stage=stage)
+        publish('stage_output', stage=stage, content=str(getattr(event.output, 'raw', event.output)))
+
+    @crewai_event_bus.on(TaskFailedEvent)
+    def on_task_failed(source, event):
+        publish('task_failed', stage=task_stage(event), error=str(event.error))
@@ -1,19 +1,107 @@
+import re
+from typing import List, Optional, Tuple, Type
+
 from crewai.tools import BaseTool
-from typing import Type
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
+
+from test_gemini.sections import split_sections
+
+
+class DocumentSearchToolInput(BaseModel):
+    """Input schema for DocumentSearchTool."""
+    query: str = Field(..., description="Words or a phrase to look up in the specification document.")
+
+
+class DocumentSearchTool(BaseTool):
+    name: str = "Search specification document"
+    description: str = (
+        "Look up the sections of the source specification document that mention the given words. "
+        "Use it to check exact values, limits, interfaces and wording instead of guessing."
+    )
+    args_schema: Type[BaseModel] = DocumentSearchToolInput
+    document: str = Field(default='', exclude=True)
+    max_sections: int = 3
+    max_chars: int = 4000
+    _sections: List[Tuple[str, str]] = PrivateAttr(default_factory=list)
 
+    def model_post_init(self, __context):
+        super().model_post_init(__context)
+        self._sections = [
+            (title, body) for title, body in split_sections(self.document) if title or body
+        ]
 
-class MyCustomToolInput(BaseModel):
-    """Input schema for MyCustomTool."""
-    argument: str = Field(..., description="Description of the argument.")
+    def _run(self, query: str) -> str:
+        terms = set(re.findall(r'\w+', query.lower()))
+        if not terms:
+            return "Provide one or more words to search for."
 
-class MyCustomTool(BaseTool):
-    name: str = "Name of my tool"
+        scored = []
+        for position, (title, body) in enumerate(self._sections):
+            words = re.findall(r'\w+', f"{title} {body}".lower())
+            if not words:
+                continue
+            score = sum(1 for word in words if word in terms) / len(words) ** 0.5
+            score += 2 * sum(1 for term in terms if term in title.lower())
+            if score:
+                scored.append((score, position))
+        if not scored:
+            return f"No section of the document mentions: {query}"
+
+        results = []
+        budget = self.max_chars
+        for _, position in sorted(scored, reverse=True)[:self.max_sections]:
+            title, body = self._sections[position]
+            text = f"{title}\n{body}".strip() if title else body
+            results.append(text[:budget])
+            budget -= len(results[-1])
+            if budget <= 0:
+                break
+        return "\n\n---\n\n".join(results)
+
+
+class PriorArtifactSearchToolInput(BaseModel):
+    """Input schema for PriorArtifactSearchTool."""
+    query: str = Field(..., description="What to look for, e.g. a component, interface, behaviour or class name.")
+    kind: Optional[str] = Field(
+        default=None,
+        description="Only this kind of artifact: 'requirement', 'test_case' or 'fixture' (C++ mocks and fixtures)."
+    )
+
+
+class PriorArtifactSearchTool(BaseTool):
+    name: str = "Search prior test artifacts"
     description: str = (
-        "Clear description for what this tool is useful for, your agent will need this information to use it."
+        "Find the most similar requirements, test cases and C++ mocks/fixtures generated for earlier components. "
+        "Use it to reuse proven wording, test structure and fixtures instead of writing them from scratch."
     )
-    args_schema: Type[BaseModel] = MyCustomToolInput
+    args_schema: Type[BaseModel] = PriorArtifactSearchToolInput
+    default_kind: Optional[str] = None
+    top_k: int = 5
+    # The run the tool works for; its own artifacts are never returned
+    exclude_run_id: Optional[str] = None
+    max_chars: int = 6000
+
+    def _run(self, query: str, kind: Optional[str] = None) -> str:
+        from test_gemini.retrieval import KINDS, STAGE_KINDS, get_retrieval_index
+        from test_gemini.streaming import current_stage
+
+        kind = kind or self.default_kind or STAGE_KINDS.get(current_stage())
+        if kind not in KINDS:
+            kind = None
+        index = get_retrieval_index()
+        results = index.search(query, k=self.top_k, kind=kind, exclude_run_id=self.exclude_run_id)
+        if not results and kind:
+            results = index.search(query, k=self.top_k, exclude_run_id=self.exclude_run_id)
+        if not results:
+            return f"No prior artifact matches: {query}"
 
-    def _run(self, argument: str) -> str:
-        # Implementation goes here
-        return "this is an example of a tool output, ignore it and move along."
+        parts = []
+        budget = self.max_chars
+        for score, document in results:
+            origin = f" from '{document['topic']}'" if document.get('topic') else ''
+            text = f"[{document['kind']}{origin}, score {score:.1f}] {document['title']}\n{document['text']}"[:budget]
+            parts.append(text)
+            budget -= len(text)
+            if budget <= 0:
+                break
+        return "\n\n---\n\n".join(parts)